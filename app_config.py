@@ -14,13 +14,42 @@ DEFAULT_EXPORT_PATH = "USER_DESKTOP"
 
 # SQL构建相关配置
 SQL_PREVIEW_LIMIT = 100
-SQL_BUILDER_DUMMY_DB_FOR_AS_STRING = "dbname=dummy user=dummy"
+# 预览采样方式 (见 sql_logic/sampling.py) 与随机种子；相同种子下多次预览得到同一批样本
+PREVIEW_SAMPLING_METHOD = "system"
+PREVIEW_SAMPLING_SEED = 42
+# 专项数据分区并行合并允许的最大分区数 (每个分区占用一个数据库连接)
+MAX_MERGE_PARTITIONS = 16
+# 专项数据特征缓存 (见 sql_logic/feature_cache.py)：缓存所在 schema 与 LRU 淘汰上限
+FEATURE_CACHE_SCHEMA = "feature_store"
+FEATURE_CACHE_MAX_ENTRIES = 200
+FEATURE_CACHE_MAX_BYTES = 20 * 1024 ** 3
+# 参数化相对时间窗口分箱输出 (见 build_binned_feature_sql) 允许的最大分箱数
+MAX_TIME_WINDOW_BINS = 1000
+# 合并执行前的代价护栏 (EXPLAIN 的规划器总代价)：超过警告阈值时提示确认，超过阻止阈值时拒绝执行；设为 None 可关闭
+MERGE_COST_WARN_THRESHOLD = 5e7
+MERGE_COST_BLOCK_THRESHOLD = 5e9
+# 专项数据 SQL 构建结果的记忆化条目上限 (见 sql_logic/build_memo.py)；设为 0 可关闭
+SQL_BUILD_MEMO_MAX_ENTRIES = 64
+
+# 队列表物化 (见 CohortCreationWorker)：以 UNLOGGED 表创建 (不写 WAL)；是否需要普通 (LOGGED) 表。
+# UNLOGGED 队列表在数据库崩溃后被清空、也不会复制到备库，但可以随时按条件重新创建；
+# 需要 LOGGED 表时直接以普通表创建 (事后 SET LOGGED 会重写整表并重建全部索引，代价高于直接创建)。
+# 会话允许的并行查询进程数 (None 表示使用服务器设置)；并行建立索引的连接数上限
+COHORT_CREATE_UNLOGGED = True
+COHORT_SET_LOGGED_AFTER_CREATE = False
+COHORT_PARALLEL_WORKERS = 4
+COHORT_INDEX_CONNECTIONS = 4
+# 编辑筛选条件时的队列规模估计: 防抖间隔 (毫秒)；精确计数的语句超时 (毫秒)，超时后改用规划器估计
+COHORT_ESTIMATE_DEBOUNCE_MS = 600
+COHORT_ESTIMATE_TIMEOUT_MS = 3000
 
 # UI相关的配置
 DEFAULT_MAIN_WINDOW_WIDTH = 950
 DEFAULT_MAIN_WINDOW_HEIGHT = 880
 MIN_CONDITION_GROUP_SCROLL_HEIGHT = 150
 MIN_PANEL_CONDITION_GROUP_SCROLL_HEIGHT = 200
+# 面板配置变更的防抖间隔 (毫秒)：间隔内的连续修改合并为一次列名与按钮状态刷新
+PANEL_CONFIG_DEBOUNCE_MS = 250
 
 # 日志配置
 LOG_FILE_ENABLED = False
@@ -48,30 +77,32 @@ AGGREGATION_METHODS_DISPLAY = [
     ("四分位距 (IQR)", "IQR"),
     ("值域 (Range)", "RANGE"),
     ("原始时间序列 (JSON)", "TIMESERIES_JSON"),
+    ("原始时间序列 (列式数组)", "TIMESERIES_ARRAYS"),
 ]
 
 # 内部键对应的SQL聚合函数模板
 # {val_col} 会被替换为实际的值列名
 # {time_col} 会被替换为实际的时间列名
+# {agg_filter} 紧跟在每个聚合调用之后，单项提取时为空，批量透视模式下为 FILTER (WHERE ...) 子句
 SQL_AGGREGATES = {
-    "MEAN": "AVG({val_col})",
-    "MEDIAN": "PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY {val_col})",
-    "MIN": "MIN({val_col})",
-    "MAX": "MAX({val_col})",
-    "COUNT": "COUNT({val_col})",
-    "SUM": "SUM({val_col})",
-    "STDDEV_SAMP": "STDDEV_SAMP({val_col})",
-    "VAR_SAMP": "VAR_SAMP({val_col})",
-    "CV": "CASE WHEN AVG({val_col}) IS DISTINCT FROM 0 THEN STDDEV_SAMP({val_col}) / AVG({val_col}) ELSE NULL END",
-    "FIRST_VALUE": "(ARRAY_AGG({val_col} ORDER BY {time_col} ASC NULLS LAST))[1]",
-    "LAST_VALUE": "(ARRAY_AGG({val_col} ORDER BY {time_col} DESC NULLS LAST))[1]",
-    "P25": "PERCENTILE_CONT(0.25) WITHIN GROUP (ORDER BY {val_col})",
-    "P75": "PERCENTILE_CONT(0.75) WITHIN GROUP (ORDER BY {val_col})",
-    "IQR": "(PERCENTILE_CONT(0.75) WITHIN GROUP (ORDER BY {val_col})) - (PERCENTILE_CONT(0.25) WITHIN GROUP (ORDER BY {val_col}))",
-    "RANGE": "MAX({val_col}) - MIN({val_col})",
-    "TIMESERIES_JSON": "JSONB_AGG(JSONB_BUILD_OBJECT('time', {time_col}, 'value', {val_col}) ORDER BY {time_col} ASC NULLS LAST)",
+    "MEAN": "AVG({val_col}){agg_filter}",
+    "MEDIAN": "PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY {val_col}){agg_filter}",
+    "MIN": "MIN({val_col}){agg_filter}",
+    "MAX": "MAX({val_col}){agg_filter}",
+    "COUNT": "COUNT({val_col}){agg_filter}",
+    "SUM": "SUM({val_col}){agg_filter}",
+    "STDDEV_SAMP": "STDDEV_SAMP({val_col}){agg_filter}",
+    "VAR_SAMP": "VAR_SAMP({val_col}){agg_filter}",
+    "CV": "CASE WHEN AVG({val_col}){agg_filter} IS DISTINCT FROM 0 THEN STDDEV_SAMP({val_col}){agg_filter} / AVG({val_col}){agg_filter} ELSE NULL END",
+    "FIRST_VALUE": "(ARRAY_AGG({val_col} ORDER BY {time_col} ASC NULLS LAST){agg_filter})[1]",
+    "LAST_VALUE": "(ARRAY_AGG({val_col} ORDER BY {time_col} DESC NULLS LAST){agg_filter})[1]",
+    "P25": "PERCENTILE_CONT(0.25) WITHIN GROUP (ORDER BY {val_col}){agg_filter}",
+    "P75": "PERCENTILE_CONT(0.75) WITHIN GROUP (ORDER BY {val_col}){agg_filter}",
+    "IQR": "(PERCENTILE_CONT(0.75) WITHIN GROUP (ORDER BY {val_col}){agg_filter}) - (PERCENTILE_CONT(0.25) WITHIN GROUP (ORDER BY {val_col}){agg_filter})",
+    "RANGE": "MAX({val_col}){agg_filter} - MIN({val_col}){agg_filter}",
+    "TIMESERIES_JSON": "JSONB_AGG(JSONB_BUILD_OBJECT('time', {time_col}, 'value', {val_col}) ORDER BY {time_col} ASC NULLS LAST){agg_filter}",
     # vvv 仍然在这里定义SQL逻辑，供后台调用 vvv
-    "MED_TIMESERIES_JSON": "JSONB_AGG(JSONB_BUILD_OBJECT('start', {time_col}, 'stop', {stop_col}, 'dose', {val_col}, 'unit', {unit_col}, 'form', {form_col}) ORDER BY {time_col} ASC NULLS LAST)",
+    "MED_TIMESERIES_JSON": "JSONB_AGG(JSONB_BUILD_OBJECT('start', {time_col}, 'stop', {stop_col}, 'dose', {val_col}, 'unit', {unit_col}, 'form', {form_col}) ORDER BY {time_col} ASC NULLS LAST){agg_filter}",
 }
 
 # 内部键对应的SQL结果列类型
@@ -94,4 +125,22 @@ AGGREGATE_RESULT_TYPES = {
     "TIMESERIES_JSON": "JSONB",
     "MED_TIMESERIES_JSON": "JSONB", # <<< 在这里定义类型
 }
+# 列式数组时间序列：一个方法键展开为多个平行的类型化数组列 (同一时间排序，下标一一对应)，
+# 代替逐事件 JSONB_BUILD_OBJECT 的 JSON 输出，客户端解码见 sql_logic/series_arrays.py
+# 每项为 (列名后缀, 取值占位符, 结果类型)；{time_array_type} 由数据库画像提供 (时间戳或整数偏移)
+ARRAY_SERIES_TEMPLATE = "ARRAY_AGG(CAST({src} AS {elem_type}) ORDER BY {time_col} ASC NULLS LAST){agg_filter}"
+ARRAY_SERIES_OUTPUTS = {
+    "TIMESERIES_ARRAYS": [
+        ("ts_time", "time_col", "{time_array_type}"),
+        ("ts_value", "val_col", "DOUBLE PRECISION[]"),
+    ],
+    "MED_TIMESERIES_ARRAYS": [
+        ("med_start", "time_col", "{time_array_type}"),
+        ("med_stop", "stop_col", "{time_array_type}"),
+        ("med_dose", "dose_col", "DOUBLE PRECISION[]"),
+        ("med_unit", "unit_col", "TEXT[]"),
+        ("med_form", "form_col", "TEXT[]"),
+    ],
+}
+
 # 注意: 文本类型列的结果类型 (MIN, MAX等) 应由 specific_sql_builder 根据面板配置动态处理。
\ No newline at end of file
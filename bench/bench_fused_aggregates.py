@@ -0,0 +1,93 @@
+# --- START OF FILE bench/bench_fused_aggregates.py ---
+"""
+合并聚合 (user-006) 的微基准：在合成事件表上对比逐方法 PERCENTILE_CONT / AVG / STDDEV 的旧 SQL
+与合并为一次 PERCENTILE_CONT(ARRAY[...]) + 一次 AVG/STDDEV_SAMP 的新 SQL。
+
+两条 SQL 均由 _build_aggregate_select_list / _build_grouped_aggregate_query 生成 (旧 SQL 使用 fuse=False)，
+事件表为 generate_series 生成的临时表，不修改数据库中的任何持久对象。
+
+用法 (在仓库根目录)：
+    python -m bench.bench_fused_aggregates --dsn "host=localhost dbname=postgres user=postgres" --keys 20000 --events-per-key 50
+省略 --dsn 时使用 libpq 环境变量 (PGHOST、PGDATABASE 等)。
+"""
+import argparse
+import statistics
+import time
+
+import psycopg2
+import psycopg2.sql as psql
+
+from sql_logic.sql_builder_special import (_build_aggregate_select_list, _build_grouped_aggregate_query,
+                                           _collect_output_columns)
+
+BENCH_METHODS = ["MEAN", "MEDIAN", "P25", "P75", "IQR", "STDDEV_SAMP", "CV", "MIN", "MAX"]
+EVENTS_TABLE = psql.Identifier("bench_fused_events")
+GROUP_KEY = psql.Identifier("hadm_id")
+
+
+def build_query(fuse: bool) -> psql.Composable:
+    selected_methods, _, error = _collect_output_columns("val", {"aggregation_methods": {m: True for m in BENCH_METHODS}})
+    if error:
+        raise ValueError(error)
+    agg_select_list, outer_select_list, _ = _build_aggregate_select_list(
+        selected_methods, val_expr=psql.Identifier("event_value"), raw_val_expr=psql.Identifier("event_value"),
+        time_expr=psql.Identifier("event_time"), fuse=fuse
+    )
+    main_query = _build_grouped_aggregate_query(GROUP_KEY, agg_select_list, outer_select_list)
+    return psql.SQL("WITH FilteredEvents AS (SELECT * FROM {events}) {main} ORDER BY 1").format(events=EVENTS_TABLE, main=main_query)
+
+
+def create_events_table(cur, keys: int, events_per_key: int):
+    cur.execute(psql.SQL("""CREATE TEMPORARY TABLE {events} AS
+SELECT k AS hadm_id, ROUND((50 + random() * 150)::NUMERIC, 2) AS event_value,
+       TIMESTAMP '2150-01-01' + e * INTERVAL '1 hour' AS event_time
+FROM generate_series(1, %s) k CROSS JOIN generate_series(1, %s) e""").format(events=EVENTS_TABLE), (keys, events_per_key))
+    cur.execute(psql.SQL("ANALYZE {}").format(EVENTS_TABLE))
+
+
+def time_query(cur, query: psql.Composable, repeat: int):
+    cur.execute(query); cur.fetchall()  # 预热缓存
+    timings, rows = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cur.execute(query)
+        rows = cur.fetchall()
+        timings.append(time.perf_counter() - start)
+    return timings, rows
+
+
+def max_abs_difference(rows_a, rows_b) -> float:
+    diff = 0.0
+    for row_a, row_b in zip(rows_a, rows_b):
+        for a, b in zip(row_a, row_b):
+            if a is not None and b is not None:
+                diff = max(diff, abs(float(a) - float(b)))
+    return diff
+
+
+def main():
+    parser = argparse.ArgumentParser(description="合并聚合 SQL 与逐方法聚合 SQL 的耗时对比")
+    parser.add_argument("--dsn", default="", help="psycopg2 连接串，默认使用 libpq 环境变量")
+    parser.add_argument("--keys", type=int, default=20000, help="合成队列键数量")
+    parser.add_argument("--events-per-key", type=int, default=50, help="每个键的事件数")
+    parser.add_argument("--repeat", type=int, default=5, help="每条 SQL 的计时次数")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(args.dsn)
+    try:
+        with conn.cursor() as cur:
+            print(f"生成合成事件表: {args.keys} 个键 x {args.events_per_key} 个事件 ...")
+            create_events_table(cur, args.keys, args.events_per_key)
+            results = {}
+            for label, fuse in (("逐方法 PERCENTILE_CONT (旧)", False), ("合并 PERCENTILE_CONT(ARRAY) (新)", True)):
+                timings, rows = time_query(cur, build_query(fuse), args.repeat)
+                results[label] = rows
+                print(f"{label}: 中位数 {statistics.median(timings):.3f} 秒, 最短 {min(timings):.3f} 秒 (n={args.repeat})")
+            old_rows, new_rows = results.values()
+            print(f"结果行数: {len(old_rows)} / {len(new_rows)}，最大绝对差: {max_abs_difference(old_rows, new_rows):.3g}")
+    finally:
+        conn.rollback(); conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+# --- START OF FILE bench/bench_series_arrays.py ---
+"""
+列式数组时间序列 (user-020) 的基准：在合成事件表上对比 TIMESERIES_JSON 与 TIMESERIES_ARRAYS 两种输出。
+
+两条 SQL 均由 _collect_output_columns / _build_aggregate_select_list / _build_grouped_aggregate_query 生成，
+事件表为 generate_series 生成的临时表 (默认 10000 个住院 x 每个 100 个事件)。每种输出分别计时：
+- 查询与读取: pd.read_sql (JSONB 以文本读取；数组列经 register_numpy_array_casters 直接解析为 NumPy 数组)
+- 客户端解码: JSONB 逐行 json.loads；数组列用 decode_series_struct 组装为 {字段: ndarray}
+同时报告服务器端结果列的总大小 (pg_column_size)。不修改数据库中的任何持久对象。
+
+用法 (在仓库根目录)：
+    python -m bench.bench_series_arrays --dsn "host=localhost dbname=postgres user=postgres" --admissions 10000
+省略 --dsn 时使用 libpq 环境变量 (PGHOST、PGDATABASE 等)。
+"""
+import argparse
+import json
+import statistics
+import time
+import warnings
+
+import pandas as pd
+import psycopg2
+import psycopg2.extras
+import psycopg2.sql as psql
+
+from sql_logic.series_arrays import decode_series_struct, register_numpy_array_casters
+from sql_logic.sql_builder_special import (_build_aggregate_select_list, _build_grouped_aggregate_query,
+                                           _collect_output_columns)
+
+BASE_COLUMN = "hr"
+EVENTS_TABLE = psql.Identifier("bench_series_events")
+GROUP_KEY = psql.Identifier("hadm_id")
+
+
+def build_query(method_key: str) -> psql.Composable:
+    selected_methods, _, error = _collect_output_columns(BASE_COLUMN, {"aggregation_methods": {method_key: True}})
+    if error:
+        raise ValueError(error)
+    agg_select_list, outer_select_list, _ = _build_aggregate_select_list(
+        selected_methods, val_expr=psql.Identifier("event_value"), raw_val_expr=psql.Identifier("event_value"),
+        time_expr=psql.Identifier("event_time")
+    )
+    main_query = _build_grouped_aggregate_query(GROUP_KEY, agg_select_list, outer_select_list)
+    return psql.SQL("WITH FilteredEvents AS (SELECT * FROM {events}) {main}").format(events=EVENTS_TABLE, main=main_query)
+
+
+def create_events_table(cur, admissions: int, events_per_admission: int):
+    cur.execute(psql.SQL("""CREATE TEMPORARY TABLE {events} AS
+SELECT k AS hadm_id, ROUND((60 + random() * 80)::NUMERIC, 1) AS event_value,
+       TIMESTAMP '2150-01-01' + k * INTERVAL '1 day' + e * INTERVAL '15 minutes' AS event_time
+FROM generate_series(1, %s) k CROSS JOIN generate_series(1, %s) e""").format(events=EVENTS_TABLE), (admissions, events_per_admission))
+    cur.execute(psql.SQL("ANALYZE {}").format(EVENTS_TABLE))
+
+
+def result_size_bytes(conn, query: psql.Composable) -> int:
+    with conn.cursor() as cur:
+        cur.execute(psql.SQL("SELECT COALESCE(SUM(pg_column_size(r.*)), 0) FROM ({}) r").format(query))
+        return int(cur.fetchone()[0])
+
+
+def read_query(conn, query: psql.Composable) -> pd.DataFrame:
+    with warnings.catch_warnings():
+        # pandas 对非 SQLAlchemy 连接的提示与计时无关
+        warnings.simplefilter("ignore", UserWarning)
+        return pd.read_sql(query.as_string(conn), conn)
+
+
+def run_json(conn, query: psql.Composable):
+    column = f"{BASE_COLUMN}_timeseries_json"
+    start = time.perf_counter()
+    df = read_query(conn, query)
+    fetched = time.perf_counter()
+    decoded = [json.loads(v) if v is not None else None for v in df[column]]
+    done = time.perf_counter()
+    return fetched - start, done - fetched, len(decoded)
+
+
+def run_arrays(conn, query: psql.Composable):
+    start = time.perf_counter()
+    df = read_query(conn, query)
+    fetched = time.perf_counter()
+    decoded = decode_series_struct(df, BASE_COLUMN, "TIMESERIES_ARRAYS")
+    done = time.perf_counter()
+    return fetched - start, done - fetched, len(decoded)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TIMESERIES_JSON 与 TIMESERIES_ARRAYS 的查询与解码耗时对比")
+    parser.add_argument("--dsn", default="", help="psycopg2 连接串，默认使用 libpq 环境变量")
+    parser.add_argument("--admissions", type=int, default=10000, help="合成住院数量")
+    parser.add_argument("--events-per-admission", type=int, default=100, help="每次住院的事件数")
+    parser.add_argument("--repeat", type=int, default=3, help="每种输出的计时次数")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(args.dsn)
+    try:
+        # JSONB 以文本读取，使 json.loads 的耗时单独计入解码阶段；数组列直接解析为 NumPy 数组
+        psycopg2.extras.register_default_jsonb(conn, loads=lambda value: value)
+        register_numpy_array_casters(conn)
+        with conn.cursor() as cur:
+            print(f"生成合成事件表: {args.admissions} 次住院 x {args.events_per_admission} 个事件 ...")
+            create_events_table(cur, args.admissions, args.events_per_admission)
+
+        for label, method_key, runner in (("JSONB (TIMESERIES_JSON)", "TIMESERIES_JSON", run_json),
+                                          ("数组 (TIMESERIES_ARRAYS)", "TIMESERIES_ARRAYS", run_arrays)):
+            query = build_query(method_key)
+            size_mb = result_size_bytes(conn, query) / 1024 / 1024
+            runner(conn, query)  # 预热缓存
+            fetch_times, decode_times = [], []
+            for _ in range(args.repeat):
+                fetch_s, decode_s, rows = runner(conn, query)
+                fetch_times.append(fetch_s); decode_times.append(decode_s)
+            fetch_med, decode_med = statistics.median(fetch_times), statistics.median(decode_times)
+            print(f"{label}: {rows} 行, 结果 {size_mb:.1f} MB | 查询与读取 {fetch_med:.3f} 秒 + 解码 {decode_med:.3f} 秒 "
+                  f"= {fetch_med + decode_med:.3f} 秒 (中位数, n={args.repeat})")
+    finally:
+        conn.rollback(); conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 # --- START OF FILE db_profiles/base_profile.py ---
 from abc import ABC, abstractmethod
-from typing import List, Tuple, Callable, Dict, Any
+from typing import List, Tuple, Callable, Dict, Any, Optional
 
 class BaseDbProfile(ABC):
     """
@@ -77,4 +77,87 @@ class BaseDbProfile(ABC):
         - 对于MIMIC-IV，需要根据表名判断是 'stay_id' 还是 'hadm_id'。
         - 对于e-ICU，所有事件表基本都使用 'patientunitstayid'。
         """
-        pass
\ No newline at end of file
+        pass
+    def get_profile_constants(self) -> Dict[str, Any]:
+        """返回该数据库的通用常量 (默认列名等)，子类按需覆盖。"""
+        return {}
+
+    def get_cohort_index_columns(self) -> List[str]:
+        """
+        返回队列表上需要建立索引的列 (与 CohortCreationWorker 创建的索引一致)。
+        重建队列表 (而非原地 UPDATE) 时会据此重新创建索引。
+        """
+        return self.get_profile_constants().get('COHORT_INDEX_COLUMNS', [])
+
+    def get_cohort_primary_key(self) -> Optional[str]:
+        """
+        返回"首次事件入院"队列 (每个分组只保留一行) 上声明为主键的列；返回 None 时不声明主键。
+        主键列同时承担该列的索引，不再单独建立。
+        """
+        return self.get_profile_constants().get('COHORT_PRIMARY_KEY')
+
+    def get_first_icu_stay_relation(self) -> Optional[str]:
+        """
+        返回画像维护的首次 ICU 入住辅助视图全名 (hadm_id -> 首次 stay_id、入/出 ICU 时间、时长)；
+        返回 None 表示该数据库没有此辅助视图。
+        """
+        return self.get_profile_constants().get('FIRST_ICU_STAY_TABLE')
+
+    def get_helper_table_refresh_sql(self) -> List[str]:
+        """返回 (必要时创建并) 按源表当前内容重新计算辅助表的 SQL 语句，只在用户显式刷新时执行。"""
+        return []
+
+    def get_search_acceleration_schema(self) -> Optional[str]:
+        """
+        返回项目检索加速 (pg_trgm 索引与去重小表，见 sql_logic/search_acceleration.py) 使用的 schema；
+        返回 None 表示该画像不提供检索加速。
+        """
+        return self.get_profile_constants().get('SEARCH_ACCELERATION_SCHEMA')
+
+    def use_cohort_key_pushdown(self) -> bool:
+        """
+        专项数据提取是否默认使用队列键半连接下推：先物化队列的连接键集合，
+        再按 `事件表.连接键 = ANY(数组)` 通过连接键索引访问事件表。
+        适用于事件表很大、队列只占一小部分、且时间条件本身无法利用索引的数据库。
+        """
+        return self.get_profile_constants().get('COHORT_KEY_PUSHDOWN', False)
+
+    def get_time_window_anchors(self) -> List[Tuple[str, Optional[str]]]:
+        """
+        返回参数化相对时间窗口可选的锚点 [(显示文本, 队列表中的锚点列)]。
+        锚点列为 None 表示以事件表时间偏移的零点为锚点 (如 e-ICU 的 ICU 入室时刻)。
+        """
+        return self.get_profile_constants().get('TIME_WINDOW_ANCHORS', [])
+
+    def get_event_time_array_type(self) -> str:
+        """
+        返回列式数组时间序列输出 (TIMESERIES_ARRAYS 等) 中时间数组的 SQL 类型。
+        默认事件时间为时间戳；以整数偏移记录时间的数据库 (如 e-ICU) 应返回整数数组类型。
+        """
+        return self.get_profile_constants().get('EVENT_TIME_ARRAY_TYPE', 'TIMESTAMP[]')
+
+    def get_numeric_shadow_tables(self) -> Dict[str, Dict[str, Any]]:
+        """
+        返回把数值存放在文本列中的事件表及其数值影子表定义 {源表全名: 定义}，
+        定义格式见 sql_logic/numeric_shadow.py。默认没有需要准备的影子表。
+        """
+        return self.get_profile_constants().get('NUMERIC_SHADOW_TABLES', {})
+
+    def get_numeric_shadow_preparation_steps(self) -> List[Tuple[Any, Any]]:
+        """
+        返回一次性建立所有数值影子表 (带索引的物化视图) 的执行步骤 [(sql, params)]。
+        准备完成后，专项数据提取直接读取影子表中已解析的数值列，而不是逐行转换文本。
+        """
+        from sql_logic.numeric_shadow import build_numeric_shadow_steps
+        steps = []
+        for source_table, shadow_def in self.get_numeric_shadow_tables().items():
+            steps.extend(build_numeric_shadow_steps(source_table, shadow_def))
+        return steps
+
+    def get_item_id_column_type(self, event_table_name: str, column_name: str) -> Optional[str]:
+        """
+        返回事件表中项目ID列的原生 SQL 类型 (如 'integer', 'text')。
+        整数与 bpchar 列由专项数据构建器生成可利用索引的 `列 = ANY(%s::类型[])` 谓词；
+        text/varchar 列 (值可能带首尾空白) 与返回 None 时使用 TRIM(CAST(列 AS TEXT)) 的文本比较。
+        """
+        return None
@@ -11,6 +11,8 @@ from ui_components.base_panel import BaseSourceConfigPanel
 from ui_components.conditiongroup import ConditionGroupWidget
 from ui_components.value_aggregation_widget import ValueAggregationWidget
 from ui_components.time_window_selector_widget import TimeWindowSelectorWidget
+from sql_logic.sql_renderer import render_sql
+from sql_logic.search_acceleration import resolve_search_relation
 
 class EicuInfusionDrugPanel(BaseSourceConfigPanel):
     """
@@ -200,13 +202,11 @@ class EicuInfusionDrugPanel(BaseSourceConfigPanel):
         try:
             query_template_obj = pgsql.SQL("SELECT DISTINCT {name} FROM {table} WHERE {cond} AND {name} IS NOT NULL ORDER BY {name} LIMIT 500").format(
                 name=pgsql.Identifier(name_col), 
-                table=pgsql.SQL(event_table), 
+                table=resolve_search_relation(self._db_cursor, self.get_db_profile(), event_table, {name_col} | self.condition_widget.get_used_fields()), 
                 cond=pgsql.SQL(condition_sql_template)
             )
             
-            if self._db_conn and not self._db_conn.closed:
-                mogrified_sql = self._db_cursor.mogrify(query_template_obj, condition_params).decode(self._db_conn.encoding or 'utf-8')
-                self.filter_sql_preview_textedit.setText(mogrified_sql)
+            self.filter_sql_preview_textedit.setText(render_sql(query_template_obj, condition_params))
 
             self._db_cursor.execute(query_template_obj, condition_params)
             items = self._db_cursor.fetchall()
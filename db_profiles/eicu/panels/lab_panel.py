@@ -11,6 +11,7 @@ from ui_components.base_panel import BaseSourceConfigPanel
 from ui_components.conditiongroup import ConditionGroupWidget
 from ui_components.value_aggregation_widget import ValueAggregationWidget
 from ui_components.time_window_selector_widget import TimeWindowSelectorWidget
+from sql_logic.search_acceleration import resolve_search_relation
 
 class EicuLabPanel(BaseSourceConfigPanel):
     def init_panel_ui(self):
@@ -165,7 +166,8 @@ class EicuLabPanel(BaseSourceConfigPanel):
             return
 
         try:
-            query = pgsql.SQL("SELECT DISTINCT labname FROM public.lab WHERE {cond} ORDER BY labname LIMIT 500").format(
+            query = pgsql.SQL("SELECT DISTINCT labname FROM {table} WHERE {cond} ORDER BY labname LIMIT 500").format(
+                table=resolve_search_relation(self._db_cursor, self.get_db_profile(), "public.lab", {"labname"} | self.condition_widget.get_used_fields()),
                 cond=pgsql.SQL(condition_sql_template)
             )
             self._db_cursor.execute(query, condition_params)
@@ -12,6 +12,8 @@ from ui_components.event_output_widget import EventOutputWidget
 # [新增] 导入聚合组件
 from ui_components.value_aggregation_widget import ValueAggregationWidget
 from ui_components.time_window_selector_widget import TimeWindowSelectorWidget
+from sql_logic.sql_renderer import render_sql
+from sql_logic.search_acceleration import resolve_search_relation
 
 class EicuMedicationPanel(BaseSourceConfigPanel):
     def init_panel_ui(self):
@@ -94,6 +96,7 @@ class EicuMedicationPanel(BaseSourceConfigPanel):
         
         # 动态添加专用的用药时间序列选项
         self.value_agg_widget.add_custom_aggregation("用药时间序列 (JSON)", "MED_TIMESERIES_JSON", is_checked_by_default=False)
+        self.value_agg_widget.add_custom_aggregation("用药时间序列 (列式数组)", "MED_TIMESERIES_ARRAYS", is_checked_by_default=False)
         
         # 隐藏全选/全不选按钮
         self.value_agg_widget.select_all_btn.setVisible(False)
@@ -221,13 +224,12 @@ class EicuMedicationPanel(BaseSourceConfigPanel):
             return
             
         try:
-            query_template_obj = pgsql.SQL("SELECT DISTINCT drugname FROM public.medication WHERE {cond} ORDER BY drugname LIMIT 500").format(
+            query_template_obj = pgsql.SQL("SELECT DISTINCT drugname FROM {table} WHERE {cond} ORDER BY drugname LIMIT 500").format(
+                table=resolve_search_relation(self._db_cursor, self.get_db_profile(), "public.medication", {"drugname"} | self.condition_widget.get_used_fields()),
                 cond=pgsql.SQL(condition_sql_template)
             )
             
-            if self._db_conn and not self._db_conn.closed:
-                mogrified_sql = self._db_cursor.mogrify(query_template_obj, condition_params).decode(self._db_conn.encoding or 'utf-8')
-                self.filter_sql_preview_textedit.setText(mogrified_sql)
+            self.filter_sql_preview_textedit.setText(render_sql(query_template_obj, condition_params))
 
             self._db_cursor.execute(query_template_obj, condition_params)
             items = self._db_cursor.fetchall()
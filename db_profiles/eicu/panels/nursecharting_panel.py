@@ -12,6 +12,7 @@ from ui_components.base_panel import BaseSourceConfigPanel
 from ui_components.conditiongroup import ConditionGroupWidget
 from ui_components.value_aggregation_widget import ValueAggregationWidget
 from ui_components.time_window_selector_widget import TimeWindowSelectorWidget
+from sql_logic.search_acceleration import resolve_search_relation
 
 class EicuNurseChartingPanel(BaseSourceConfigPanel):
     def init_panel_ui(self):
@@ -214,7 +215,8 @@ class EicuNurseChartingPanel(BaseSourceConfigPanel):
 
         try:
             # 查询 nursecharting 表中所有不重复的标签 (label)
-            query = pgsql.SQL("SELECT DISTINCT nursingchartcelltypevallabel FROM public.nursecharting WHERE {cond} ORDER BY nursingchartcelltypevallabel LIMIT 500").format(
+            query = pgsql.SQL("SELECT DISTINCT nursingchartcelltypevallabel FROM {table} WHERE {cond} ORDER BY nursingchartcelltypevallabel LIMIT 500").format(
+                table=resolve_search_relation(self._db_cursor, self.get_db_profile(), "public.nursecharting", {"nursingchartcelltypevallabel"} | self.condition_widget.get_used_fields()),
                 cond=pgsql.SQL(condition_sql_template)
             )
             self._db_cursor.execute(query, condition_params)
@@ -1,5 +1,5 @@
 # --- START OF FILE db_profiles/eicu/profile.py ---
-from typing import List, Tuple, Callable, Dict, Any
+from typing import List, Tuple, Callable, Dict, Any, Optional
 
 from db_profiles.base_profile import BaseDbProfile
 
@@ -130,6 +130,37 @@ class EICUProfile(BaseDbProfile):
             'DEFAULT_VALUE_COLUMN': 'labresult',
             'DEFAULT_TEXT_VALUE_COLUMN': 'labresulttext',
             'DEFAULT_TIME_COLUMN': 'labresultoffset',
+            'COHORT_INDEX_COLUMNS': ['patientunitstayid'],
+            'COHORT_PRIMARY_KEY': 'patientunitstayid',
+            'TIME_WINDOW_ANCHORS': [("ICU入室 (offset 0)", None)],
+            # 时间窗口只是 offset 谓词，队列通常只占很少的 ICU 住院；按 patientunitstayid 索引驱动事件表访问
+            'COHORT_KEY_PUSHDOWN': True,
+            # 事件时间均为相对 ICU 入室的分钟偏移
+            'EVENT_TIME_ARRAY_TYPE': 'INTEGER[]',
+            # 项目检索加速 (见 sql_logic/search_acceleration.py)：去重小表所在 schema 与面板独有的检索列
+            'SEARCH_ACCELERATION_SCHEMA': 'eicu_derived',
+            'SEARCH_ACCELERATION_EXTRA_TARGETS': {
+                "public.nursecharting": ["nursingchartcelltypevallabel", "nursingchartcelltypecat", "nursingchartcelltypevalname"],
+                "public.medication": ["frequency"],
+            },
+            # 数值存放在文本列中的事件表：准备后改读带索引的物化视图 (见 sql_logic/numeric_shadow.py)
+            'NUMERIC_SHADOW_TABLES': {
+                "public.nursecharting": {
+                    "relation": "eicu_derived.nursecharting_numeric",
+                    "index_columns": ["patientunitstayid", "nursingchartcelltypevallabel", "nursingchartoffset"],
+                    "extra_columns": ["nursingchartcelltypecat", "nursingchartcelltypevalname"],
+                    "numeric_columns": {"nursingchartvalue": "nursingchartvalue_num"},
+                },
+                "public.infusiondrug": {
+                    "relation": "eicu_derived.infusiondrug_numeric",
+                    "index_columns": ["patientunitstayid", "drugname", "infusionoffset"],
+                    "extra_columns": [],
+                    "numeric_columns": {
+                        "drugrate": "drugrate_num", "infusionrate": "infusionrate_num", "drugamount": "drugamount_num",
+                        "volumeoffluid": "volumeoffluid_num", "patientweight": "patientweight_num",
+                    },
+                },
+            },
         }
 
     def get_event_table_join_key(self, event_table_name: str) -> str:
@@ -138,4 +169,12 @@ class EICUProfile(BaseDbProfile):
 
     def get_cohort_join_key(self, event_table_name: str) -> str:
         # e-ICU的队列主键总是 patientunitstayid，忽略事件表名
-        return "patientunitstayid"
\ No newline at end of file
+        return "patientunitstayid"
+
+    def get_item_id_column_type(self, event_table_name: str, column_name: str) -> Optional[str]:
+        # e-ICU 的项目列均为 VARCHAR 名称列 (labname, drugname, nursingchartcelltypevallabel 等)，构建器对其保留 TRIM 文本比较
+        item_id_columns = {
+            'labname', 'drugname', 'nursingchartcelltypevallabel', 'nursingchartcelltypevalname',
+            'diagnosisstring', 'treatmentstring',
+        }
+        return 'text' if column_name in item_id_columns else None
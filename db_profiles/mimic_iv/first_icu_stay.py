@@ -0,0 +1,35 @@
+# --- START OF FILE db_profiles/mimic_iv/first_icu_stay.py ---
+"""
+MIMIC-IV 首次 ICU 入住辅助表。
+
+每次创建队列或添加基础信息时都对整张 mimiciv_icu.icustays 做 ROW_NUMBER() OVER (PARTITION BY hadm_id ...)
+代价不小。这里维护一个带索引的小物化视图 (hadm_id -> 首次 stay_id、入/出 ICU 时间、ICU 住院时长)，
+只在用户点击"刷新"时创建或刷新 (不在队列创建事务中执行 DDL)；队列创建用 to_regclass 确认视图存在后才连接它，
+否则仍使用内联子查询。生成的都是纯文本 SQL (关系名来自画像常量，不含用户输入)。
+"""
+from typing import List
+
+
+def build_first_icu_stay_ensure_sql(relation: str) -> List[str]:
+    """视图不存在时创建视图及其索引 (已存在时均为空操作)。"""
+    schema_name, view_name = relation.split(".", 1)
+    return [
+        f"CREATE SCHEMA IF NOT EXISTS {schema_name};",
+        f"""CREATE MATERIALIZED VIEW IF NOT EXISTS {relation} AS
+SELECT DISTINCT ON (ie.hadm_id)
+    ie.hadm_id, ie.subject_id, ie.stay_id, ie.intime, ie.outtime,
+    EXTRACT(EPOCH FROM (ie.outtime - ie.intime)) / 3600.0 AS los_icu_hours
+FROM mimiciv_icu.icustays ie
+ORDER BY ie.hadm_id, ie.intime, ie.stay_id;""",
+        f"CREATE UNIQUE INDEX IF NOT EXISTS {view_name}_hadm_id_idx ON {relation} (hadm_id);",
+        f"CREATE INDEX IF NOT EXISTS {view_name}_stay_id_idx ON {relation} (stay_id);",
+    ]
+
+
+def build_first_icu_stay_refresh_sql(relation: str) -> List[str]:
+    """(必要时创建后) 按 icustays 的当前内容刷新视图并收集统计信息。"""
+    return build_first_icu_stay_ensure_sql(relation) + [
+        f"REFRESH MATERIALIZED VIEW {relation};",
+        f"ANALYZE {relation};",
+    ]
+
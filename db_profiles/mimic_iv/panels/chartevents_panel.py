@@ -12,6 +12,7 @@ from ui_components.base_panel import BaseSourceConfigPanel
 from ui_components.conditiongroup import ConditionGroupWidget
 from ui_components.value_aggregation_widget import ValueAggregationWidget
 from ui_components.time_window_selector_widget import TimeWindowSelectorWidget
+from sql_logic.sql_renderer import render_sql
 
 class CharteventsConfigPanel(BaseSourceConfigPanel):
     def init_panel_ui(self):
@@ -269,9 +270,7 @@ class CharteventsConfigPanel(BaseSourceConfigPanel):
                 cond=pgsql.SQL(condition_sql_template)
             )
             
-            if self._db_conn and not self._db_conn.closed:
-                mogrified_sql = self._db_cursor.mogrify(query_template_obj, condition_params).decode(self._db_conn.encoding or 'utf-8')
-                self.filter_sql_preview_textedit.setText(mogrified_sql)
+            self.filter_sql_preview_textedit.setText(render_sql(query_template_obj, condition_params))
 
             self._db_cursor.execute(query_template_obj, condition_params)
             items = self._db_cursor.fetchall()
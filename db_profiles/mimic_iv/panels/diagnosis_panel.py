@@ -11,6 +11,7 @@ from ui_components.base_panel import BaseSourceConfigPanel
 from ui_components.conditiongroup import ConditionGroupWidget
 from ui_components.event_output_widget import EventOutputWidget
 from ui_components.time_window_selector_widget import TimeWindowSelectorWidget
+from sql_logic.sql_renderer import render_sql
 
 class DiagnosisConfigPanel(BaseSourceConfigPanel):
     def init_panel_ui(self):
@@ -118,7 +119,7 @@ class DiagnosisConfigPanel(BaseSourceConfigPanel):
         if not condition_sql_template: self.item_list.clear(); self.item_list.addItem("请输入筛选条件。"); self.filter_items_btn.setEnabled(True); self._close_panel_db(); return
         try:
             query_template_obj = pgsql.SQL("SELECT {id}, {name}, {ver} FROM {table} WHERE {cond} ORDER BY {name} LIMIT 500").format(id=pgsql.Identifier(id_col), name=pgsql.Identifier(name_col), ver=pgsql.Identifier(ver_col), table=pgsql.SQL(dict_table), cond=pgsql.SQL(condition_sql_template))
-            if self._db_conn and not self._db_conn.closed: self.filter_sql_preview_textedit.setText(self._db_cursor.mogrify(query_template_obj, condition_params).decode(self._db_conn.encoding or 'utf-8'))
+            self.filter_sql_preview_textedit.setText(render_sql(query_template_obj, condition_params))
             self._db_cursor.execute(query_template_obj, condition_params); items = self._db_cursor.fetchall(); self.item_list.clear()
             if items:
                 for item_id_val, item_name_disp_val, item_ver_val in items:
@@ -12,6 +12,8 @@ from ui_components.conditiongroup import ConditionGroupWidget
 from ui_components.event_output_widget import EventOutputWidget
 from ui_components.value_aggregation_widget import ValueAggregationWidget
 from ui_components.time_window_selector_widget import TimeWindowSelectorWidget
+from sql_logic.sql_renderer import render_sql
+from sql_logic.search_acceleration import resolve_search_relation
 
 class MedicationConfigPanel(BaseSourceConfigPanel):
     def init_panel_ui(self):
@@ -58,6 +60,7 @@ class MedicationConfigPanel(BaseSourceConfigPanel):
         
         # 动态添加我们专用的用药时间序列选项
         self.value_agg_widget.add_custom_aggregation("用药时间序列 (JSON)", "MED_TIMESERIES_JSON", is_checked_by_default=False)
+        self.value_agg_widget.add_custom_aggregation("用药时间序列 (列式数组)", "MED_TIMESERIES_ARRAYS", is_checked_by_default=False)
         
         # 隐藏全选/全不选按钮
         self.value_agg_widget.select_all_btn.setVisible(False)
@@ -174,10 +177,8 @@ class MedicationConfigPanel(BaseSourceConfigPanel):
         self.item_list.clear(); self.item_list.addItem("正在查询..."); self.filter_items_btn.setEnabled(False); QApplication.processEvents()
         if not condition_sql_template: self.item_list.clear(); self.item_list.addItem("请输入筛选条件。"); self.filter_items_btn.setEnabled(True); self._close_panel_db(); return
         try:
-            query_template_obj = pgsql.SQL("SELECT DISTINCT {name} FROM {table} WHERE {cond} ORDER BY {name} LIMIT 500").format(name=pgsql.Identifier(name_col), table=pgsql.SQL(event_table), cond=pgsql.SQL(condition_sql_template))
-            if self._db_conn and not self._db_conn.closed:
-                mogrified_sql = self._db_cursor.mogrify(query_template_obj, condition_params).decode(self._db_conn.encoding or 'utf-8')
-                self.filter_sql_preview_textedit.setText(mogrified_sql)
+            query_template_obj = pgsql.SQL("SELECT DISTINCT {name} FROM {table} WHERE {cond} ORDER BY {name} LIMIT 500").format(name=pgsql.Identifier(name_col), table=resolve_search_relation(self._db_cursor, self.get_db_profile(), event_table, {name_col} | self.condition_widget.get_used_fields()), cond=pgsql.SQL(condition_sql_template))
+            self.filter_sql_preview_textedit.setText(render_sql(query_template_obj, condition_params))
             self._db_cursor.execute(query_template_obj, condition_params); items = self._db_cursor.fetchall(); self.item_list.clear()
             if items:
                 for item_tuple in items:
@@ -7,6 +7,7 @@ import psycopg2
 import traceback
 
 from ui_components.base_panel import BaseSourceConfigPanel
+from sql_logic.catalog_cache import get_table_columns
 
 class PreprocessedNotePanel(BaseSourceConfigPanel):
     """
@@ -104,15 +105,10 @@ class PreprocessedNotePanel(BaseSourceConfigPanel):
 
         self.column_list.clear()
         try:
-            self._db_cursor.execute("""
-                SELECT column_name FROM information_schema.columns
-                WHERE table_schema = 'mimiciv_note' AND table_name = %s
-                AND column_name NOT IN ('subject_id', 'hadm_id') -- 自动排除连接键
-                ORDER BY ordinal_position;
-            """, (table_name,))
-            columns = self._db_cursor.fetchall()
-            for col in columns:
-                self.column_list.addItem(QListWidgetItem(col[0]))
+            # 列清单经由共享的表元数据缓存读取 (合并执行时构建器复用同一份缓存)
+            for col_name, _ in get_table_columns(self._db_cursor, 'mimiciv_note', table_name):
+                if col_name not in ('subject_id', 'hadm_id'): # 自动排除连接键
+                    self.column_list.addItem(QListWidgetItem(col_name))
             self._set_all_columns_selected(True) # 默认全选
         except Exception as e:
             QMessageBox.critical(self, "查询失败", f"无法获取表 '{table_name}' 的列: {e}")
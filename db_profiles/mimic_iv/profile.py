@@ -1,5 +1,5 @@
 # --- START OF FILE db_profiles/mimic_iv/profile.py ---
-from typing import List, Tuple, Callable, Dict, Any
+from typing import List, Tuple, Callable, Dict, Any, Optional
 
 from db_profiles.base_profile import BaseDbProfile
 
@@ -10,6 +10,7 @@ from .panels.procedure_panel import ProcedureConfigPanel
 from .panels.diagnosis_panel import DiagnosisConfigPanel
 from .panels.preprocessed_note_panel import PreprocessedNotePanel
 from . import base_info_modules as mimic_base_info
+from .first_icu_stay import build_first_icu_stay_refresh_sql
 
 class MIMICIVProfile(BaseDbProfile):
     """MIMIC-IV 数据库的具体配置画像。"""
@@ -129,8 +130,20 @@ class MIMICIVProfile(BaseDbProfile):
             'DEFAULT_VALUE_COLUMN': "valuenum",
             'DEFAULT_TEXT_VALUE_COLUMN': "value",
             'DEFAULT_TIME_COLUMN': "charttime",
+            'COHORT_INDEX_COLUMNS': ["subject_id", "hadm_id"],
+            # 首次事件队列每个患者一行，hadm_id 唯一
+            'COHORT_PRIMARY_KEY': "hadm_id",
+            # 首次 ICU 入住辅助视图 (见 first_icu_stay.py)，仅在存在时供队列创建连接
+            'FIRST_ICU_STAY_TABLE': "mimiciv_helper.first_icu_stay",
+            # 项目检索加速 (见 sql_logic/search_acceleration.py)：去重小表所在 schema 与面板独有的检索列
+            'SEARCH_ACCELERATION_SCHEMA': "mimiciv_helper",
+            'SEARCH_ACCELERATION_EXTRA_TARGETS': {"mimiciv_hosp.prescriptions": ["drug"]},
+            'TIME_WINDOW_ANCHORS': [("ICU入室时间 (icu_intime)", "icu_intime"), ("入院时间 (admittime)", "admittime")],
         }
 
+    def get_helper_table_refresh_sql(self) -> List[str]:
+        return build_first_icu_stay_refresh_sql(self.get_first_icu_stay_relation())
+
     def get_cohort_join_key(self, event_table_name: str) -> str:
         # 根据事件表的级别，决定队列表应该用哪个键去连接
         # 如果事件表是 ICU 级别的 (如 chartevents)，队列表就用 stay_id
@@ -161,4 +174,13 @@ class MIMICIVProfile(BaseDbProfile):
              'note' in event_table_name:
             return 'hadm_id'
         # 默认返回一个最不可能出错的键，但理想情况下所有支持的表都应被覆盖
-        return 'hadm_id'
\ No newline at end of file
+        return 'hadm_id'
+
+    def get_item_id_column_type(self, event_table_name: str, column_name: str) -> Optional[str]:
+        # MIMIC-IV 官方建表脚本中的列类型：itemid 为 INTEGER，icd_code 为 CHAR(7)，drug 为 VARCHAR
+        item_id_types = {
+            'itemid': 'integer',
+            'icd_code': 'bpchar',
+            'drug': 'text',
+        }
+        return item_id_types.get(column_name)
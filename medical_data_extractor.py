@@ -16,6 +16,7 @@ from db_profiles.eicu.profile import EICUProfile
 from tabs.tab_connection import ConnectionTab
 from tabs.tab_structure import StructureTab
 from tabs.tab_query_cohort import QueryCohortTab
+from tabs.tab_cohort_compose import CohortCompositionTab
 from tabs.tab_combine_base_info import BaseInfoDataExtractionTab
 from tabs.tab_special_data_master import SpecialDataMasterTab
 from tabs.tab_data_dictionary import DataDictionaryTab
@@ -48,6 +49,7 @@ class MedicalDataExtractor(QMainWindow):
         # --- 实例化所有 Tab 页面 ---
         self.connection_tab = ConnectionTab(self.get_active_db_profile)
         self.query_cohort_tab = QueryCohortTab(self.get_db_params, self.get_active_db_profile)
+        self.cohort_compose_tab = CohortCompositionTab(self.get_db_params, self.get_active_db_profile)
         self.data_extraction_tab = BaseInfoDataExtractionTab(self.get_db_params, self.get_active_db_profile)
         self.special_data_master_tab = SpecialDataMasterTab(self.get_db_params, self.get_active_db_profile)
         self.data_export_tab = DataExportTab(self.get_db_params)
@@ -62,7 +64,7 @@ class MedicalDataExtractor(QMainWindow):
 
         # 存储所有页面，方便后续遍历
         self.all_pages = [
-            self.connection_tab, self.query_cohort_tab, self.data_extraction_tab,
+            self.connection_tab, self.query_cohort_tab, self.cohort_compose_tab, self.data_extraction_tab,
             self.special_data_master_tab, self.data_export_tab, self.data_merge_tab,
             self.structure_tab, self.data_dictionary_tab, self.sql_lab_tab, self.data_processing_tab,
             self.plotting_tab
@@ -94,6 +96,7 @@ class MedicalDataExtractor(QMainWindow):
         # --- 添加主流程 Tab ---
         self.main_tabs.addTab(self.connection_tab, "1. 数据库连接")
         self.main_tabs.addTab(self.query_cohort_tab, "2. 查找与创建队列")
+        self.main_tabs.addTab(self.cohort_compose_tab, "2b. 组合队列")
         self.main_tabs.addTab(self.data_extraction_tab, "3. 添加基础数据")
         self.main_tabs.addTab(self.special_data_master_tab, "4. 添加专项数据")
         self.main_tabs.addTab(self.data_export_tab, "5. 数据预览与导出")
@@ -0,0 +1,80 @@
+# --- START OF FILE sql_logic/build_memo.py ---
+"""
+专项数据 SQL 构建结果的进程内记忆化。
+
+面板每次发出 config_changed_signal 后，预览、代价估计与执行都会重新构建完整的 psycopg2.sql 语法树；
+选中数百个项目时构建本身就会造成界面卡顿。这里以配置的规范化可哈希形式为键缓存预览构建结果 (LRU)；
+执行计划含有每次生成的临时表名，不经过这里。
+
+- 以 "_" 开头的配置键 (如 _ui_state) 只用于恢复界面，不参与键的计算
+- 列表保持原有顺序 (项目顺序决定参数与输出列的顺序)，集合排序后参与计算
+- psycopg2.sql 对象以 repr 参与计算 (repr 包含完整的组成部分)
+- 命中时返回深拷贝，调用方修改步骤或参数列表不会污染缓存
+"""
+import copy
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Tuple
+
+import psycopg2.sql as psql
+
+from app_config import SQL_BUILD_MEMO_MAX_ENTRIES
+
+
+def freeze_value(value: Any) -> Hashable:
+    """把配置值转换为规范化的可哈希形式 (字典键顺序无关，列表顺序相关)。"""
+    if isinstance(value, dict):
+        return ("dict", tuple(sorted(
+            ((str(k), freeze_value(v)) for k, v in value.items() if not str(k).startswith("_")),
+            key=lambda item: item[0]
+        )))
+    if isinstance(value, (list, tuple)):
+        return (type(value).__name__, tuple(freeze_value(v) for v in value))
+    if isinstance(value, (set, frozenset)):
+        return ("set", tuple(sorted(repr(freeze_value(v)) for v in value)))
+    if isinstance(value, psql.Composable):
+        return ("sql", repr(value))
+    if value is None or isinstance(value, (str, bool, int, float)):
+        # 区分 1 / 1.0 / True，它们渲染出的 SQL 字面量不同
+        return (type(value).__name__, value)
+    return ("repr", type(value).__name__, repr(value))
+
+
+class BuildMemo:
+    """线程安全的 LRU 记忆化容器。"""
+
+    def __init__(self, max_entries: int = SQL_BUILD_MEMO_MAX_ENTRIES):
+        self.max_entries = max(0, int(max_entries))
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_build(self, key: Hashable, build_func: Callable[[], Any]) -> Any:
+        if self.max_entries == 0:
+            return build_func()
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(self._entries[key])
+        # 构建在锁外进行，构建期间抛出的异常不会被缓存
+        result = build_func()
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = copy.deepcopy(result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Tuple[int, int, int]:
+        """返回 (条目数, 命中次数, 未命中次数)。"""
+        with self._lock:
+            return len(self._entries), self.hits, self.misses
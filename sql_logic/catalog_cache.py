@@ -0,0 +1,88 @@
+# --- START OF FILE sql_logic/catalog_cache.py ---
+"""
+表列元数据的进程内缓存。
+
+每张表的列清单 (列名与完整类型) 用一次 pg_attribute 查询取得并缓存，构建器与面板共享。
+每次读取前先查询表的签名 (relfilenode, 现有列数)：表被重写 (TRUNCATE、VACUUM FULL、ALTER COLUMN TYPE 等)
+或增删列后签名改变，缓存随之失效并重新读取。
+缓存键包含连接的 DSN，不同数据库之间互不干扰。
+"""
+import threading
+from typing import Dict, List, Optional, Tuple
+
+_cache: Dict[Tuple[str, str, str], Dict[str, object]] = {}
+_lock = threading.Lock()
+
+
+def _fetch_table_signature(cur, schema_name: str, table_name: str) -> Optional[Tuple[int, int, int]]:
+    """返回 (oid, relfilenode, 现有列数)；表不存在时返回 None。"""
+    cur.execute("""
+        SELECT c.oid, c.relfilenode,
+               (SELECT COUNT(*) FROM pg_attribute a WHERE a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped)
+        FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = %s AND c.relname = %s
+    """, (schema_name, table_name))
+    row = cur.fetchone()
+    return (int(row[0]), int(row[1]), int(row[2])) if row else None
+
+
+def get_table_columns(cur, schema_name: str, table_name: str) -> List[Tuple[str, str]]:
+    """
+    返回表的 [(列名, 类型), ...] (按列序)。类型取自 format_type，包含长度/精度等修饰
+    (如 character varying(255))，可以直接用于 ADD COLUMN。表不存在时返回空列表。
+    """
+    table_info = _fetch_table_signature(cur, schema_name, table_name)
+    if table_info is None:
+        return []
+    table_oid, signature = table_info[0], table_info[1:]
+    key = (cur.connection.dsn, schema_name, table_name)
+    with _lock:
+        entry = _cache.get(key)
+        if entry and entry["signature"] == signature:
+            return list(entry["columns"])
+
+    cur.execute("""
+        SELECT a.attname, format_type(a.atttypid, a.atttypmod)
+        FROM pg_attribute a
+        WHERE a.attrelid = %s AND a.attnum > 0 AND NOT a.attisdropped
+        ORDER BY a.attnum
+    """, (table_oid,))
+    columns = [(row[0], row[1]) for row in cur.fetchall()]
+    with _lock:
+        _cache[key] = {"signature": signature, "columns": columns}
+    return list(columns)
+
+
+def get_table_column_types(cur, schema_name: str, table_name: str) -> Dict[str, str]:
+    """返回 {列名: 类型}。"""
+    return dict(get_table_columns(cur, schema_name, table_name))
+
+
+def clear_catalog_cache():
+    with _lock:
+        _cache.clear()
+
+
+def find_index_by_leading_columns(cur, schema_name: str, table_name: str, leading_columns: List[str]) -> Optional[str]:
+    """
+    返回表上以 leading_columns 为前导列 (顺序一致) 的有效 B-tree 索引名，没有时返回 None。
+    索引的增删不改变表签名，因此这里不做缓存。
+    """
+    cur.execute("""
+        SELECT ic.relname,
+               ARRAY(SELECT COALESCE(a.attname::TEXT, '')
+                     FROM unnest(i.indkey::INT2[]) WITH ORDINALITY AS k(attnum, ord)
+                     LEFT JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+                     ORDER BY k.ord)
+        FROM pg_index i
+        JOIN pg_class ic ON ic.oid = i.indexrelid
+        JOIN pg_class c ON c.oid = i.indrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        JOIN pg_am am ON am.oid = ic.relam
+        WHERE n.nspname = %s AND c.relname = %s AND i.indisvalid AND am.amname = 'btree'
+        ORDER BY ic.relname
+    """, (schema_name, table_name))
+    for index_name, index_columns in cur.fetchall():
+        if list(index_columns[:len(leading_columns)]) == list(leading_columns):
+            return index_name
+    return None
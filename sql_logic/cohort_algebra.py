@@ -0,0 +1,201 @@
+# --- START OF FILE sql_logic/cohort_algebra.py ---
+"""
+队列集合运算 (并 / 交 / 差)。
+
+表达式以别名 (A、B、C ...) 引用队列表，运算符:
+- 并: | 或 + 或 ∪
+- 交: & 或 ∩ (优先级高于并与差)
+- 差: - 或 − 或 \\
+可以使用括号，例如 "(A | B) - C"。
+
+集合运算只作用于画像的队列键 (MIMIC-IV 为 hadm_id，eICU 为 patientunitstayid)。
+结果表的列为所有参与运算的队列表共有的列 (类型以第一个出现的队列表为准)；
+某个键在多个队列表中都存在时，取表达式中最先出现的那个队列表的行 (保留该表中该键的全部行)。
+整个结果由一条 INSERT ... SELECT 在服务器端写入，随后建立索引并收集统计信息。
+"""
+import re
+from typing import Dict, List, Tuple, Union
+
+import psycopg2.sql as psql
+
+from sql_logic.catalog_cache import get_table_columns
+from sql_logic.narrow_store import build_drop_feature_store_step
+
+OPERATOR_KEYWORDS = {"|": "UNION", "&": "INTERSECT", "-": "EXCEPT"}
+_OPERATOR_ALIASES = {"+": "|", "∪": "|", "∩": "&", "−": "-", "\\": "-"}
+_TOKEN_PATTERN = re.compile(r"\s*(?:([A-Za-z_][A-Za-z0-9_]*)|(.))")
+
+# 表达式树: 别名字符串，或 (运算符, 左子树, 右子树)
+ExpressionTree = Union[str, Tuple[str, "ExpressionTree", "ExpressionTree"]]
+
+
+def _tokenize(expression: str) -> List[str]:
+    tokens = []
+    for match in _TOKEN_PATTERN.finditer(expression.strip()):
+        name, symbol = match.groups()
+        if name:
+            tokens.append(name.upper())
+        elif symbol and not symbol.isspace():
+            symbol = _OPERATOR_ALIASES.get(symbol, symbol)
+            if symbol not in OPERATOR_KEYWORDS and symbol not in "()":
+                raise ValueError(f"表达式中含有无法识别的字符: '{symbol}'")
+            tokens.append(symbol)
+    return tokens
+
+
+def parse_cohort_expression(expression: str, aliases: List[str]) -> ExpressionTree:
+    """把集合表达式解析为表达式树；别名未定义、括号不匹配等情况抛出 ValueError。"""
+    tokens = _tokenize(expression)
+    if not tokens:
+        raise ValueError("集合表达式为空。")
+    known_aliases = {a.upper() for a in aliases}
+    position = 0
+
+    def peek():
+        return tokens[position] if position < len(tokens) else None
+
+    def take():
+        nonlocal position
+        position += 1
+        return tokens[position - 1]
+
+    def take_if(expected):
+        return take() if peek() == expected else None
+
+    def parse_factor() -> ExpressionTree:
+        token = peek()
+        if token is None:
+            raise ValueError("表达式不完整: 运算符后缺少队列。")
+        if token == "(":
+            take()
+            node = parse_union()
+            if take_if(")") is None:
+                raise ValueError("表达式中的括号不匹配。")
+            return node
+        if token in OPERATOR_KEYWORDS or token == ")":
+            raise ValueError(f"表达式中 '{token}' 的位置不正确。")
+        if token not in known_aliases:
+            raise ValueError(f"表达式引用了未定义的队列别名: {token}")
+        return take()
+
+    def parse_intersect() -> ExpressionTree:
+        node = parse_factor()
+        while peek() == "&":
+            take()
+            node = ("&", node, parse_factor())
+        return node
+
+    def parse_union() -> ExpressionTree:
+        node = parse_intersect()
+        while peek() in ("|", "-"):
+            operator = take()
+            node = (operator, node, parse_intersect())
+        return node
+
+    tree = parse_union()
+    if position != len(tokens):
+        raise ValueError(f"表达式中 '{tokens[position]}' 的位置不正确。")
+    return tree
+
+
+def get_expression_aliases(tree: ExpressionTree) -> List[str]:
+    """按在表达式中首次出现的顺序返回引用的别名。"""
+    if isinstance(tree, str):
+        return [tree]
+    aliases = get_expression_aliases(tree[1])
+    return aliases + [a for a in get_expression_aliases(tree[2]) if a not in aliases]
+
+
+def get_contributing_aliases(tree: ExpressionTree) -> List[str]:
+    """可能为结果提供行的别名 (差运算右侧的队列只用于排除键，不提供行)，按首次出现的顺序。"""
+    if isinstance(tree, str):
+        return [tree]
+    operator, left, right = tree
+    aliases = get_contributing_aliases(left)
+    if operator == "-":
+        return aliases
+    return aliases + [a for a in get_contributing_aliases(right) if a not in aliases]
+
+
+def build_key_set_sql(tree: ExpressionTree, operand_idents: Dict[str, psql.Identifier], key_ident: psql.Identifier) -> psql.Composable:
+    """把表达式树转换为只含队列键的 UNION / INTERSECT / EXCEPT 查询 (每个子查询都加括号，优先级由表达式树决定)。"""
+    if isinstance(tree, str):
+        return psql.SQL("SELECT {key} FROM {table}").format(key=key_ident, table=operand_idents[tree])
+    operator, left, right = tree
+    return psql.SQL("({left}) {op} ({right})").format(
+        left=build_key_set_sql(left, operand_idents, key_ident),
+        op=psql.SQL(OPERATOR_KEYWORDS[operator]),
+        right=build_key_set_sql(right, operand_idents, key_ident)
+    )
+
+
+def get_common_columns(cur, schema_name: str, table_names: List[str]) -> List[Tuple[str, str]]:
+    """返回所有队列表共有的 [(列名, 类型), ...]，列序与类型以第一个队列表为准。"""
+    column_sets = [get_table_columns(cur, schema_name, t) for t in table_names]
+    for table_name, columns in zip(table_names, column_sets):
+        if not columns:
+            raise ValueError(f"队列表 {schema_name}.{table_name} 不存在或没有列。")
+    shared_names = set.intersection(*({name for name, _ in columns} for columns in column_sets))
+    return [(name, col_type) for name, col_type in column_sets[0] if name in shared_names]
+
+
+def build_cohort_composition_steps(
+    target_table_ident: psql.Identifier,
+    operand_tables: Dict[str, str],
+    expression: str,
+    key_column: str,
+    common_columns: List[Tuple[str, str]],
+    index_columns: List[str]
+) -> Tuple[List[Tuple[psql.Composable, None]], List[str]]:
+    """
+    构建在同一事务中依次执行的步骤 [(SQL, None), ...]，并返回表达式实际引用的别名。
+    operand_tables 为 {别名: 队列表名}，队列表与目标表位于同一 schema。
+    """
+    schema_name, target_name = target_table_ident.strings
+    tree = parse_cohort_expression(expression, list(operand_tables.keys()))
+    used_aliases = get_expression_aliases(tree)
+    alias_to_table = {alias.upper(): table for alias, table in operand_tables.items()}
+    if target_name in (alias_to_table[a] for a in used_aliases):
+        raise ValueError("结果表不能与参与运算的队列表同名。")
+    column_names = [name for name, _ in common_columns]
+    if key_column not in column_names:
+        raise ValueError(f"参与运算的队列表没有共同的队列键列 '{key_column}'。")
+
+    key_ident = psql.Identifier(key_column)
+    operand_idents = {a: psql.Identifier(schema_name, alias_to_table[a]) for a in used_aliases}
+    col_idents = psql.SQL(", ").join(psql.Identifier(name) for name in column_names)
+    # 各队列表同名列的类型可能不同 (如窄表特征写入前后)，统一转换为第一个队列表的类型
+    cast_cols = psql.SQL(", ").join(
+        psql.SQL("CAST(o.{col} AS {type}) AS {col}").format(col=psql.Identifier(name), type=psql.SQL(col_type))
+        for name, col_type in common_columns
+    )
+    key_set_sql = build_key_set_sql(tree, operand_idents, key_ident)
+    contributing_aliases = get_contributing_aliases(tree)
+    operand_selects = [
+        psql.SQL("SELECT {cols}, {rank} AS operand_rank FROM {table} o WHERE o.{key} IN (SELECT {key} FROM cohort_keys)").format(
+            cols=cast_cols, rank=psql.Literal(rank), table=operand_idents[alias], key=key_ident
+        )
+        for rank, alias in enumerate(contributing_aliases, start=1)
+    ]
+    if len(operand_selects) == 1:
+        rows_sql = psql.SQL("SELECT {cols} FROM ({operand_select}) src").format(cols=col_idents, operand_select=operand_selects[0])
+    else:
+        rows_sql = psql.SQL("""SELECT {cols} FROM (
+    SELECT src.*, MIN(src.operand_rank) OVER (PARTITION BY src.{key}) AS first_rank
+    FROM ({operand_selects}) src
+) ranked
+WHERE ranked.operand_rank = ranked.first_rank""").format(cols=col_idents, key=key_ident, operand_selects=psql.SQL(" UNION ALL ").join(operand_selects))
+    insert_sql = psql.SQL("INSERT INTO {target} ({cols})\nWITH cohort_keys AS ({key_set})\n{rows}").format(
+        target=target_table_ident, cols=col_idents, key_set=key_set_sql, rows=rows_sql
+    )
+    create_sql = psql.SQL("DROP TABLE IF EXISTS {target}; CREATE TABLE {target} ({defs})").format(
+        target=target_table_ident,
+        defs=psql.SQL(", ").join(psql.SQL("{} {}").format(psql.Identifier(name), psql.SQL(col_type)) for name, col_type in common_columns)
+    )
+    # 同名旧结果表的窄表特征、增量标记表与分箱长表不再对应新结果，先行删除
+    steps = [build_drop_feature_store_step(target_table_ident), (create_sql, None), (insert_sql, None)]
+    for column in dict.fromkeys([key_column] + list(index_columns)):
+        if column in column_names:
+            steps.append((psql.SQL("CREATE INDEX ON {} ({})").format(target_table_ident, psql.Identifier(column)), None))
+    steps.append((psql.SQL("ANALYZE {}").format(target_table_ident), None))
+    return steps, used_aliases
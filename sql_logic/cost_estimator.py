@@ -0,0 +1,124 @@
+# --- START OF FILE sql_logic/cost_estimator.py ---
+"""
+执行前代价估计。
+
+对生成的 CREATE TEMPORARY TABLE ... AS 查询执行 EXPLAIN (FORMAT JSON) (不会真正执行)，
+汇总规划器给出的总代价、结果行数，以及每个被扫描关系的扫描方式与估计扫描行数。
+顺序扫描的扫描行数取自 pg_class.reltuples，其余扫描方式取规划器估计的输出行数。
+"""
+import json
+from typing import Any, Dict, List, Optional
+
+import psycopg2.sql as psql
+
+from app_config import MERGE_COST_WARN_THRESHOLD, MERGE_COST_BLOCK_THRESHOLD
+from sql_logic.sampling import get_relation_estimate
+
+COST_LEVEL_OK = "ok"
+COST_LEVEL_WARN = "warn"
+COST_LEVEL_BLOCK = "block"
+
+_INDEX_SCAN_TYPES = {"Index Scan", "Index Only Scan", "Bitmap Heap Scan"}
+
+
+def _leading_text(sql_obj: Any) -> str:
+    """返回 SQL 对象开头的字面文本，用于识别步骤类型。"""
+    if isinstance(sql_obj, psql.Composed):
+        return _leading_text(sql_obj.seq[0]) if sql_obj.seq else ""
+    if isinstance(sql_obj, psql.SQL):
+        return sql_obj.string
+    return sql_obj if isinstance(sql_obj, str) else ""
+
+
+def find_compute_step(execution_steps: List[Any]) -> Optional[Any]:
+    """从执行步骤中找到计算聚合结果的 CREATE TEMPORARY TABLE ... AS 步骤。"""
+    for step in execution_steps:
+        if _leading_text(step[0]).lstrip().upper().startswith("CREATE TEMPORARY TABLE"):
+            return step
+    return None
+
+
+def _walk_plan(node: Dict[str, Any], scans: List[Dict[str, Any]]):
+    if "Relation Name" in node:
+        scans.append({
+            "schema": node.get("Schema"),
+            "relation": node["Relation Name"],
+            "node_type": node.get("Node Type"),
+            "index_name": node.get("Index Name"),
+            "plan_rows": int(node.get("Plan Rows", 0)),
+        })
+    for child in node.get("Plans", []):
+        _walk_plan(child, scans)
+
+
+def classify_cost(total_cost: Optional[float]) -> str:
+    if total_cost is None:
+        return COST_LEVEL_OK
+    if MERGE_COST_BLOCK_THRESHOLD is not None and total_cost > MERGE_COST_BLOCK_THRESHOLD:
+        return COST_LEVEL_BLOCK
+    if MERGE_COST_WARN_THRESHOLD is not None and total_cost > MERGE_COST_WARN_THRESHOLD:
+        return COST_LEVEL_WARN
+    return COST_LEVEL_OK
+
+
+def explain_query_cost(cur, sql_obj: Any, params: Optional[List[Any]] = None) -> Dict[str, Any]:
+    """
+    对 sql_obj 执行 EXPLAIN (FORMAT JSON, VERBOSE) 并汇总结果 (VERBOSE 才会给出关系所在 schema)。返回字典:
+        total_cost, plan_rows, rows_scanned, scans (每个关系的扫描信息),
+        uses_index (所有被扫描关系是否都使用了索引), level (ok / warn / block)
+    """
+    explain_sql = psql.SQL("EXPLAIN (FORMAT JSON, VERBOSE) {}").format(sql_obj if isinstance(sql_obj, psql.Composable) else psql.SQL(sql_obj))
+    cur.execute(explain_sql, params if params else None)
+    raw = cur.fetchone()[0]
+    plan_doc = json.loads(raw) if isinstance(raw, str) else raw
+    root = plan_doc[0]["Plan"]
+
+    scans: List[Dict[str, Any]] = []
+    _walk_plan(root, scans)
+    for scan in scans:
+        scan["uses_index"] = scan["node_type"] in _INDEX_SCAN_TYPES
+        scan["rows_scanned"] = scan["plan_rows"]
+        if scan["node_type"] == "Seq Scan" and scan["schema"]:
+            estimated_rows, _ = get_relation_estimate(cur, scan["schema"], scan["relation"])
+            if estimated_rows is not None:
+                scan["rows_scanned"] = estimated_rows
+
+    total_cost = float(root.get("Total Cost", 0.0))
+    return {
+        "total_cost": total_cost,
+        "plan_rows": int(root.get("Plan Rows", 0)),
+        "rows_scanned": sum(s["rows_scanned"] for s in scans),
+        "scans": scans,
+        "uses_index": bool(scans) and all(s["uses_index"] for s in scans),
+        "level": classify_cost(total_cost),
+    }
+
+
+def estimate_execution_steps_cost(cur, execution_steps: List[Any]) -> Optional[Dict[str, Any]]:
+    """估计执行步骤中计算步骤的代价；找不到计算步骤时返回 None。数据库错误由调用方处理。"""
+    step = find_compute_step(execution_steps)
+    if step is None:
+        return None
+    return explain_query_cost(cur, step[0], step[1])
+
+
+def format_cost_summary(estimate: Optional[Dict[str, Any]], event_table: Optional[str] = None) -> str:
+    """生成供界面显示的代价摘要文本。给定 event_table 时单独标明事件表是否使用索引扫描。"""
+    if not estimate:
+        return "无法估计执行代价。"
+    lines = [
+        f"规划器总代价: {estimate['total_cost']:,.0f}",
+        f"估计扫描行数: {estimate['rows_scanned']:,}",
+        f"估计结果行数: {estimate['plan_rows']:,}",
+    ]
+    event_scans = []
+    for scan in estimate["scans"]:
+        full_name = f"{scan['schema']}.{scan['relation']}" if scan["schema"] else scan["relation"]
+        if event_table and event_table in (full_name, scan["relation"]):
+            event_scans.append(scan)
+        index_part = f" ({scan['index_name']})" if scan.get("index_name") else ""
+        lines.append(f" - {full_name}: {scan['node_type']}{index_part}, 约 {scan['rows_scanned']:,} 行")
+    if event_scans:
+        lines.append(f"事件表使用索引扫描: {'是' if all(s['uses_index'] for s in event_scans) else '否'}")
+    return "\n".join(lines)
+
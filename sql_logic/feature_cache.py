@@ -0,0 +1,224 @@
+# --- START OF FILE sql_logic/feature_cache.py ---
+"""
+专项数据特征缓存 (feature store)。
+
+同一特征 (相同事件表、项目、时间窗口与聚合方式) 经常被重复提取到不同队列，或在失败后重新提取。
+这里把每个特征按连接键的计算结果保存在独立的缓存表中，合并时只计算缓存中缺失的键，
+再从缓存表写回队列表。
+
+- 缓存表: {FEATURE_CACHE_SCHEMA}.f_<hash>，列为 (连接键, 各输出列)，输出列名与用户的列基础名无关
+- 登记表: {FEATURE_CACHE_SCHEMA}.feature_registry，记录源表、失效水位线、大小与最近使用时间
+- 失效:   源表的 relfilenode (TRUNCATE / VACUUM FULL 后变化) 与 pg_stat 中累计的增删改行数任一变化时清空缓存表
+- 淘汰:   按最近使用时间 (LRU) 保留不超过 FEATURE_CACHE_MAX_ENTRIES 个、总计不超过 FEATURE_CACHE_MAX_BYTES 的缓存
+
+注意：缓存按连接键保存结果。时间窗口以队列表中的锚点列 (如 icu_intime) 为起点时，
+假定同一连接键在不同队列中的锚点相同 (由同一数据库画像的队列创建逻辑生成)。
+"""
+import hashlib
+import json
+from typing import Any, Dict, List, Tuple
+
+import psycopg2.sql as psql
+
+from app_config import FEATURE_CACHE_SCHEMA, FEATURE_CACHE_MAX_ENTRIES, FEATURE_CACHE_MAX_BYTES
+
+# 缓存表中输出列使用的固定基础名 (例如 feature_mean)，使不同列名的提取可以共用同一缓存
+FEATURE_CACHE_COLUMN_BASE = "feature"
+# 缓存格式版本，修改缓存表结构或聚合语义时递增，使旧缓存自然失效
+FEATURE_CACHE_VERSION = 2
+
+# 仅影响界面显示或列命名、不影响计算结果的配置键
+_NON_SEMANTIC_CONFIG_KEYS = {"primary_item_label_for_naming"}
+# 顺序不影响结果的列表键 (规范化时排序)；其余列表与元组 (如 (字段, 运算符, 值) 明细过滤条件) 保持原顺序
+_ORDER_INSENSITIVE_CONFIG_KEYS = {"selected_item_ids"}
+
+_REGISTRY_TABLE = "feature_registry"
+
+
+def _sorted_scalars(items: List[Any]) -> List[Any]:
+    return sorted(items, key=lambda v: (type(v).__name__, v)) if all(isinstance(v, (str, int, float)) for v in items) else items
+
+
+def _canonicalize(value: Any) -> Any:
+    if isinstance(value, dict):
+        canonical = {}
+        for k, v in value.items():
+            if k in _NON_SEMANTIC_CONFIG_KEYS or str(k).startswith("_"):
+                continue
+            v = _canonicalize(v)
+            canonical[str(k)] = _sorted_scalars(v) if k in _ORDER_INSENSITIVE_CONFIG_KEYS and isinstance(v, list) else v
+        return canonical
+    if isinstance(value, set):
+        return _sorted_scalars([_canonicalize(v) for v in value])
+    if isinstance(value, (list, tuple)):
+        return [_canonicalize(v) for v in value]
+    if isinstance(value, psql.Composable):
+        return repr(value)
+    return value
+
+
+def compute_feature_hash(panel_specific_config: Dict[str, Any], profile_name: str, join_key: str) -> str:
+    """基于规范化后的面板配置计算特征哈希。"""
+    payload = {
+        "version": FEATURE_CACHE_VERSION,
+        "profile": profile_name,
+        "join_key": join_key,
+        "config": _canonicalize(panel_specific_config),
+    }
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()
+
+
+def get_cache_table_ident(feature_hash: str) -> psql.Identifier:
+    return psql.Identifier(FEATURE_CACHE_SCHEMA, f"f_{feature_hash[:32]}")
+
+
+def _registry_ident() -> psql.Identifier:
+    return psql.Identifier(FEATURE_CACHE_SCHEMA, _REGISTRY_TABLE)
+
+
+def _watermark_exprs(source_table: str) -> Tuple[psql.Composable, psql.Composable]:
+    source_literal = psql.Literal(source_table)
+    relfilenode_expr = psql.SQL(
+        "COALESCE((SELECT c.relfilenode::BIGINT FROM pg_class c WHERE c.oid = to_regclass({src})), 0)"
+    ).format(src=source_literal)
+    mods_expr = psql.SQL(
+        "COALESCE((SELECT s.n_tup_ins + s.n_tup_upd + s.n_tup_del FROM pg_stat_all_tables s WHERE s.relid = to_regclass({src})), 0)"
+    ).format(src=source_literal)
+    return relfilenode_expr, mods_expr
+
+
+def build_cache_setup_steps(
+    cache_ident: psql.Identifier,
+    empty_query: psql.Composable,
+    query_params: List[Any],
+    join_key: psql.Identifier
+) -> List[Tuple[psql.Composable, Any]]:
+    """创建缓存 schema、登记表以及当前特征的缓存表 (结构由 empty_query 决定)。"""
+    create_registry = psql.SQL(
+        "CREATE SCHEMA IF NOT EXISTS {schema}; "
+        "CREATE TABLE IF NOT EXISTS {registry} ("
+        "feature_hash TEXT PRIMARY KEY, cache_table TEXT NOT NULL, source_table TEXT, join_key TEXT, "
+        "config_json JSONB, source_relfilenode BIGINT, source_mod_watermark BIGINT, "
+        "row_count BIGINT, size_bytes BIGINT, created_at TIMESTAMPTZ DEFAULT NOW(), last_used_at TIMESTAMPTZ DEFAULT NOW())"
+    ).format(schema=psql.Identifier(FEATURE_CACHE_SCHEMA), registry=_registry_ident())
+    create_cache = psql.SQL("CREATE TABLE IF NOT EXISTS {cache} AS {query} WITH NO DATA").format(
+        cache=cache_ident, query=empty_query
+    )
+    create_index = psql.SQL("CREATE UNIQUE INDEX IF NOT EXISTS {idx} ON {cache} ({key})").format(
+        idx=psql.Identifier(f"{cache_ident.strings[1]}_key_idx"), cache=cache_ident, key=join_key
+    )
+    return [(create_registry, None), (create_cache, query_params), (create_index, None)]
+
+
+def build_invalidation_step(feature_hash: str, cache_ident: psql.Identifier, source_table: str) -> Tuple[psql.Composable, Any]:
+    """源表水位线与登记时不一致时清空缓存表。"""
+    relfilenode_expr, mods_expr = _watermark_exprs(source_table)
+    return psql.SQL(
+        "DELETE FROM {cache} WHERE EXISTS (SELECT 1 FROM {registry} r WHERE r.feature_hash = {hash} "
+        "AND (r.source_relfilenode, r.source_mod_watermark) IS DISTINCT FROM ({relfilenode}, {mods}))"
+    ).format(
+        cache=cache_ident, registry=_registry_ident(), hash=psql.Literal(feature_hash),
+        relfilenode=relfilenode_expr, mods=mods_expr
+    ), None
+
+
+def build_missing_keys_source(
+    target_table_ident: psql.Identifier,
+    cache_ident: psql.Identifier,
+    join_key: psql.Identifier
+) -> psql.Composable:
+    """返回只包含缓存中尚无结果的队列行的子查询，可直接替代队列表作为 FilteredEvents 的关联源。"""
+    return psql.SQL(
+        "(SELECT * FROM {tgt} t WHERE NOT EXISTS (SELECT 1 FROM {cache} c WHERE c.{key} = t.{key}))"
+    ).format(tgt=target_table_ident, cache=cache_ident, key=join_key)
+
+
+def build_cache_fill_steps(
+    target_table_ident: psql.Identifier,
+    cache_ident: psql.Identifier,
+    join_key: psql.Identifier,
+    compute_query: psql.Composable,
+    query_params: List[Any],
+    cache_columns: List[psql.Identifier]
+) -> List[Tuple[psql.Composable, Any]]:
+    """
+    计算缺失键并写入缓存。compute_query 只覆盖有事件的键，
+    其余缺失键随后以 NULL 写入，避免下次合并时重复计算。
+    """
+    column_list = psql.SQL(', ').join([join_key] + cache_columns)
+    insert_computed = psql.SQL("INSERT INTO {cache} ({cols}) SELECT {cols} FROM ({query}) computed").format(
+        cache=cache_ident, cols=column_list, query=compute_query
+    )
+    insert_empty = psql.SQL(
+        "INSERT INTO {cache} ({key}) SELECT DISTINCT t.{key} FROM {tgt} t "
+        "WHERE t.{key} IS NOT NULL AND NOT EXISTS (SELECT 1 FROM {cache} c WHERE c.{key} = t.{key})"
+    ).format(cache=cache_ident, key=join_key, tgt=target_table_ident)
+    return [(insert_computed, query_params), (insert_empty, None)]
+
+
+def build_cache_read_query(
+    target_table_ident: psql.Identifier,
+    cache_ident: psql.Identifier,
+    join_key: psql.Identifier,
+    column_mapping: List[Tuple[psql.Identifier, psql.Identifier]]
+) -> psql.Composable:
+    """从缓存读取队列所需的键，并把缓存列重命名为目标列名 (column_mapping 为 [(缓存列, 目标列)])。"""
+    cols = [psql.SQL("c.{}").format(join_key)] + [
+        psql.SQL("c.{} AS {}").format(cache_col, target_col) for cache_col, target_col in column_mapping
+    ]
+    return psql.SQL("SELECT {cols} FROM {cache} c WHERE c.{key} IN (SELECT {key} FROM {tgt})").format(
+        cols=psql.SQL(', ').join(cols), cache=cache_ident, key=join_key, tgt=target_table_ident
+    )
+
+
+def build_registry_upsert_step(
+    feature_hash: str,
+    cache_ident: psql.Identifier,
+    source_table: str,
+    join_key: str,
+    config_json: str
+) -> Tuple[psql.Composable, Any]:
+    """登记或刷新缓存条目的水位线、大小与最近使用时间。"""
+    relfilenode_expr, mods_expr = _watermark_exprs(source_table)
+    cache_name = ".".join(cache_ident.strings)
+    return psql.SQL(
+        "INSERT INTO {registry} AS r (feature_hash, cache_table, source_table, join_key, config_json, "
+        "source_relfilenode, source_mod_watermark, row_count, size_bytes, last_used_at) "
+        "VALUES ({hash}, {cache_name}, {src}, {key}, {cfg}::JSONB, {relfilenode}, {mods}, "
+        "(SELECT COUNT(*) FROM {cache}), pg_total_relation_size({cache_name}), NOW()) "
+        "ON CONFLICT (feature_hash) DO UPDATE SET source_relfilenode = EXCLUDED.source_relfilenode, "
+        "source_mod_watermark = EXCLUDED.source_mod_watermark, row_count = EXCLUDED.row_count, "
+        "size_bytes = EXCLUDED.size_bytes, last_used_at = NOW()"
+    ).format(
+        registry=_registry_ident(), hash=psql.Literal(feature_hash), cache_name=psql.Literal(cache_name),
+        src=psql.Literal(source_table), key=psql.Literal(join_key), cfg=psql.Literal(config_json),
+        relfilenode=relfilenode_expr, mods=mods_expr, cache=cache_ident
+    ), None
+
+
+def build_eviction_step(
+    keep_feature_hash: str,
+    max_entries: int = FEATURE_CACHE_MAX_ENTRIES,
+    max_bytes: int = FEATURE_CACHE_MAX_BYTES
+) -> Tuple[psql.Composable, Any]:
+    """按最近使用时间淘汰超出条目数或总大小上限的缓存 (当前特征除外)。"""
+    return psql.SQL(
+        "DO $$ DECLARE r RECORD; BEGIN "
+        "FOR r IN SELECT feature_hash, cache_table FROM ("
+        "SELECT feature_hash, cache_table, "
+        "ROW_NUMBER() OVER (ORDER BY (feature_hash = {keep}) DESC, last_used_at DESC) AS rn, "
+        "SUM(COALESCE(size_bytes, 0)) OVER (ORDER BY (feature_hash = {keep}) DESC, last_used_at DESC) AS cum_bytes "
+        "FROM {registry}) ranked "
+        "WHERE feature_hash <> {keep} AND (rn > {max_entries} OR cum_bytes > {max_bytes}) LOOP "
+        "EXECUTE 'DROP TABLE IF EXISTS ' || r.cache_table; "
+        "DELETE FROM {registry} WHERE feature_hash = r.feature_hash; "
+        "END LOOP; END $$"
+    ).format(
+        keep=psql.Literal(keep_feature_hash), registry=_registry_ident(),
+        max_entries=psql.Literal(int(max_entries)), max_bytes=psql.Literal(int(max_bytes))
+    ), None
+
+
+def serialize_config_for_registry(panel_specific_config: Dict[str, Any]) -> str:
+    return json.dumps(_canonicalize(panel_specific_config), sort_keys=True, ensure_ascii=False, default=str)
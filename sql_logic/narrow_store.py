@@ -0,0 +1,216 @@
+# --- START OF FILE sql_logic/narrow_store.py ---
+"""
+窄表特征存储。
+
+原地更新与重建表两种写入方式都会加宽队列表：列数受 PostgreSQL 1600 列上限约束，
+每次 UPDATE 还要重写整行。窄表方式下每次提取 (或一次批量提取) 写入一张独立的特征表：
+
+- 特征表: {schema}.{队列表}__f__<列基础名>，列为 (连接键, 各输出列)
+- 宽视图: {schema}.{队列表}__wide = 队列表 LEFT JOIN 所有特征表，每次写入后重新生成
+
+同名列以最新写入的特征表为准 (写入时从其他特征表中删除同名列)，特征表的列同样覆盖队列表中的同名列。
+数据导出与绘图选项卡选择队列表时，若存在宽视图则自动改为读取宽视图。
+
+队列表的其他派生表同样与队列表同 schema：增量模式的已计算标记表 {队列表}__computed 与分箱长表 {队列表}__binned。
+它们和特征表一样只对应当前队列，以同名重新创建队列表时一并删除，并在队列表列表中隐藏。
+"""
+import hashlib
+from typing import List, Optional, Tuple
+
+import psycopg2.sql as psql
+
+FEATURE_TABLE_INFIX = "__f__"
+WIDE_VIEW_SUFFIX = "__wide"
+COMPUTED_MARKER_SUFFIX = "__computed"
+BINNED_TABLE_SUFFIX = "__binned"
+
+# PostgreSQL 标识符长度上限
+_MAX_IDENTIFIER_LENGTH = 63
+# 特征表名前缀 (队列表名 + 中缀) 的最大长度，为列基础名保留足够空间
+_MAX_PREFIX_LENGTH = 48
+
+
+def get_feature_table_prefix(cohort_table_name: str) -> Optional[str]:
+    """返回队列表的特征表名前缀；队列表名过长时返回 None (无法使用窄表存储)。"""
+    prefix = f"{cohort_table_name}{FEATURE_TABLE_INFIX}"
+    return prefix if len(prefix) <= _MAX_PREFIX_LENGTH else None
+
+
+def get_feature_table_name(cohort_table_name: str, feature_base_name: str) -> str:
+    prefix = get_feature_table_prefix(cohort_table_name)
+    if prefix is None:
+        raise ValueError(f"队列表名 '{cohort_table_name}' 过长，无法使用窄表存储")
+    name = f"{prefix}{feature_base_name}"
+    if len(name) > _MAX_IDENTIFIER_LENGTH:
+        # 截断后附加哈希，避免不同的长基础名截断为同一表名
+        digest = hashlib.sha1(feature_base_name.encode("utf-8")).hexdigest()[:8]
+        name = f"{name[:_MAX_IDENTIFIER_LENGTH - 9]}_{digest}"
+    return name
+
+
+def get_wide_view_name(cohort_table_name: str) -> str:
+    return f"{cohort_table_name}{WIDE_VIEW_SUFFIX}"[:_MAX_IDENTIFIER_LENGTH]
+
+
+def get_computed_marker_name(cohort_table_name: str) -> str:
+    return f"{cohort_table_name}{COMPUTED_MARKER_SUFFIX}"[:_MAX_IDENTIFIER_LENGTH]
+
+
+def get_binned_table_name(cohort_table_name: str) -> str:
+    return f"{cohort_table_name}{BINNED_TABLE_SUFFIX}"[:_MAX_IDENTIFIER_LENGTH]
+
+
+def is_narrow_store_relation(relation_name: str) -> bool:
+    """是否为队列表的内部派生关系 (特征表、宽视图、已计算标记表或分箱长表)，在队列表列表中应隐藏。"""
+    return FEATURE_TABLE_INFIX in relation_name or relation_name.endswith(
+        (WIDE_VIEW_SUFFIX, COMPUTED_MARKER_SUFFIX, BINNED_TABLE_SUFFIX)
+    )
+
+
+def build_drop_wide_view_step(target_table_ident: psql.Identifier) -> Tuple[psql.Composable, None]:
+    """删除宽视图 (删除或替换队列表、删除其列之前需要先解除视图依赖)。"""
+    schema_name, table_only_name = target_table_ident.strings
+    return (psql.SQL("DROP VIEW IF EXISTS {}").format(psql.Identifier(schema_name, get_wide_view_name(table_only_name))), None)
+
+
+def build_refresh_wide_view_step(
+    target_table_ident: psql.Identifier,
+    group_by_key: psql.Identifier,
+    claimed_table_name: Optional[str] = None,
+    claimed_columns: Optional[List[str]] = None
+) -> Tuple[psql.Composable, None]:
+    """
+    重新生成宽视图 (服务器端 DO 块，列清单在执行时从系统目录读取)。
+    DO 块中含有 format() 的 % 占位符，因此该步骤必须以 params=None 执行。
+    给定 claimed_table_name 时，先从其他特征表中删除 claimed_columns 中的同名列，删空的特征表随之删除。
+    队列表没有任何特征表时只删除旧视图，不创建新视图。
+    """
+    schema_name, table_only_name = target_table_ident.strings
+    return (psql.SQL("""DO $narrow$
+DECLARE
+    v_schema TEXT := {schema};
+    v_cohort TEXT := {cohort};
+    v_prefix TEXT := {prefix};
+    v_view TEXT := {view};
+    v_key TEXT := {key};
+    v_claimed TEXT := {claimed};
+    v_claimed_cols TEXT[] := {claimed_cols};
+    v_seen TEXT[] := ARRAY[]::TEXT[];
+    v_feature_cols TEXT := '';
+    v_joins TEXT := '';
+    v_cohort_cols TEXT;
+    v_col TEXT;
+    r RECORD;
+    i INTEGER := 0;
+BEGIN
+    EXECUTE format('DROP VIEW IF EXISTS %I.%I', v_schema, v_view);
+    IF v_claimed IS NOT NULL THEN
+        FOR r IN SELECT c.relname::TEXT AS relname FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+                 WHERE n.nspname = v_schema AND c.relkind = 'r' AND LEFT(c.relname, LENGTH(v_prefix)) = v_prefix AND c.relname <> v_claimed LOOP
+            FOR v_col IN SELECT a.attname::TEXT FROM pg_attribute a
+                         WHERE a.attrelid = format('%I.%I', v_schema, r.relname)::REGCLASS AND a.attnum > 0 AND NOT a.attisdropped
+                           AND a.attname::TEXT = ANY(v_claimed_cols) LOOP
+                EXECUTE format('ALTER TABLE %I.%I DROP COLUMN %I', v_schema, r.relname, v_col);
+            END LOOP;
+            IF NOT EXISTS (SELECT 1 FROM pg_attribute a
+                           WHERE a.attrelid = format('%I.%I', v_schema, r.relname)::REGCLASS AND a.attnum > 0 AND NOT a.attisdropped
+                             AND a.attname::TEXT <> v_key) THEN
+                EXECUTE format('DROP TABLE %I.%I', v_schema, r.relname);
+            END IF;
+        END LOOP;
+    END IF;
+    FOR r IN SELECT c.relname::TEXT AS relname FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+             WHERE n.nspname = v_schema AND c.relkind = 'r' AND LEFT(c.relname, LENGTH(v_prefix)) = v_prefix
+             ORDER BY c.relname LOOP
+        i := i + 1;
+        FOR v_col IN SELECT a.attname::TEXT FROM pg_attribute a
+                     WHERE a.attrelid = format('%I.%I', v_schema, r.relname)::REGCLASS AND a.attnum > 0 AND NOT a.attisdropped
+                       AND a.attname::TEXT <> v_key ORDER BY a.attnum LOOP
+            IF NOT v_col = ANY(v_seen) THEN
+                v_feature_cols := v_feature_cols || ', f' || i || '.' || quote_ident(v_col);
+                v_seen := v_seen || v_col;
+            END IF;
+        END LOOP;
+        v_joins := v_joins || format(' LEFT JOIN %I.%I ', v_schema, r.relname) || 'f' || i
+                   || ' ON f' || i || format('.%I = c.%I', v_key, v_key);
+    END LOOP;
+    IF i = 0 THEN
+        RETURN;
+    END IF;
+    SELECT string_agg(format('c.%I', a.attname), ', ' ORDER BY a.attnum) INTO v_cohort_cols FROM pg_attribute a
+    WHERE a.attrelid = format('%I.%I', v_schema, v_cohort)::REGCLASS AND a.attnum > 0 AND NOT a.attisdropped
+      AND NOT a.attname::TEXT = ANY(v_seen);
+    EXECUTE format('CREATE VIEW %I.%I AS SELECT ', v_schema, v_view) || v_cohort_cols || v_feature_cols
+            || format(' FROM %I.%I c', v_schema, v_cohort) || v_joins;
+END
+$narrow$""").format(
+        schema=psql.Literal(schema_name), cohort=psql.Literal(table_only_name),
+        prefix=psql.Literal(get_feature_table_prefix(table_only_name) or f"{table_only_name}{FEATURE_TABLE_INFIX}"),
+        view=psql.Literal(get_wide_view_name(table_only_name)), key=psql.Literal(group_by_key.string),
+        claimed=psql.Literal(claimed_table_name), claimed_cols=psql.SQL("CAST({} AS TEXT[])").format(psql.Literal(list(claimed_columns or [])))
+    ), None)
+
+
+def build_drop_feature_store_step(target_table_ident: psql.Identifier) -> Tuple[psql.Composable, None]:
+    """
+    删除队列表的宽视图、全部特征表、已计算标记表与分箱长表
+    (以同名重新创建或替换队列表时，旧特征与标记不再对应新队列)。
+    """
+    schema_name, table_only_name = target_table_ident.strings
+    return (psql.SQL("""DO $narrow$
+DECLARE
+    v_schema TEXT := {schema};
+    v_prefix TEXT := {prefix};
+    r RECORD;
+BEGIN
+    EXECUTE format('DROP VIEW IF EXISTS %I.%I', v_schema, {view});
+    FOR r IN SELECT c.relname::TEXT AS relname FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+             WHERE n.nspname = v_schema AND c.relkind = 'r' AND LEFT(c.relname, LENGTH(v_prefix)) = v_prefix LOOP
+        EXECUTE format('DROP TABLE %I.%I', v_schema, r.relname);
+    END LOOP;
+    EXECUTE format('DROP TABLE IF EXISTS %I.%I', v_schema, {marker});
+    EXECUTE format('DROP TABLE IF EXISTS %I.%I', v_schema, {binned});
+END
+$narrow$""").format(
+        schema=psql.Literal(schema_name), view=psql.Literal(get_wide_view_name(table_only_name)),
+        prefix=psql.Literal(f"{table_only_name}{FEATURE_TABLE_INFIX}"),
+        marker=psql.Literal(get_computed_marker_name(table_only_name)),
+        binned=psql.Literal(get_binned_table_name(table_only_name))
+    ), None)
+
+
+def build_feature_table_steps(
+    target_table_ident: psql.Identifier,
+    source_ident: psql.Identifier,
+    selected_methods: List[Tuple[str, psql.Identifier, object, psql.SQL, str]],
+    group_by_key: psql.Identifier,
+    feature_base_name: str
+) -> List[Tuple[psql.Composable, None]]:
+    """
+    把 source_ident (临时表或分区中间表，列为连接键与各输出列) 中的结果写入独立特征表，再重新生成宽视图。
+    同一列基础名再次写入时替换整张特征表。
+    """
+    schema_name, table_only_name = target_table_ident.strings
+    feature_name = get_feature_table_name(table_only_name, feature_base_name)
+    feature_ident = psql.Identifier(schema_name, feature_name)
+    src_alias = psql.Identifier("md")
+    cols = [psql.SQL("CAST({src}.{col} AS {type}) AS {col}").format(src=src_alias, col=m[1], type=m[3]) for m in selected_methods]
+    return [
+        build_drop_wide_view_step(target_table_ident),
+        (psql.SQL("DROP TABLE IF EXISTS {feat}; CREATE TABLE {feat} AS SELECT {src}.{key}, {cols} FROM {source} {src}").format(
+            feat=feature_ident, src=src_alias, key=group_by_key, cols=psql.SQL(', ').join(cols), source=source_ident
+        ), None),
+        (psql.SQL("CREATE UNIQUE INDEX ON {} ({})").format(feature_ident, group_by_key), None),
+        (psql.SQL("ANALYZE {}").format(feature_ident), None),
+        build_refresh_wide_view_step(target_table_ident, group_by_key, feature_name, [m[0] for m in selected_methods]),
+    ]
+
+
+def resolve_read_relation(cur, schema_name: str, table_name: str) -> str:
+    """读取队列表时实际使用的关系名：存在宽视图时返回宽视图名，否则返回原表名。"""
+    view_name = get_wide_view_name(table_name)
+    cur.execute(
+        "SELECT 1 FROM information_schema.views WHERE table_schema = %s AND table_name = %s",
+        (schema_name, view_name)
+    )
+    return view_name if cur.fetchone() else table_name
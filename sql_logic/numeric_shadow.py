@@ -0,0 +1,101 @@
+# --- START OF FILE sql_logic/numeric_shadow.py ---
+"""
+文本数值列的数值影子表。
+
+e-ICU 的 nursecharting / infusiondrug 把数值存放在文本列中，专项数据提取时原本要对每一行做
+CAST(NULLIF(列, '') AS NUMERIC)：既无法利用索引，遇到 'pending' 之类的非数值文本还会让整个查询报错。
+这里提供一次性的准备步骤：为源表建立物化视图，保留 (连接键, 项目列, 时间列) 等所需列，
+并用正则安全解析出数值列，再在 (连接键, 项目列, 时间列) 上建立索引。准备完成后构建器直接读取影子表。
+
+影子表定义 (由数据库画像的 NUMERIC_SHADOW_TABLES 常量提供，键为源表全名):
+    relation:        影子物化视图全名 (schema.name)
+    index_columns:   按顺序建立复合索引的列 (连接键, 项目列, 时间列)
+    extra_columns:   额外保留的原表列
+    numeric_columns: {原文本列: 影子表中的数值列}
+"""
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import psycopg2.sql as psql
+
+# 可以安全转换为 NUMERIC 的文本 (允许首尾空白、正负号、小数与科学计数法)
+NUMERIC_TEXT_PATTERN = r'^\s*[-+]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][-+]?[0-9]+)?\s*$'
+
+
+def safe_numeric_expression(value_ref: psql.Composable) -> psql.Composable:
+    """文本到 NUMERIC 的安全转换：不是数值的文本 (包括空字符串) 得到 NULL 而不是报错。"""
+    return psql.SQL("CASE WHEN {v} ~ {pattern} THEN CAST({v} AS NUMERIC) END").format(
+        v=value_ref, pattern=psql.Literal(NUMERIC_TEXT_PATTERN)
+    )
+
+
+def get_shadow_columns(shadow_def: Dict[str, Any]) -> List[str]:
+    """影子表中保留的原表列 (不含数值列)。"""
+    columns = list(shadow_def.get("index_columns", []))
+    columns.extend(c for c in shadow_def.get("extra_columns", []) if c not in columns)
+    return columns
+
+
+def build_numeric_shadow_steps(source_table: str, shadow_def: Dict[str, Any]) -> List[Tuple[psql.Composable, None]]:
+    """生成 (重新) 建立一个影子物化视图的执行步骤 (与 MergeSQLWorker 的步骤格式一致)。"""
+    schema_name, view_name = shadow_def["relation"].split(".", 1)
+    view_ident = psql.Identifier(schema_name, view_name)
+    src = psql.Identifier("src")
+
+    select_items = [psql.SQL("{}.{}").format(src, psql.Identifier(c)) for c in get_shadow_columns(shadow_def)]
+    for text_col, numeric_col in shadow_def["numeric_columns"].items():
+        select_items.append(psql.SQL("{} AS {}").format(
+            safe_numeric_expression(psql.SQL("{}.{}").format(src, psql.Identifier(text_col))),
+            psql.Identifier(numeric_col)
+        ))
+
+    index_ident = psql.Identifier(f"idx_{view_name}_{'_'.join(shadow_def['index_columns'])}"[:63])
+    return [
+        (psql.SQL("CREATE SCHEMA IF NOT EXISTS {}").format(psql.Identifier(schema_name)), None),
+        (psql.SQL("DROP MATERIALIZED VIEW IF EXISTS {}").format(view_ident), None),
+        (psql.SQL("CREATE MATERIALIZED VIEW {view} AS SELECT {items} FROM {source} {src}").format(
+            view=view_ident, items=psql.SQL(", ").join(select_items), source=psql.SQL(source_table), src=src
+        ), None),
+        (psql.SQL("CREATE INDEX {} ON {} ({})").format(
+            index_ident, view_ident, psql.SQL(", ").join(map(psql.Identifier, shadow_def["index_columns"]))
+        ), None),
+        (psql.SQL("ANALYZE {}").format(view_ident), None),
+    ]
+
+
+def find_prepared_numeric_shadows(cur, shadow_tables: Dict[str, Dict[str, Any]]) -> Set[str]:
+    """返回影子表已经建立 (且已填充数据) 的源表集合。"""
+    prepared = set()
+    for source_table, shadow_def in shadow_tables.items():
+        schema_name, view_name = shadow_def["relation"].split(".", 1)
+        cur.execute(
+            "SELECT ispopulated FROM pg_matviews WHERE schemaname = %s AND matviewname = %s",
+            (schema_name, view_name)
+        )
+        row = cur.fetchone()
+        if row and row[0]:
+            prepared.add(source_table)
+    return prepared
+
+
+def resolve_numeric_shadow(panel_specific_config: Dict[str, Any], shadow_tables: Dict[str, Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    判断一份专项数据配置能否改读影子表，可以时返回影子表定义，否则返回 None。
+    需要配置显式启用 use_numeric_shadow (影子表已准备)，且查询用到的列都保留在影子表中。
+    """
+    if not panel_specific_config.get("use_numeric_shadow") or panel_specific_config.get("is_text_extraction"):
+        return None
+    shadow_def = shadow_tables.get(panel_specific_config.get("source_event_table"))
+    if not shadow_def or panel_specific_config.get("value_column_to_extract") not in shadow_def["numeric_columns"]:
+        return None
+    # 以下配置会引用影子表中没有的列或原表本身
+    if any(panel_specific_config.get(k) for k in ("cte_join_on_cohort_override", "text_filter", "detail_table", "item_filter_conditions")):
+        return None
+    aggregation_methods = panel_specific_config.get("aggregation_methods") or {}
+    if aggregation_methods.get("MED_TIMESERIES_JSON") or aggregation_methods.get("MED_TIMESERIES_ARRAYS"):
+        return None
+    shadow_columns = get_shadow_columns(shadow_def)
+    for key in ("item_id_column_in_event_table", "time_column_in_event_table"):
+        column = panel_specific_config.get(key)
+        if column and column not in shadow_columns:
+            return None
+    return shadow_def
@@ -0,0 +1,118 @@
+# --- START OF FILE sql_logic/sampling.py ---
+"""
+预览采样策略。
+
+预览只需要几十到几百行数据，`ORDER BY RANDOM() LIMIT n` 会对整张表做一次全表扫描和排序。
+这里提供可选的廉价采样方式，并基于 pg_class.reltuples 给出行数估计 (代替 COUNT(*))：
+
+- system:    TABLESAMPLE SYSTEM (按数据块采样，最快，块内行相关)
+- bernoulli: TABLESAMPLE BERNOULLI (按行采样，需要扫描全表但无需排序)
+- key_range: 在连接键上随机选一个起点，沿索引顺序读取 n 行
+- random:    原有的 ORDER BY RANDOM() (全表排序)
+
+除 random 以外，给定相同的 seed 时采样结果可复现。
+"""
+import random
+from typing import Optional, Tuple
+
+import psycopg2.sql as psql
+
+SAMPLING_SYSTEM = "system"
+SAMPLING_BERNOULLI = "bernoulli"
+SAMPLING_KEY_RANGE = "key_range"
+SAMPLING_RANDOM = "random"
+
+# (UI显示名, 内部键)
+SAMPLING_METHODS_DISPLAY = [
+    ("块采样 (TABLESAMPLE SYSTEM)", SAMPLING_SYSTEM),
+    ("行采样 (TABLESAMPLE BERNOULLI)", SAMPLING_BERNOULLI),
+    ("主键区间采样 (Key Range)", SAMPLING_KEY_RANGE),
+    ("完全随机 (ORDER BY RANDOM)", SAMPLING_RANDOM),
+]
+
+# TABLESAMPLE 的采样比例按 limit 放大的倍数，避免采样行数不足 (SYSTEM 按块采样，方差更大)
+_OVERSAMPLE_FACTOR = {SAMPLING_SYSTEM: 5.0, SAMPLING_BERNOULLI: 2.0}
+# 估计行数不超过 limit 的该倍数时视为小表，直接按哈希排序取样 (全表扫描代价可以忽略)
+_SMALL_TABLE_FACTOR = 20
+
+# 支持 TABLESAMPLE 的关系类型：普通表、物化视图、分区表
+_SAMPLEABLE_RELKINDS = ('r', 'm', 'p')
+
+
+def get_relation_estimate(cur, schema_name: str, table_name: str) -> Tuple[Optional[int], Optional[str]]:
+    """
+    从 pg_class 读取行数估计与关系类型，返回 (estimated_rows, relkind)。
+    表从未 ANALYZE 过 (reltuples < 0，或为 0 但已有数据页) 时 estimated_rows 为 None。
+    """
+    cur.execute("""
+        SELECT c.reltuples::bigint, c.relpages, c.relkind
+        FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = %s AND c.relname = %s
+    """, (schema_name, table_name))
+    row = cur.fetchone()
+    if not row:
+        return None, None
+    reltuples, relpages, relkind = row
+    relkind = relkind.decode() if isinstance(relkind, bytes) else relkind
+    if reltuples is None or reltuples < 0 or (reltuples == 0 and relpages and relpages > 0):
+        return None, relkind
+    return int(reltuples), relkind
+
+
+def estimate_row_count(cur, schema_name: str, table_name: str) -> Optional[int]:
+    """基于统计信息的行数估计，代替 SELECT COUNT(*)。未知时返回 None。"""
+    return get_relation_estimate(cur, schema_name, table_name)[0]
+
+
+def build_sample_query(
+    table_ident: psql.Identifier,
+    limit: int,
+    method: str = SAMPLING_RANDOM,
+    seed: Optional[int] = None,
+    estimated_rows: Optional[int] = None,
+    key_column: Optional[str] = None,
+    relkind: Optional[str] = 'r'
+) -> psql.Composable:
+    """
+    生成采样查询 (不含结尾分号)，可直接执行，也可作为 CTE 的主体。
+
+    Args:
+        table_ident: 被采样的表。
+        limit: 需要的行数。
+        method: 采样方式，见 SAMPLING_* 常量。
+        seed: 随机种子，相同的种子得到相同的样本 (random 方式除外)。
+        estimated_rows: 表的估计行数 (见 estimate_row_count)，用于计算 TABLESAMPLE 比例。
+        key_column: 连接键列名，key_range 方式及小表回退排序时使用。
+        relkind: 关系类型，视图等不支持 TABLESAMPLE 的关系会自动回退。
+    """
+    limit_literal = psql.Literal(int(limit))
+    seed_value = int(seed) if seed is not None else 0
+
+    if method == SAMPLING_KEY_RANGE and not key_column:
+        method = SAMPLING_SYSTEM
+
+    if method == SAMPLING_KEY_RANGE:
+        start_fraction = random.Random(seed_value).random()
+        key_ident = psql.Identifier(key_column)
+        return psql.SQL(
+            "(SELECT * FROM {tbl} WHERE {key} >= (SELECT MIN({key}) + (MAX({key}) - MIN({key})) * {frac} FROM {tbl}) ORDER BY {key} LIMIT {lim}) "
+            "UNION ALL "
+            "(SELECT * FROM {tbl} WHERE {key} < (SELECT MIN({key}) + (MAX({key}) - MIN({key})) * {frac} FROM {tbl}) ORDER BY {key} LIMIT {lim}) "
+            "LIMIT {lim}"
+        ).format(tbl=table_ident, key=key_ident, frac=psql.Literal(round(start_fraction, 6)), lim=limit_literal)
+
+    if method in _OVERSAMPLE_FACTOR:
+        is_small = estimated_rows is None or estimated_rows <= limit * _SMALL_TABLE_FACTOR
+        if relkind in _SAMPLEABLE_RELKINDS and not is_small:
+            percent = min(100.0, limit * _OVERSAMPLE_FACTOR[method] * 100.0 / estimated_rows)
+            return psql.SQL("SELECT * FROM {tbl} TABLESAMPLE {method} ({pct}) REPEATABLE ({seed}) LIMIT {lim}").format(
+                tbl=table_ident, method=psql.SQL(method.upper()), pct=psql.Literal(round(percent, 6)),
+                seed=psql.Literal(seed_value), lim=limit_literal
+            )
+        # 小表、行数未知或不支持 TABLESAMPLE 的关系：按键的哈希排序，结果同样可复现
+        if key_column:
+            return psql.SQL("SELECT * FROM {tbl} ORDER BY MD5(CAST({key} AS TEXT) || {seed}) LIMIT {lim}").format(
+                tbl=table_ident, key=psql.Identifier(key_column), seed=psql.Literal(str(seed_value)), lim=limit_literal
+            )
+
+    return psql.SQL("SELECT * FROM {tbl} ORDER BY RANDOM() LIMIT {lim}").format(tbl=table_ident, lim=limit_literal)
@@ -0,0 +1,132 @@
+# --- START OF FILE sql_logic/search_acceleration.py ---
+"""
+项目检索加速 (可选)。
+
+筛选项目时 ConditionGroupWidget 生成的文本条件形如 CAST(列 AS TEXT) ILIKE '%关键词%'，无法使用 B-tree 索引；
+事件表 (eICU 的 diagnosis、nursecharting 等) 上的项目列表还要对数百万行做 SELECT DISTINCT。
+
+- 字典表 (d_icd_diagnoses、d_items 等): 直接为每个检索列建立 pg_trgm 表达式 GIN 索引
+  ON 表 USING gin ((CAST(列 AS TEXT)) gin_trgm_ops)，表达式与生成的条件完全一致，规划器可直接匹配
+- 事件表: 在画像的检索加速 schema 中建立只含检索列去重组合的小表 ({源schema}_{表名}__names)，
+  并为其检索列建立同样的索引；项目列表查询在小表包含所需列时改为读取小表
+
+检索目标来自画像的 get_cohort_creation_configs / get_dictionary_tables 中的 search_fields，
+以及画像常量 SEARCH_ACCELERATION_EXTRA_TARGETS ({事件表: [列, ...]}，面板独有的检索列)。
+小表是源表的快照，源表更新后重新执行建立步骤即可刷新。
+"""
+import hashlib
+from typing import Any, Dict, Iterable, List, Tuple
+
+import psycopg2.sql as psql
+
+from sql_logic.catalog_cache import get_table_column_types, get_table_columns
+
+SIDE_TABLE_SUFFIX = "__names"
+# 只为文本类型的列建立三元组索引 (数值列的检索按等值条件直接比较)
+TEXT_COLUMN_TYPE_PREFIXES = ("text", "character varying", "character", "varchar", "bpchar")
+TRIGRAM_INDEX_SUFFIX = "_trgm_idx"
+
+_MAX_IDENTIFIER_LENGTH = 63
+
+
+def _fit_identifier(name: str) -> str:
+    """超过 PostgreSQL 标识符长度上限时截断并附加哈希，避免不同的长名称截断后相同。"""
+    if len(name) <= _MAX_IDENTIFIER_LENGTH:
+        return name
+    digest = hashlib.sha1(name.encode("utf-8")).hexdigest()[:8]
+    return f"{name[:_MAX_IDENTIFIER_LENGTH - 9]}_{digest}"
+
+
+def get_side_table_name(table_name: str) -> str:
+    """事件表对应的去重小表名 (不含 schema)。"""
+    return _fit_identifier(f"{table_name.replace('.', '_')}{SIDE_TABLE_SUFFIX}")
+
+
+def get_trigram_index_name(table_name: str, column: str) -> str:
+    return _fit_identifier(f"{table_name.split('.')[-1]}_{column}{TRIGRAM_INDEX_SUFFIX}")
+
+
+def collect_search_targets(db_profile) -> List[Dict[str, Any]]:
+    """
+    汇总画像的检索目标，返回 [{"table": 表全名, "columns": [列, ...], "side_table": 是否建立去重小表}, ...]。
+    同一张表的多个来源合并为一项 (列取并集)。
+    """
+    targets: Dict[str, Dict[str, Any]] = {}
+
+    def add(table_name: str, columns: Iterable[str], side_table: bool):
+        if not table_name:
+            return
+        entry = targets.setdefault(table_name, {"table": table_name, "columns": [], "side_table": False})
+        entry["columns"].extend(c for c in columns if c not in entry["columns"])
+        entry["side_table"] = entry["side_table"] or side_table
+
+    for config in db_profile.get_cohort_creation_configs().values():
+        search_columns = [field[0] for field in config.get("search_fields", [])]
+        if config.get("dictionary_table"):
+            add(config["dictionary_table"], search_columns, False)
+        else:
+            add(config.get("event_table"), search_columns, True)
+    for dictionary in db_profile.get_dictionary_tables():
+        add(dictionary.get("table_name"), [field[0] for field in dictionary.get("search_fields", [])], bool(dictionary.get("is_dynamic_view")))
+    for table_name, columns in db_profile.get_profile_constants().get("SEARCH_ACCELERATION_EXTRA_TARGETS", {}).items():
+        add(table_name, columns, True)
+    return [entry for entry in targets.values() if entry["columns"]]
+
+
+def _build_trigram_index_sql(relation: psql.Composable, index_name: str, column: str) -> psql.Composable:
+    return psql.SQL("CREATE INDEX IF NOT EXISTS {idx} ON {rel} USING gin ((CAST({col} AS TEXT)) gin_trgm_ops)").format(
+        idx=psql.Identifier(index_name), rel=relation, col=psql.Identifier(column)
+    )
+
+
+def build_search_acceleration_steps(cur, db_profile) -> List[Tuple[str, psql.Composable]]:
+    """
+    构建建立 (或刷新) 检索加速的步骤 [(说明, SQL), ...]。每一步相互独立，调用方可以逐步执行并跳过失败的步骤
+    (例如对源 schema 中的字典表没有建索引权限时)。画像未配置检索加速 schema 时返回空列表。
+    源表不存在时跳过该目标，源表中不存在的列不参与；只为文本列建立索引。
+    """
+    schema_name = db_profile.get_search_acceleration_schema()
+    if not schema_name:
+        return []
+    steps: List[Tuple[str, psql.Composable]] = [
+        ("启用 pg_trgm 扩展", psql.SQL("CREATE EXTENSION IF NOT EXISTS pg_trgm")),
+        (f"创建 schema {schema_name}", psql.SQL("CREATE SCHEMA IF NOT EXISTS {}").format(psql.Identifier(schema_name))),
+    ]
+    for target in collect_search_targets(db_profile):
+        table_name = target["table"]
+        source_schema, _, source_table = table_name.rpartition(".")
+        column_types = get_table_column_types(cur, source_schema or "public", source_table)
+        columns = [c for c in target["columns"] if c in column_types]
+        if not columns:
+            continue
+        text_columns = [c for c in columns if column_types[c].startswith(TEXT_COLUMN_TYPE_PREFIXES)]
+        if target["side_table"]:
+            side_name = get_side_table_name(table_name)
+            side_ident = psql.Identifier(schema_name, side_name)
+            cols = psql.SQL(", ").join(psql.Identifier(c) for c in columns)
+            steps.append((f"重建去重小表 {schema_name}.{side_name} ({', '.join(columns)})", psql.SQL(
+                "DROP TABLE IF EXISTS {side}; CREATE TABLE {side} AS SELECT DISTINCT {cols} FROM {table}"
+            ).format(side=side_ident, cols=cols, table=psql.SQL(table_name))))
+            for column in text_columns:
+                steps.append((f"为 {schema_name}.{side_name}.{column} 建立三元组索引",
+                              _build_trigram_index_sql(side_ident, get_trigram_index_name(side_name, column), column)))
+            steps.append((f"收集 {schema_name}.{side_name} 的统计信息", psql.SQL("ANALYZE {}").format(side_ident)))
+        else:
+            for column in text_columns:
+                steps.append((f"为 {table_name}.{column} 建立三元组索引",
+                              _build_trigram_index_sql(psql.SQL(table_name), get_trigram_index_name(table_name, column), column)))
+    return steps
+
+
+def resolve_search_relation(cur, db_profile, table_name: str, required_columns: Iterable[str]) -> psql.Composable:
+    """
+    项目列表查询应读取的关系: 事件表的去重小表存在且包含全部 required_columns 时返回小表，否则返回原表。
+    小表的列清单经 catalog_cache 缓存，每次只多一次系统目录签名查询。
+    """
+    schema_name = db_profile.get_search_acceleration_schema() if db_profile else None
+    if schema_name:
+        side_name = get_side_table_name(table_name)
+        side_columns = {name for name, _ in get_table_columns(cur, schema_name, side_name)}
+        if side_columns and set(required_columns) <= side_columns:
+            return psql.Identifier(schema_name, side_name)
+    return psql.SQL(table_name)
@@ -0,0 +1,86 @@
+# --- START OF FILE sql_logic/series_arrays.py ---
+"""
+列式数组时间序列 (TIMESERIES_ARRAYS / MED_TIMESERIES_ARRAYS) 的客户端解码。
+
+psycopg2 默认把 float8[] / timestamp[] 解析为逐元素的 Python float / datetime 列表。
+这里注册按连接生效的类型转换器，直接把数组文本解析为 NumPy 数组：
+数值数组 (float8[] / numeric[] / int4[] / int8[]) 解析为 float64 (NULL 为 NaN)，
+时间戳数组解析为 datetime64 (NULL 为 NaT)。text[] 保持 psycopg2 默认的字符串列表。
+"""
+from typing import Any, Dict, Optional
+
+import numpy as np
+import pandas as pd
+import psycopg2.extensions
+
+from app_config import ARRAY_SERIES_OUTPUTS
+
+FLOAT8_ARRAY_OID = 1022
+NUMERIC_ARRAY_OID = 1231
+INT4_ARRAY_OID = 1007
+INT8_ARRAY_OID = 1016
+TIMESTAMP_ARRAY_OID = 1115
+TIMESTAMPTZ_ARRAY_OID = 1185
+
+
+def parse_numeric_array(value: Optional[str], cur=None) -> Optional[np.ndarray]:
+    """把一维数值数组的文本形式 (如 '{1.5,NULL,2}') 解析为 float64 数组。"""
+    if value is None:
+        return None
+    body = value[1:-1]
+    if not body:
+        return np.empty(0, dtype=np.float64)
+    body = body.replace("NULL", "nan").replace("Infinity", "inf")
+    parsed = np.fromstring(body, dtype=np.float64, sep=",")
+    if parsed.size != body.count(",") + 1:
+        # fromstring 遇到无法识别的文本会提前停止，此时退回逐项转换
+        parsed = np.array(body.split(","), dtype=np.float64)
+    return parsed
+
+
+def parse_timestamp_array(value: Optional[str], cur=None) -> Optional[np.ndarray]:
+    """把一维时间戳数组的文本形式解析为 datetime64[ns] 数组 (NULL、infinity 等为 NaT)。"""
+    if value is None:
+        return None
+    body = value[1:-1]
+    if not body:
+        return np.empty(0, dtype="datetime64[ns]")
+    return pd.to_datetime(body.replace('"', "").split(","), errors="coerce").to_numpy()
+
+
+_NUMPY_ARRAY_TYPES = [
+    psycopg2.extensions.new_type(
+        (FLOAT8_ARRAY_OID, NUMERIC_ARRAY_OID, INT4_ARRAY_OID, INT8_ARRAY_OID), "NUMPY_FLOAT_ARRAY", parse_numeric_array
+    ),
+    psycopg2.extensions.new_type((TIMESTAMP_ARRAY_OID, TIMESTAMPTZ_ARRAY_OID), "NUMPY_TIMESTAMP_ARRAY", parse_timestamp_array),
+]
+
+
+def register_numpy_array_casters(conn_or_cursor):
+    """为给定连接 (或游标) 注册 NumPy 数组转换器，不影响其他连接。"""
+    for array_type in _NUMPY_ARRAY_TYPES:
+        psycopg2.extensions.register_type(array_type, conn_or_cursor)
+
+
+def decode_series_struct(df: pd.DataFrame, base_column_name: str, method_key: str = "TIMESERIES_ARRAYS") -> pd.Series:
+    """
+    把列式数组方法生成的平行数组列组装为每行一个 {字段: ndarray} 的结构 (字段名为列名后缀去掉前缀，
+    如用药序列的 start/stop/dose/unit/form)。未经 register_numpy_array_casters 读取的列表也会转换为数组。
+    df 中缺少该方法任一列时抛出 KeyError。
+    """
+    fields = []
+    for suffix, _, col_type in ARRAY_SERIES_OUTPUTS[method_key]:
+        column = f"{base_column_name}_{suffix}"
+        if column not in df.columns:
+            raise KeyError(column)
+        fields.append((suffix.split("_", 1)[1], column, object if col_type == "TEXT[]" else None))
+
+    def to_array(value: Any, dtype) -> np.ndarray:
+        if value is None or (isinstance(value, float) and np.isnan(value)):
+            return np.empty(0, dtype=dtype or np.float64)
+        return value if isinstance(value, np.ndarray) else np.asarray(value, dtype=dtype)
+
+    def build_row(row) -> Dict[str, np.ndarray]:
+        return {name: to_array(row[column], dtype) for name, column, dtype in fields}
+
+    return df.apply(build_row, axis=1)
@@ -1,3 +1,4 @@
+import math
 import psycopg2
 import psycopg2.sql as psql
 import time
@@ -8,15 +9,28 @@ from typing import List, Tuple, Dict, Any, Optional
 from utils import validate_column_name
 from app_config import SQL_AGGREGATES as GENERIC_SQL_AGGREGATES
 from app_config import AGGREGATE_RESULT_TYPES as GENERIC_AGGREGATE_RESULT_TYPES
+from app_config import MAX_TIME_WINDOW_BINS, ARRAY_SERIES_TEMPLATE, ARRAY_SERIES_OUTPUTS
 from db_profiles.base_profile import BaseDbProfile
+from sql_logic.sampling import build_sample_query, SAMPLING_RANDOM
+from sql_logic.cost_estimator import estimate_execution_steps_cost, explain_query_cost
+from sql_logic.build_memo import BuildMemo, freeze_value
+from sql_logic.catalog_cache import get_table_column_types, find_index_by_leading_columns
+from sql_logic.numeric_shadow import resolve_numeric_shadow, safe_numeric_expression
+from sql_logic.narrow_store import (BINNED_TABLE_SUFFIX, get_feature_table_prefix, build_feature_table_steps,
+                                    build_drop_wide_view_step, build_refresh_wide_view_step,
+                                    get_computed_marker_name, get_binned_table_name)
+from sql_logic.feature_cache import (FEATURE_CACHE_COLUMN_BASE, compute_feature_hash, get_cache_table_ident,
+                                     build_cache_setup_steps, build_invalidation_step, build_missing_keys_source,
+                                     build_cache_fill_steps, build_registry_upsert_step, build_eviction_step,
+                                     build_cache_read_query, serialize_config_for_registry)
 
 # --- 配置常量 ---
 SQL_AGGREGATES = {
     **GENERIC_SQL_AGGREGATES,
-    "NOTE_CONCAT": "STRING_AGG({val_col}, E'\\n\\n---NOTE---\\n\\n' ORDER BY {time_col})",
-    "NOTE_FIRST": "(ARRAY_AGG({val_col} ORDER BY {time_col} ASC NULLS LAST))[1]",
-    "NOTE_LAST": "(ARRAY_AGG({val_col} ORDER BY {time_col} DESC NULLS LAST))[1]",
-    "NOTE_COUNT": "COUNT({val_col})",
+    "NOTE_CONCAT": "STRING_AGG({val_col}, E'\\n\\n---NOTE---\\n\\n' ORDER BY {time_col}){agg_filter}",
+    "NOTE_FIRST": "(ARRAY_AGG({val_col} ORDER BY {time_col} ASC NULLS LAST){agg_filter})[1]",
+    "NOTE_LAST": "(ARRAY_AGG({val_col} ORDER BY {time_col} DESC NULLS LAST){agg_filter})[1]",
+    "NOTE_COUNT": "COUNT({val_col}){agg_filter}",
 }
 
 AGGREGATE_RESULT_TYPES = {
@@ -27,6 +41,51 @@ AGGREGATE_RESULT_TYPES = {
     "NOTE_COUNT": "INTEGER",
 }
 
+# 事件输出 (Exists/Count) 的聚合模板与结果类型
+EVENT_OUTPUT_AGGREGATES = {
+    "exists": ("BOOL_OR(TRUE){agg_filter}", "BOOLEAN"),
+    "countevt": ("COUNT(*){agg_filter}", "INTEGER"),
+}
+
+# 计数类聚合在空组上返回 0 而非 NULL，批量透视模式下需要额外包裹以保持与单项提取一致
+COUNT_LIKE_METHODS = {"COUNT", "NOTE_COUNT", "countevt"}
+
+JSON_AGGREGATE_METHODS = {"TIMESERIES_JSON", "MED_TIMESERIES_JSON"}
+# 需要在 FilteredEvents 中携带用药停止时间/单位/剂型列的方法
+MED_SERIES_METHODS = {"MED_TIMESERIES_JSON", "MED_TIMESERIES_ARRAYS"}
+# 列式数组用药序列中剂量取文本开头的数值部分 (如 '5 mg' -> 5，'1-2' -> 1)，没有数值时为 NULL
+LEADING_NUMBER_PATTERN = '^[[:space:]]*([-+]?([0-9]+[.]?[0-9]*|[.][0-9]+))'
+
+# 共同选中时合并计算的聚合方法：
+# 百分位类共用一次 PERCENTILE_CONT(ARRAY[...]) 排序，按数组下标取值 (IQR = P75 - P25)
+FUSED_PERCENTILE_FRACTIONS = [0.25, 0.5, 0.75]
+FUSED_PERCENTILE_INDEX = {"P25": 1, "MEDIAN": 2, "P75": 3}
+FUSED_PERCENTILE_METHODS = set(FUSED_PERCENTILE_INDEX) | {"IQR"}
+# 矩统计类共用一次 AVG / STDDEV_SAMP (CV = STDDEV / AVG)
+FUSED_MOMENT_METHODS = {"MEAN", "STDDEV_SAMP", "CV"}
+
+# 取首/末条记录的方法及其时间排序方向。存在时间列时改用 DISTINCT ON 子查询计算，
+# 避免 (ARRAY_AGG(... ORDER BY ...))[1] 为每个分组物化完整数组
+ORDERED_PICK_DIRECTIONS = {"FIRST_VALUE": "ASC", "NOTE_FIRST": "ASC", "LAST_VALUE": "DESC", "NOTE_LAST": "DESC"}
+
+# 预处理表合并时每个连接键按该时间列取首条记录
+PREPROCESSED_ORDER_COLUMN = "charttime"
+
+# 项目ID列可以使用原生类型 `列 = ANY(%s::类型[])` 比较的类型 (见 _coerce_item_ids)
+INTEGER_ITEM_ID_TYPES = {"integer", "int", "bigint", "smallint"}
+PADDING_INSENSITIVE_ITEM_ID_TYPES = {"bpchar"}
+
+# 执行阶段写回队列表的方式
+MERGE_STRATEGY_UPDATE = "update"    # ALTER TABLE ADD COLUMN + UPDATE ... FROM 临时表 (原地更新)
+MERGE_STRATEGY_REBUILD = "rebuild"  # 新表 INSERT 队列 LEFT JOIN 特征，替换原表并按原定义重建约束与索引
+MERGE_STRATEGY_NARROW = "narrow"    # 写入独立的窄特征表，经由宽视图呈现 (见 sql_logic/narrow_store.py)
+
+# 分区并行执行时返回的信号类型 (普通执行为 "execution_list")
+PARTITIONED_EXECUTION_SIGNAL = "partitioned_execution_list"
+
+# 分箱时间序列的长表输出：与队列表同 schema 的 {队列表}__binned (BINNED_TABLE_SUFFIX)；文本/JSON/数组类结果不写入长表
+BINNED_EXCLUDED_RESULT_TYPES = {"TEXT", "JSONB"}
+
 # ==========================================
 # 1. 定义策略接口 (Strategy Interface)
 # ==========================================
@@ -43,6 +102,16 @@ class BaseSqlBuilderStrategy(ABC):
         """生成时间窗口的 WHERE 子句"""
         pass
 
+    @abstractmethod
+    def get_relative_window_condition(self, time_col_name: str, window_spec: Dict[str, Any], is_date_col: bool) -> psql.Composable:
+        """生成参数化相对时间窗口 [锚点 + start_hours, 锚点 + end_hours) 的 WHERE 子句"""
+        pass
+
+    @abstractmethod
+    def get_hours_since_anchor_expression(self, time_col_name: str, window_spec: Dict[str, Any], is_date_col: bool) -> psql.Composable:
+        """返回事件时间相对锚点的小时数表达式 (用于分箱)"""
+        pass
+
     @abstractmethod
     def get_value_expression(self, val_col_name: str, table_name: str, is_text_mode: bool) -> psql.SQL:
         """获取数值列的表达式（处理类型转换）"""
@@ -98,6 +167,29 @@ class MimicIVStrategy(BaseSqlBuilderStrategy):
         
         return psql.SQL("TRUE") # 默认不过滤
 
+    def _get_anchor_expression(self, window_spec: Dict[str, Any], is_date_col: bool) -> psql.Composable:
+        anchor = psql.SQL("{}.{}").format(self.coh, psql.Identifier(window_spec.get("anchor") or "icu_intime"))
+        # 仅日期列以锚点当天 0 点为起点
+        return psql.SQL("CAST(CAST({} AS DATE) AS TIMESTAMP)").format(anchor) if is_date_col else anchor
+
+    def get_relative_window_condition(self, time_col_name: str, window_spec: Dict[str, Any], is_date_col: bool) -> psql.Composable:
+        anchor = self._get_anchor_expression(window_spec, is_date_col)
+        # 直接比较时间列 (不对其做运算)，可以使用事件表时间列上的索引
+        return psql.SQL(
+            "{evt}.{time} >= {anchor} + {start} * INTERVAL '1 hour' AND {evt}.{time} < {anchor} + {end} * INTERVAL '1 hour'"
+        ).format(
+            evt=self.evt, time=psql.Identifier(time_col_name), anchor=anchor,
+            start=psql.Literal(float(window_spec["start_hours"])), end=psql.Literal(float(window_spec["end_hours"]))
+        )
+
+    def get_hours_since_anchor_expression(self, time_col_name: str, window_spec: Dict[str, Any], is_date_col: bool) -> psql.Composable:
+        time_ref = psql.SQL("{}.{}").format(self.evt, psql.Identifier(time_col_name))
+        if is_date_col:
+            time_ref = psql.SQL("CAST({} AS TIMESTAMP)").format(time_ref)
+        return psql.SQL("EXTRACT(EPOCH FROM ({time} - {anchor})) / 3600.0").format(
+            time=time_ref, anchor=self._get_anchor_expression(window_spec, is_date_col)
+        )
+
     def get_value_expression(self, val_col_name: str, table_name: str, is_text_mode: bool) -> psql.SQL:
         # MIMIC 通常不需要特殊转换，直接返回列名
         return psql.SQL("{}.{}").format(self.evt, psql.Identifier(val_col_name))
@@ -131,13 +223,31 @@ class EicuStrategy(BaseSqlBuilderStrategy):
         # 此处回退到宽泛策略或仅 ICU
         return psql.SQL("{evt}.{time} >= 0").format(evt=self.evt, time=time_col)
 
+    def _get_relative_minutes_expression(self, time_col_name: str, window_spec: Dict[str, Any]) -> psql.Composable:
+        # 未指定锚点列时以 ICU 入室 (offset 0) 为锚点；否则减去队列表中以分钟计的锚点偏移列
+        time_ref = psql.SQL("{}.{}").format(self.evt, psql.Identifier(time_col_name))
+        anchor_col = window_spec.get("anchor")
+        if not anchor_col:
+            return time_ref
+        return psql.SQL("({} - {}.{})").format(time_ref, self.coh, psql.Identifier(anchor_col))
+
+    def get_relative_window_condition(self, time_col_name: str, window_spec: Dict[str, Any], is_date_col: bool) -> psql.Composable:
+        minutes_expr = self._get_relative_minutes_expression(time_col_name, window_spec)
+        return psql.SQL("{rel} >= {start} AND {rel} < {end}").format(
+            rel=minutes_expr,
+            start=psql.Literal(float(window_spec["start_hours"]) * 60), end=psql.Literal(float(window_spec["end_hours"]) * 60)
+        )
+
+    def get_hours_since_anchor_expression(self, time_col_name: str, window_spec: Dict[str, Any], is_date_col: bool) -> psql.Composable:
+        return psql.SQL("{} / 60.0").format(self._get_relative_minutes_expression(time_col_name, window_spec))
+
     def get_value_expression(self, val_col_name: str, table_name: str, is_text_mode: bool) -> psql.SQL:
         col_ident = psql.Identifier(val_col_name)
         
         # 特殊处理：nursecharting 和 infusiondrug 的数值列实际上是存储在文本字段里的
         if (table_name in ["public.nursecharting", "public.infusiondrug"]) and (not is_text_mode):
-            # 需要将文本转为数值，处理空字符串
-            return psql.SQL("CAST(NULLIF({evt}.{col}, '') AS NUMERIC)").format(evt=self.evt, col=col_ident)
+            # 需要将文本安全地转为数值 (非数值文本得到 NULL)
+            return safe_numeric_expression(psql.SQL("{evt}.{col}").format(evt=self.evt, col=col_ident))
         
         return psql.SQL("{evt}.{col}").format(evt=self.evt, col=col_ident)
 
@@ -161,72 +271,76 @@ def get_sql_strategy(db_profile: BaseDbProfile, evt_alias: psql.Identifier, coh_
         return MimicIVStrategy(evt_alias, coh_alias)
 
 # ==========================================
-# 4. 主构建函数 (Refactored Main Function)
+# 4. 构建辅助函数 (Shared Building Blocks)
 # ==========================================
 
-def build_special_data_sql(
-    target_cohort_table_name: str,
-    base_new_column_name: str,
-    panel_specific_config: Dict[str, Any],
-    db_profile: BaseDbProfile,
-    active_db_params: Optional[Dict] = None,
-    for_execution: bool = False,
-    preview_limit: int = 100
-) -> Tuple[Optional[Any], Optional[str], Optional[List[Any]], List[Tuple[str, str]]]:
-    
-    # 处理特殊的“预处理表合并”模式 (保持原有逻辑)
-    if panel_specific_config.get("panel_type") == "merge_preprocessed":
-        return build_merge_preprocessed_sql(
-            target_cohort_table_name, panel_specific_config, db_profile, active_db_params, for_execution, preview_limit
-        )
+def _split_table_name(full_name: str) -> Optional[Tuple[str, str]]:
+    try:
+        schema_name, table_only_name = full_name.split('.')
+    except ValueError:
+        return None
+    return schema_name, table_only_name
 
-    generated_column_details_for_preview = [] 
 
-    # --- 1. 参数提取 ---
-    source_event_table = panel_specific_config.get("source_event_table")
+def validate_time_window_spec(window_spec: Dict[str, Any]) -> Optional[str]:
+    """
+    校验参数化相对时间窗口 {"anchor": 锚点列, "start_hours": 起始偏移, "end_hours": 结束偏移, "bin_hours": 分箱宽度}。
+    偏移均以小时计、相对锚点，窗口为左闭右开；bin_hours 为 0 时不分箱。返回错误信息，校验通过时返回 None。
+    """
+    try:
+        start_hours = float(window_spec.get("start_hours"))
+        end_hours = float(window_spec.get("end_hours"))
+        bin_hours = float(window_spec.get("bin_hours") or 0)
+    except (TypeError, ValueError):
+        return "相对时间窗口的起止偏移与分箱宽度必须为数值"
+    if end_hours <= start_hours:
+        return "相对时间窗口的结束偏移必须大于起始偏移"
+    if bin_hours < 0:
+        return "分箱宽度不能为负数"
+    if bin_hours > 0 and math.ceil((end_hours - start_hours) / bin_hours) > MAX_TIME_WINDOW_BINS:
+        return f"分箱数量超过上限 ({MAX_TIME_WINDOW_BINS})，请增大分箱宽度或缩短时间窗口"
+    return None
+
+
+def _coerce_item_ids(item_ids: List[str], native_type: Optional[str]) -> Optional[List[Any]]:
+    """
+    将项目ID转换为列的原生类型；返回 None 时回退到 TRIM(CAST(列 AS TEXT)) 的文本比较。
+    只有首尾空白不影响比较的类型 (整数与 bpchar，后者比较时忽略尾部填充空格) 使用原生类型比较；
+    text/varchar 名称列中可能存有首尾带空白的值，而面板选中的 ID 已去除空白，必须保留 TRIM 比较。
+    """
+    if native_type in INTEGER_ITEM_ID_TYPES:
+        try:
+            return [int(i) for i in item_ids]
+        except ValueError:
+            return None
+    if native_type in PADDING_INSENSITIVE_ITEM_ID_TYPES:
+        return list(item_ids)
+    return None
+
+
+def _collect_where_conditions(
+    panel_specific_config: Dict[str, Any],
+    strategy: BaseSqlBuilderStrategy,
+    event_alias: psql.Identifier,
+    db_profile: BaseDbProfile
+) -> Tuple[List[psql.Composable], List[Any]]:
+    """根据面板配置生成 FilteredEvents 的 WHERE 条件列表及其参数 (按出现顺序)。"""
     id_col_in_event_table = panel_specific_config.get("item_id_column_in_event_table")
-    value_column_name = panel_specific_config.get("value_column_to_extract") 
     time_col_name = panel_specific_config.get("time_column_in_event_table")
     time_col_is_date = panel_specific_config.get("time_column_is_date_only", False)
-    
     selected_item_ids = panel_specific_config.get("selected_item_ids", [])
-    aggregation_methods = panel_specific_config.get("aggregation_methods", {})
-    event_outputs = panel_specific_config.get("event_outputs", {})
-    quick_extractors = panel_specific_config.get("quick_extractors", {})
-    
     time_window_text = panel_specific_config.get("time_window_text")
-    is_text_extraction = panel_specific_config.get("is_text_extraction", False)
-    
+    time_window_spec = panel_specific_config.get("time_window_spec")
+
     # 高级过滤器
     text_filter = panel_specific_config.get("text_filter")
     detail_table = panel_specific_config.get("detail_table")
     detail_filters = panel_specific_config.get("detail_filters", [])
     item_filter_conditions = panel_specific_config.get("item_filter_conditions", None) # (sql, params)
 
-    # --- 2. 基础校验 ---
-    if not all([source_event_table, time_window_text]):
-        return None, "配置不完整 (缺少源表或时间窗口)", [], []
-    
-    try:
-        schema_name, table_only_name = target_cohort_table_name.split('.')
-    except ValueError:
-        return None, "目标表名格式错误 (Schema.Table)", [], []
-
-    # --- 3. 初始化对象 ---
-    target_table_ident = psql.Identifier(schema_name, table_only_name)
-    cohort_alias = psql.Identifier("cohort")
-    event_alias = psql.Identifier("evt")
-    md_alias = psql.Identifier("md")
-    target_alias = psql.Identifier("target")
-    
-    # 获取策略对象
-    strategy = get_sql_strategy(db_profile, event_alias, cohort_alias)
-
     params_for_cte = []
     all_where_conditions = []
 
-    # --- 4. 构建 WHERE 子句 (通用逻辑) ---
-    
     # 4.1 文本过滤
     if text_filter:
         all_where_conditions.append(psql.SQL("evt.text ILIKE %s"))
@@ -243,13 +357,20 @@ def build_special_data_sql(
             all_where_conditions.append(psql.SQL("({})").format(psql.SQL(" OR ").join(ilike_parts)))
             params_for_cte.extend(safe_ids)
         else:
-            trimmed_expr = psql.SQL("TRIM(CAST({}.{} AS TEXT))").format(event_alias, col_ident)
-            if len(safe_ids) == 1:
-                all_where_conditions.append(psql.SQL("{} = %s").format(trimmed_expr))
-                params_for_cte.append(safe_ids[0])
+            native_type = db_profile.get_item_id_column_type(panel_specific_config.get("source_event_table"), id_col_in_event_table)
+            typed_ids = _coerce_item_ids(safe_ids, native_type)
+            if typed_ids is not None:
+                # 使用原生类型比较，可以走事件表上项目列的 btree 索引
+                all_where_conditions.append(psql.SQL("{}.{} = ANY(%s::{}[])").format(event_alias, col_ident, psql.SQL(native_type)))
+                params_for_cte.append(typed_ids)
             else:
-                all_where_conditions.append(psql.SQL("{} IN %s").format(trimmed_expr))
-                params_for_cte.append(tuple(safe_ids))
+                trimmed_expr = psql.SQL("TRIM(CAST({}.{} AS TEXT))").format(event_alias, col_ident)
+                if len(safe_ids) == 1:
+                    all_where_conditions.append(psql.SQL("{} = %s").format(trimmed_expr))
+                    params_for_cte.append(safe_ids[0])
+                else:
+                    all_where_conditions.append(psql.SQL("{} IN %s").format(trimmed_expr))
+                    params_for_cte.append(tuple(safe_ids))
     
     # 4.3 自定义高级过滤 (如从 condition_group 传来的)
     if item_filter_conditions:
@@ -272,67 +393,148 @@ def build_special_data_sql(
         )
         all_where_conditions.append(psql.SQL("{}.note_id IN {}").format(event_alias, subquery))
 
-    # 4.5 时间窗口过滤 (使用策略)
+    # 4.5 时间窗口过滤 (使用策略)，参数化相对时间窗口优先于面板的时间窗口选项
     if time_col_name:
-        time_condition = strategy.get_time_window_condition(time_col_name, time_window_text, time_col_is_date)
+        if time_window_spec:
+            time_condition = strategy.get_relative_window_condition(time_col_name, time_window_spec, time_col_is_date)
+        else:
+            time_condition = strategy.get_time_window_condition(time_col_name, time_window_text, time_col_is_date)
         all_where_conditions.append(time_condition)
 
-    # --- 5. 构建 FilteredEvents CTE ---
-    cohort_join_key = db_profile.get_cohort_join_key(source_event_table)
-    event_join_key = db_profile.get_event_table_join_key(source_event_table)
-    
+    return all_where_conditions, params_for_cte
+
+
+def _resolve_shared_numeric_shadow(panel_configs: List[Dict[str, Any]], db_profile: BaseDbProfile) -> Optional[Dict[str, Any]]:
+    """
+    所有配置都可以改读同一个数值影子表时返回其定义 (见 sql_logic/numeric_shadow.py)，否则返回 None。
+    批量透视共享一次事件表扫描，只要有一项不适用就整体读取原表。
+    """
+    shadow_tables = db_profile.get_numeric_shadow_tables()
+    shadow_defs = [resolve_numeric_shadow(config, shadow_tables) for config in panel_configs]
+    if not shadow_defs or any(d is None for d in shadow_defs):
+        return None
+    return shadow_defs[0]
+
+
+def _get_event_value_column(panel_specific_config: Dict[str, Any], shadow_def: Optional[Dict[str, Any]]) -> Optional[str]:
+    """FilteredEvents 读取的值列：改读影子表时为已解析的数值列。"""
+    value_column_name = panel_specific_config.get("value_column_to_extract")
+    if shadow_def and value_column_name:
+        return shadow_def["numeric_columns"][value_column_name]
+    return value_column_name
+
+
+def _build_cohort_join_clause(
+    panel_specific_config: Dict[str, Any],
+    db_profile: BaseDbProfile,
+    event_alias: psql.Identifier,
+    cohort_source: psql.Composable,
+    cohort_alias: psql.Identifier,
+    shadow_def: Optional[Dict[str, Any]] = None
+) -> psql.Composable:
+    """
+    生成 FilteredEvents 的 FROM ... JOIN 子句，cohort_source 可以是目标表或采样 CTE。
+    面板提供的 cte_join_on_cohort_override 模板必须通过 {cohort_table} 引用队列表，
+    这样预览时会自动替换为 SampledCohort。给定 shadow_def 时从数值影子表读取事件。
+    """
+    source_event_table = panel_specific_config.get("source_event_table")
+
     # 允许面板覆盖默认 JOIN 逻辑 (例如对于“既往史”需要关联 admission 表)
     override_join = panel_specific_config.get("cte_join_on_cohort_override")
-    
     if override_join:
         # 如果是 SQL 对象则直接使用，如果是字符串则转换
         from_join_clause = override_join if isinstance(override_join, psql.Composed) or isinstance(override_join, psql.SQL) else psql.SQL(str(override_join))
         # 格式化参数
-        from_join_clause = from_join_clause.format(
+        return from_join_clause.format(
             event_table=psql.SQL(source_event_table), evt_alias=event_alias,
-            cohort_table=target_table_ident, coh_alias=cohort_alias,
+            cohort_table=cohort_source, coh_alias=cohort_alias,
             adm_evt=psql.Identifier("adm_evt") # 预留给 admission join 的别名
         )
-    else:
-        from_join_clause = psql.SQL("FROM {event_table} {evt_alias} JOIN {cohort_table} {coh_alias} ON {evt_alias}.{evt_key} = {coh_alias}.{coh_key}").format(
-            event_table=psql.SQL(source_event_table), evt_alias=event_alias,
-            cohort_table=target_table_ident, coh_alias=cohort_alias,
-            evt_key=psql.Identifier(event_join_key), coh_key=psql.Identifier(cohort_join_key)
-        )
 
-    # 构建 SELECT 列表
-    select_defs = [psql.SQL("{}.*").format(cohort_alias)] # 保留所有队列列
-    
-    # 添加值列 (使用 event_value 别名)
-    if value_column_name:
-        # 使用策略获取原始值表达式 (不转换类型，原始值)
-        # 注意：我们在聚合阶段再做类型转换 (get_value_expression)，这里为了保持 CTE 通用性，可以先取原始列
-        # 或者，为了简化，我们直接在这里取原始列，别名为 event_value
-        select_defs.append(psql.SQL("{}.{} AS event_value").format(event_alias, psql.Identifier(value_column_name)))
-    
-    # 添加时间列 (使用 event_time 别名)
-    if time_col_name:
-        select_defs.append(psql.SQL("{}.{} AS event_time").format(event_alias, psql.Identifier(time_col_name)))
+    cohort_join_key = db_profile.get_cohort_join_key(source_event_table)
+    event_join_key = db_profile.get_event_table_join_key(source_event_table)
+    return psql.SQL("FROM {event_table} {evt_alias} JOIN {cohort_table} {coh_alias} ON {evt_alias}.{evt_key} = {coh_alias}.{coh_key}").format(
+        event_table=psql.SQL(shadow_def["relation"] if shadow_def else source_event_table), evt_alias=event_alias,
+        cohort_table=cohort_source, coh_alias=cohort_alias,
+        evt_key=psql.Identifier(event_join_key), coh_key=psql.Identifier(cohort_join_key)
+    )
 
-    # 添加 JSON 所需列 (使用策略)
-    if any(m == "MED_TIMESERIES_JSON" for m, s in aggregation_methods.items() if s):
-        json_cols = strategy.get_med_json_columns()
-        select_defs.extend(json_cols)
-
-    # 组装 CTE SQL
-    filtered_events_cte_sql = psql.SQL("FilteredEvents AS (SELECT {selects} {joins} WHERE {conds})").format(
-        selects=psql.SQL(', ').join(select_defs),
-        joins=from_join_clause,
-        conds=psql.SQL(' AND ').join(all_where_conditions) if all_where_conditions else psql.SQL("TRUE")
+
+def _build_cohort_key_pushdown_condition(
+    panel_specific_config: Dict[str, Any],
+    db_profile: BaseDbProfile,
+    event_alias: psql.Identifier,
+    cohort_source: psql.Composable
+) -> Optional[psql.Composable]:
+    """
+    队列键半连接下推：先把队列 (或样本/分区源) 的连接键集合物化为数组 (InitPlan，只计算一次)，
+    再以 `事件表.连接键 = ANY(数组)` 驱动事件表的访问，使规划器可以走事件表连接键上的索引，
+    而不是先按时间偏移条件扫描整张事件表再与队列关联。面板覆盖了关联方式时不适用，返回 None。
+    """
+    if panel_specific_config.get("cte_join_on_cohort_override"):
+        return None
+    source_event_table = panel_specific_config.get("source_event_table")
+    return psql.SQL("{evt}.{evt_key} = ANY(ARRAY(SELECT {coh_key} FROM {source} pushdown_keys))").format(
+        evt=event_alias,
+        evt_key=psql.Identifier(db_profile.get_event_table_join_key(source_event_table)),
+        coh_key=psql.Identifier(db_profile.get_cohort_join_key(source_event_table)),
+        source=cohort_source
     )
 
-    # --- 6. 确定聚合列 ---
+
+def _partition_pushdown_source(
+    cohort_source: psql.Composable,
+    cohort_alias: psql.Identifier,
+    group_by_key: psql.Identifier,
+    partition_count: int,
+    partition_index: Optional[int]
+) -> psql.Composable:
+    """分区执行时，半连接下推只物化本分区的连接键。"""
+    if partition_index is None:
+        return cohort_source
+    return psql.SQL("(SELECT * FROM {src} {coh} WHERE {cond})").format(
+        src=cohort_source, coh=cohort_alias,
+        cond=_build_partition_condition(cohort_alias, group_by_key, partition_count, partition_index)
+    )
+
+
+def _collect_output_columns(
+    base_new_column_name: str,
+    panel_specific_config: Dict[str, Any],
+    time_array_type: str = "TIMESTAMP[]"
+) -> Tuple[List[Tuple[str, psql.Identifier, Any, psql.SQL, str]], List[Tuple[str, str]], Optional[str]]:
+    """
+    确定要生成的输出列。
+    返回 (selected_methods, column_details_for_preview, error)，
+    selected_methods 中每项为 (列名, 列标识符, 聚合模板, 列类型, 方法键)。
+    列式数组方法 (ARRAY_SERIES_OUTPUTS) 展开为多列，各列的方法键相同；time_array_type 为时间数组的类型。
+    """
+    aggregation_methods = panel_specific_config.get("aggregation_methods", {})
+    event_outputs = panel_specific_config.get("event_outputs", {})
+    quick_extractors = panel_specific_config.get("quick_extractors", {})
+    is_text_extraction = panel_specific_config.get("is_text_extraction", False)
+
     selected_methods = []
+    column_details = []
     type_map = {"NUMERIC": "Numeric", "INTEGER": "Integer", "BOOLEAN": "Boolean", "TEXT": "Text", "JSONB": "JSON"}
 
     # 处理常规聚合
     for method_key, is_selected in aggregation_methods.items():
         if not is_selected: continue
+        if method_key in ARRAY_SERIES_OUTPUTS:
+            for suffix, src, col_type in ARRAY_SERIES_OUTPUTS[method_key]:
+                col_type = col_type.format(time_array_type=time_array_type)
+                if is_text_extraction and src == "val_col":
+                    col_type = "TEXT[]"
+                final_col_name = f"{base_new_column_name}_{suffix}"
+                is_valid, err = validate_column_name(final_col_name)
+                if not is_valid: return [], [], f"列名 '{final_col_name}' 无效: {err}"
+                template = ARRAY_SERIES_TEMPLATE.format(
+                    src="{" + src + "}", elem_type=col_type[:-2], time_col="{time_col}", agg_filter="{agg_filter}"
+                )
+                selected_methods.append((final_col_name, psql.Identifier(final_col_name), template, psql.SQL(col_type), method_key))
+                column_details.append((final_col_name, col_type))
+            continue
         template = SQL_AGGREGATES.get(method_key)
         if not template: continue
         
@@ -343,161 +545,1051 @@ def build_special_data_sql(
             
         final_col_name = f"{base_new_column_name}_{method_key.lower()}"
         is_valid, err = validate_column_name(final_col_name)
-        if not is_valid: return None, f"列名 '{final_col_name}' 无效: {err}", [], []
+        if not is_valid: return [], [], f"列名 '{final_col_name}' 无效: {err}"
         
-        selected_methods.append((final_col_name, psql.Identifier(final_col_name), template, psql.SQL(col_type)))
-        generated_column_details_for_preview.append((final_col_name, type_map.get(col_type, col_type)))
+        selected_methods.append((final_col_name, psql.Identifier(final_col_name), template, psql.SQL(col_type), method_key))
+        column_details.append((final_col_name, type_map.get(col_type, col_type)))
 
     # 处理事件输出 (Exists/Count)
-    event_configs = {"exists": ("TRUE", "BOOLEAN"), "countevt": ("COUNT(*)", "INTEGER")}
     for key, is_selected in event_outputs.items():
-        if is_selected and key in event_configs:
-            tmpl, ctype = event_configs[key]
+        if is_selected and key in EVENT_OUTPUT_AGGREGATES:
+            tmpl, ctype = EVENT_OUTPUT_AGGREGATES[key]
             final_col_name = f"{base_new_column_name}_{key}"
-            selected_methods.append((final_col_name, psql.Identifier(final_col_name), tmpl, psql.SQL(ctype)))
-            generated_column_details_for_preview.append((final_col_name, type_map.get(ctype, ctype)))
+            selected_methods.append((final_col_name, psql.Identifier(final_col_name), tmpl, psql.SQL(ctype), key))
+            column_details.append((final_col_name, type_map.get(ctype, ctype)))
 
     # 处理正则提取
     for key, pattern in quick_extractors.items():
         final_col_name = f"{base_new_column_name}_{key}"
         tmpl = "(REGEXP_MATCHES({val_col}, %s, 'i'))" # Placeholder for param
-        selected_methods.append((final_col_name, psql.Identifier(final_col_name), (tmpl, [pattern]), psql.SQL("TEXT")))
-        generated_column_details_for_preview.append((final_col_name, "Text"))
+        selected_methods.append((final_col_name, psql.Identifier(final_col_name), (tmpl, [pattern]), psql.SQL("TEXT"), key))
+        column_details.append((final_col_name, "Text"))
 
-    if not selected_methods:
-        return None, "未选择任何有效的提取列", [], []
+    return selected_methods, column_details, None
+
+
+def _get_aggregate_value_expression(
+    db_profile: BaseDbProfile,
+    panel_specific_config: Dict[str, Any],
+    value_ref: psql.Composable,
+    shadow_def: Optional[Dict[str, Any]] = None
+) -> psql.Composable:
+    """
+    返回聚合阶段使用的取值表达式 (value_ref 指向 FilteredEvents 中的值列)。
+    数值存放在文本列中的事件表 (画像的数值影子表定义) 在影子表未准备时逐行安全转换；
+    读取影子表时值列已经是 NUMERIC，无需转换。
+    """
+    source_event_table = panel_specific_config.get("source_event_table")
+    is_text_extraction = panel_specific_config.get("is_text_extraction", False)
+    value_column_name = panel_specific_config.get("value_column_to_extract")
+
+    if shadow_def is None and not is_text_extraction and value_column_name and source_event_table in db_profile.get_numeric_shadow_tables():
+        return safe_numeric_expression(value_ref)
+    return value_ref
+
+
+def _build_aggregate_select_list(
+    selected_methods: List[Tuple[str, psql.Identifier, Any, psql.SQL, str]],
+    val_expr: psql.Composable,
+    raw_val_expr: psql.Composable,
+    time_expr: psql.Composable,
+    match_flag: Optional[psql.Identifier] = None,
+    fused_prefix: str = "_fused",
+    fuse: bool = True
+) -> Tuple[List[psql.Composable], List[psql.Composable], List[Any]]:
+    """
+    生成聚合 SELECT 列表，返回 (内层聚合列表, 外层输出列表, 参数)。
+    match_flag 不为空时 (批量透视模式)，每个聚合调用都附加 FILTER (WHERE match_flag)。
+
+    MEDIAN/P25/P75/IQR 中需要两次及以上 PERCENTILE_CONT 时，合并为一次数组形式的 PERCENTILE_CONT；
+    选中 CV 时，MEAN/STDDEV_SAMP/CV 共用一次 AVG 与 STDDEV_SAMP。
+    合并后的中间结果以 fused_prefix 开头的列输出，由外层 SELECT 派生最终列 (见 _build_grouped_aggregate_query)。
+    fuse 为 False 时逐个方法套用 SQL_AGGREGATES 模板 (基准测试用于对比)。
+    """
+    agg_filter = psql.SQL(" FILTER (WHERE {})").format(match_flag) if match_flag is not None else psql.SQL("")
+    selected_keys = {m[4] for m in selected_methods}
+
+    percentile_calls = sum(2 if k == "IQR" else 1 for k in selected_keys & FUSED_PERCENTILE_METHODS)
+    fuse_percentiles = fuse and percentile_calls >= 2
+    fuse_moments = fuse and "CV" in selected_keys
 
-    # --- 7. 构建聚合查询 ---
-    group_by_key = psql.Identifier(cohort_join_key)
     agg_select_list = []
+    outer_select_list = []
     extra_params = []
 
-    for _, col_ident, template_obj, _ in selected_methods:
-        # 构建取值表达式 (使用策略处理类型转换)
-        # 注意：我们在 CTE 中已经将值列别名为 event_value
-        # 策略的 get_value_expression 需要知道这一点
-        # 为了简化，我们直接在 SQL 模板中替换 {val_col}
-        
-        val_expr = psql.Identifier('event_value')
-        
-        # 如果是 e-ICU 且非文本模式，需要转换
-        if "eicu" in db_profile.get_display_name().lower() and not is_text_extraction and value_column_name and source_event_table in ["public.nursecharting", "public.infusiondrug"]:
-             val_expr = psql.SQL("CAST(NULLIF(event_value, '') AS NUMERIC)")
-        
-        time_expr = psql.Identifier('event_time')
-
-        # 处理 JSON 特殊情况
-        if "JSON" in str(template_obj): # 简单判断，或者是检查 method_key
-             # 此时 template_obj 应该对应 SQL_AGGREGATES["MED_TIMESERIES_JSON"]
-             # 直接引用 CTE 列
-             sql_expr = psql.SQL(template_obj).format(
-                 val_col=psql.Identifier('event_value'),
-                 time_col=time_expr,
-                 stop_col=psql.Identifier('stoptime'),
-                 unit_col=psql.Identifier('dose_unit_rx'),
-                 form_col=psql.Identifier('form_unit_disp')
-             )
+    pct_ident = psql.Identifier(f"{fused_prefix}_pct")
+    avg_ident = psql.Identifier(f"{fused_prefix}_avg")
+    sd_ident = psql.Identifier(f"{fused_prefix}_sd")
+    if fuse_percentiles:
+        agg_select_list.append(psql.SQL("PERCENTILE_CONT(ARRAY[{fracs}]::DOUBLE PRECISION[]) WITHIN GROUP (ORDER BY {val}){flt} AS {alias}").format(
+            fracs=psql.SQL(', ').join(psql.Literal(f) for f in FUSED_PERCENTILE_FRACTIONS),
+            val=val_expr, flt=agg_filter, alias=pct_ident
+        ))
+    if fuse_moments:
+        agg_select_list.append(psql.SQL("AVG({val}){flt} AS {alias}").format(val=val_expr, flt=agg_filter, alias=avg_ident))
+        agg_select_list.append(psql.SQL("STDDEV_SAMP({val}){flt} AS {alias}").format(val=val_expr, flt=agg_filter, alias=sd_ident))
+
+    for _, col_ident, template_obj, _, method_key in selected_methods:
+        if fuse_percentiles and method_key in FUSED_PERCENTILE_METHODS:
+            if method_key == "IQR":
+                derived = psql.SQL("{pct}[3] - {pct}[1]").format(pct=pct_ident)
+            else:
+                derived = psql.SQL("{}[{}]").format(pct_ident, psql.SQL(str(FUSED_PERCENTILE_INDEX[method_key])))
+            outer_select_list.append(psql.SQL("{} AS {}").format(derived, col_ident))
+            continue
+        if fuse_moments and method_key in FUSED_MOMENT_METHODS:
+            if method_key == "CV":
+                derived = psql.SQL("CASE WHEN {avg} IS DISTINCT FROM 0 THEN {sd} / {avg} ELSE NULL END").format(avg=avg_ident, sd=sd_ident)
+            else:
+                derived = avg_ident if method_key == "MEAN" else sd_ident
+            outer_select_list.append(psql.SQL("{} AS {}").format(derived, col_ident))
+            continue
+
+        # 处理 JSON 特殊情况：直接引用 CTE 列
+        if method_key in JSON_AGGREGATE_METHODS:
+            sql_expr = psql.SQL(template_obj).format(
+                val_col=raw_val_expr,
+                time_col=time_expr,
+                stop_col=psql.Identifier('stoptime'),
+                unit_col=psql.Identifier('dose_unit_rx'),
+                form_col=psql.Identifier('form_unit_disp'),
+                agg_filter=agg_filter
+            )
+        elif method_key in ARRAY_SERIES_OUTPUTS:
+            sql_expr = psql.SQL(template_obj).format(
+                val_col=val_expr,
+                time_col=time_expr,
+                stop_col=psql.Identifier('stoptime'),
+                dose_col=psql.SQL("SUBSTRING(CAST({} AS TEXT) FROM {})").format(raw_val_expr, psql.Literal(LEADING_NUMBER_PATTERN)),
+                unit_col=psql.Identifier('dose_unit_rx'),
+                form_col=psql.Identifier('form_unit_disp'),
+                agg_filter=agg_filter
+            )
         elif isinstance(template_obj, tuple): # 带参数的模板 (如正则)
             tmpl_str, params = template_obj
-            sql_expr = psql.SQL("(ARRAY_AGG({}))[1]").format(
-                psql.SQL(tmpl_str).format(val_col=val_expr)
+            sql_expr = psql.SQL("(ARRAY_AGG({}){})[1]").format(
+                psql.SQL(tmpl_str).format(val_col=val_expr), agg_filter
             )
             extra_params.extend(params)
-        elif template_obj in ["COUNT(*)", "TRUE"]:
-            sql_expr = psql.SQL(template_obj)
         else: # 标准聚合
-            sql_expr = psql.SQL(template_obj).format(val_col=val_expr, time_col=time_expr)
-        
+            sql_expr = psql.SQL(template_obj).format(val_col=val_expr, time_col=time_expr, agg_filter=agg_filter)
+
+        if match_flag is not None and method_key in COUNT_LIKE_METHODS:
+            # 该项无任何匹配事件时返回 NULL，而不是 0
+            sql_expr = psql.SQL("CASE WHEN BOOL_OR({flag}) THEN {expr} END").format(flag=match_flag, expr=sql_expr)
+
         agg_select_list.append(psql.SQL("{} AS {}").format(sql_expr, col_ident))
+        outer_select_list.append(col_ident)
+
+    return agg_select_list, outer_select_list, extra_params
+
 
-    main_query = psql.SQL("SELECT {group}, {aggs} FROM FilteredEvents GROUP BY {group}").format(
-        group=group_by_key, aggs=psql.SQL(', ').join(agg_select_list)
+def _split_ordered_pick_methods(
+    selected_methods: List[Tuple[str, psql.Identifier, Any, psql.SQL, str]],
+    val_expr: psql.Composable,
+    time_expr: psql.Composable,
+    match_flag: Optional[psql.Identifier] = None,
+    alias_prefix: str = "pick"
+) -> Tuple[List[Tuple[str, psql.Identifier, Any, psql.SQL, str]], List[Dict[str, Any]]]:
+    """
+    从已选方法中拆出 FIRST/LAST 类方法，返回 (其余方法, 取值子查询定义列表)。
+    每个排序方向对应一个 DISTINCT ON 子查询定义，供 _build_grouped_aggregate_query 关联。
+    """
+    remaining_methods = []
+    picks_by_direction: Dict[str, List[Tuple[psql.Composable, psql.Identifier]]] = {}
+    for method in selected_methods:
+        direction = ORDERED_PICK_DIRECTIONS.get(method[4])
+        if direction is None or isinstance(method[2], tuple):
+            remaining_methods.append(method)
+            continue
+        picks_by_direction.setdefault(direction, []).append((val_expr, method[1]))
+
+    ordered_picks = [
+        {
+            "alias": psql.Identifier(f"{alias_prefix}_{direction.lower()}"),
+            "direction": psql.SQL(direction),
+            "time_expr": time_expr,
+            "match_flag": match_flag,
+            "columns": columns,
+        }
+        for direction, columns in picks_by_direction.items()
+    ]
+    return remaining_methods, ordered_picks
+
+
+def _build_grouped_aggregate_query(
+    group_by_key: psql.Identifier,
+    agg_select_list: List[psql.Composable],
+    outer_select_list: List[psql.Composable],
+    ordered_picks: Optional[List[Dict[str, Any]]] = None
+) -> psql.Composable:
+    """
+    生成基于 FilteredEvents 的分组聚合查询。
+    存在合并计算的中间列或 FIRST/LAST 取值子查询时，外包一层 SELECT：
+    从中间列派生最终输出列，并按分组键 LEFT JOIN 各 DISTINCT ON 子查询。
+    """
+    grouped = psql.SQL("SELECT {cols} FROM FilteredEvents GROUP BY {group}").format(
+        cols=psql.SQL(', ').join([group_by_key] + agg_select_list), group=group_by_key
     )
+    is_plain = len(agg_select_list) == len(outer_select_list) and all(isinstance(c, psql.Identifier) for c in outer_select_list)
+    if is_plain and not ordered_picks:
+        return grouped
 
-    # --- 8. 组装最终 SQL (Execution or Preview) ---
-    final_params = params_for_cte + extra_params
-    
-    # 基础 CTE 部分
-    base_cte_part = psql.SQL("WITH {cte} {main}").format(cte=filtered_events_cte_sql, main=main_query)
+    agg_alias = psql.Identifier("agg")
+    select_cols = [psql.SQL("{}.{}").format(agg_alias, group_by_key)] + outer_select_list
+    pick_joins = []
+    for pick in ordered_picks or []:
+        pick_alias = pick["alias"]
+        where_clause = psql.SQL(" WHERE {}").format(pick["match_flag"]) if pick["match_flag"] is not None else psql.SQL("")
+        pick_joins.append(psql.SQL(
+            "LEFT JOIN (SELECT DISTINCT ON ({key}) {key}, {vals} FROM FilteredEvents{where} "
+            "ORDER BY {key}, {time} {direction} NULLS LAST) {alias} ON {alias}.{key} = {agg}.{key}"
+        ).format(
+            key=group_by_key,
+            vals=psql.SQL(', ').join(psql.SQL("{} AS {}").format(expr, col) for expr, col in pick["columns"]),
+            where=where_clause, time=pick["time_expr"], direction=pick["direction"],
+            alias=pick_alias, agg=agg_alias
+        ))
+        select_cols.extend(psql.SQL("{}.{}").format(pick_alias, col) for _, col in pick["columns"])
 
-    if for_execution:
-        # 生成 ALTER, CREATE TEMP, UPDATE, DROP 序列
-        alter_cols = [psql.SQL("ADD COLUMN IF NOT EXISTS {} {}").format(i, t) for _, i, _, t in selected_methods]
-        alter_sql = psql.SQL("ALTER TABLE {tgt} ").format(tgt=target_table_ident) + psql.SQL(', ').join(alter_cols) + psql.SQL(";")
-        
-        tmp_name = f"temp_merge_{base_new_column_name}_{int(time.time())%1000}"[:60]
+    return psql.SQL("SELECT {cols} FROM ({grouped}) {agg} {joins}").format(
+        cols=psql.SQL(', ').join(select_cols), grouped=grouped, agg=agg_alias,
+        joins=psql.SQL(' ').join(pick_joins)
+    )
+
+
+def _build_rebuild_create_step(target_table_ident: psql.Identifier, rebuild_name: str) -> Tuple[psql.Composable, None]:
+    """
+    以 LIKE 原表创建空的重建表 (保留列默认值、NOT NULL 与存储参数)，并沿用原表的持久性 (UNLOGGED 队列仍为 UNLOGGED)。
+    约束与索引在写入数据、替换原表之后由 _build_rebuild_swap_step 重建。DO 块须以 params=None 执行。
+    """
+    schema_name, table_only_name = target_table_ident.strings
+    return (psql.SQL("""DO $rebuild$
+DECLARE
+    v_schema TEXT := {schema};
+    v_table TEXT := {table};
+    v_new TEXT := {new};
+    v_persistence "char";
+BEGIN
+    SELECT c.relpersistence INTO v_persistence FROM pg_class c WHERE c.oid = format('%I.%I', v_schema, v_table)::REGCLASS;
+    EXECUTE format('DROP TABLE IF EXISTS %I.%I', v_schema, v_new);
+    EXECUTE format('CREATE %s TABLE %I.%I (LIKE %I.%I INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING IDENTITY INCLUDING STORAGE INCLUDING COMMENTS)',
+                   CASE WHEN v_persistence = 'u' THEN 'UNLOGGED' ELSE '' END, v_schema, v_new, v_schema, v_table);
+END
+$rebuild$""").format(schema=psql.Literal(schema_name), table=psql.Literal(table_only_name), new=psql.Literal(rebuild_name)), None)
+
+
+def _build_rebuild_swap_step(target_table_ident: psql.Identifier, rebuild_name: str, index_columns: List[str]) -> Tuple[psql.Composable, None]:
+    """
+    用重建表替换原表: 先从系统目录读取原表的约束 (pg_get_constraintdef) 与其他索引 (pg_get_indexdef) 定义，
+    删除原表、重命名新表后按原名重新创建；index_columns 中仍没有以其为首列的索引的列再补建普通索引，最后 ANALYZE。
+    DO 块须以 params=None 执行。
+    """
+    schema_name, table_only_name = target_table_ident.strings
+    return (psql.SQL("""DO $rebuild$
+DECLARE
+    v_schema TEXT := {schema};
+    v_table TEXT := {table};
+    v_new TEXT := {new};
+    v_index_cols TEXT[] := {index_cols};
+    v_constraints TEXT[];
+    v_indexes TEXT[];
+    v_def TEXT;
+    v_col TEXT;
+BEGIN
+    SELECT COALESCE(array_agg(format('ALTER TABLE %I.%I ADD CONSTRAINT %I ', v_schema, v_table, con.conname) || pg_get_constraintdef(con.oid)
+                              ORDER BY con.contype = 'f', con.conname), ARRAY[]::TEXT[])
+    INTO v_constraints FROM pg_constraint con
+    WHERE con.conrelid = format('%I.%I', v_schema, v_table)::REGCLASS AND con.contype IN ('p', 'u', 'c', 'x', 'f');
+    SELECT COALESCE(array_agg(pg_get_indexdef(i.indexrelid)), ARRAY[]::TEXT[])
+    INTO v_indexes FROM pg_index i
+    WHERE i.indrelid = format('%I.%I', v_schema, v_table)::REGCLASS
+      AND NOT EXISTS (SELECT 1 FROM pg_constraint con WHERE con.conindid = i.indexrelid AND con.conrelid = i.indrelid);
+    EXECUTE format('DROP TABLE %I.%I', v_schema, v_table);
+    EXECUTE format('ALTER TABLE %I.%I RENAME TO %I', v_schema, v_new, v_table);
+    FOREACH v_def IN ARRAY v_constraints LOOP
+        EXECUTE v_def;
+    END LOOP;
+    FOREACH v_def IN ARRAY v_indexes LOOP
+        EXECUTE v_def;
+    END LOOP;
+    FOREACH v_col IN ARRAY v_index_cols LOOP
+        IF EXISTS (SELECT 1 FROM pg_attribute a WHERE a.attrelid = format('%I.%I', v_schema, v_table)::REGCLASS
+                   AND a.attname::TEXT = v_col AND a.attnum > 0 AND NOT a.attisdropped)
+           AND NOT EXISTS (SELECT 1 FROM pg_index i JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+                           WHERE i.indrelid = format('%I.%I', v_schema, v_table)::REGCLASS AND a.attname::TEXT = v_col) THEN
+            EXECUTE format('CREATE INDEX ON %I.%I (%I)', v_schema, v_table, v_col);
+        END IF;
+    END LOOP;
+    EXECUTE format('ANALYZE %I.%I', v_schema, v_table);
+END
+$rebuild$""").format(
+        schema=psql.Literal(schema_name), table=psql.Literal(table_only_name), new=psql.Literal(rebuild_name),
+        index_cols=psql.SQL("CAST({} AS TEXT[])").format(psql.Literal(list(index_columns)))
+    ), None)
+
+
+def _build_execution_steps(
+    target_table_ident: psql.Identifier,
+    query_sql: psql.Composable,
+    query_params: List[Any],
+    selected_methods: List[Tuple[str, psql.Identifier, Any, psql.SQL, str]],
+    group_by_key: psql.Identifier,
+    tmp_base_name: str,
+    merge_strategy: str = MERGE_STRATEGY_UPDATE,
+    index_columns: Optional[List[str]] = None,
+    staging_table_ident: Optional[psql.Identifier] = None
+) -> List[Tuple[psql.Composable, Optional[List[Any]]]]:
+    """
+    生成执行步骤序列。
+    - update:  ALTER, CREATE TEMP, UPDATE, DROP
+    - rebuild: CREATE TEMP, DROP 宽视图, DROP 旧列, CREATE TABLE 新表 (LIKE 原表, 沿用持久性) + INSERT 队列 LEFT JOIN 临时表,
+               DROP 原表, RENAME 新表, 按原定义重建约束与索引, ANALYZE, 重新生成宽视图, DROP TEMP
+    - narrow:  CREATE TEMP, 写入特征表 {队列表}__f__<列基础名> 并重新生成宽视图, DROP TEMP (不修改队列表)
+    原地更新同样在最后重新生成宽视图，使其包含新加入队列表的列。
+    所有步骤由 MergeSQLWorker 在同一事务中执行，因此表替换是原子的。
+    给定 staging_table_ident 时 (分区并行执行)，聚合结果已写入该中间表，不再生成 CREATE TEMP 步骤，
+    最后一步删除中间表。
+    """
+    md_alias = psql.Identifier("md")
+    target_alias = psql.Identifier("target")
+
+    if staging_table_ident is not None:
+        tmp_ident = staging_table_ident
+        load_steps = []
+    else:
+        tmp_name = f"temp_merge_{tmp_base_name}_{int(time.time())%1000}"[:60]
         tmp_ident = psql.Identifier(tmp_name)
-        
-        create_tmp = psql.SQL("CREATE TEMPORARY TABLE {tmp} AS {query}").format(tmp=tmp_ident, query=base_cte_part)
-        
-        updates = [psql.SQL("{col} = {src}.{col}").format(col=i, src=md_alias) for _, i, _, _ in selected_methods]
-        update_sql = psql.SQL("UPDATE {tgt} {alias} SET {sets} FROM {tmp} {src} WHERE {alias}.{key} = {src}.{key}").format(
-            tgt=target_table_ident, alias=target_alias, sets=psql.SQL(', ').join(updates),
-            tmp=tmp_ident, src=md_alias, key=group_by_key
+        create_tmp = psql.SQL("CREATE TEMPORARY TABLE {tmp} AS {query}").format(tmp=tmp_ident, query=query_sql)
+        load_steps = [(create_tmp, query_params)]
+    drop_sql = psql.SQL("DROP TABLE IF EXISTS {}").format(tmp_ident)
+
+    if merge_strategy == MERGE_STRATEGY_NARROW:
+        return load_steps + build_feature_table_steps(
+            target_table_ident, tmp_ident, selected_methods, group_by_key, tmp_base_name
+        ) + [(drop_sql, None)]
+
+    if merge_strategy == MERGE_STRATEGY_REBUILD:
+        schema_name, table_only_name = target_table_ident.strings
+        rebuild_name = f"{table_only_name}__rebuild"[:63]
+        rebuild_ident = psql.Identifier(schema_name, rebuild_name)
+
+        # 先删除同名旧列 (仅修改元数据)，使 target.* 不与新特征列冲突；重建后表中不会残留已删除列
+        drop_cols = [psql.SQL("DROP COLUMN IF EXISTS {}").format(m[1]) for m in selected_methods]
+        drop_cols_sql = psql.SQL("ALTER TABLE {tgt} ").format(tgt=target_table_ident) + psql.SQL(', ').join(drop_cols) + psql.SQL(";")
+
+        new_cols = [psql.SQL("CAST({src}.{col} AS {type})").format(src=md_alias, col=m[1], type=m[3]) for m in selected_methods]
+        add_cols = [psql.SQL("ADD COLUMN {} {}").format(m[1], m[3]) for m in selected_methods]
+        create_new_sql = psql.SQL("ALTER TABLE {new} ").format(new=rebuild_ident) + psql.SQL(', ').join(add_cols) + psql.SQL(
+            "; INSERT INTO {new} SELECT {alias}.*, {cols} FROM {tgt} {alias} "
+            "LEFT JOIN {tmp} {src} ON {alias}.{key} = {src}.{key}"
+        ).format(
+            new=rebuild_ident, alias=target_alias, cols=psql.SQL(', ').join(new_cols),
+            tgt=target_table_ident, tmp=tmp_ident, src=md_alias, key=group_by_key
         )
-        
-        drop_sql = psql.SQL("DROP TABLE IF EXISTS {}").format(tmp_ident)
-        
-        return [
-            (alter_sql, None),
-            (create_tmp, final_params),
-            (update_sql, None),
-            (drop_sql, None)
-        ], "execution_list", base_new_column_name, generated_column_details_for_preview
 
-    else:
-        # 生成预览 SQL (采样)
-        # 这里的技巧是：先对 target table 采样，然后作为 SampledCohort CTE，再与 FilteredEvents 关联
-        # 注意：为了性能，我们重写 FilteredEvents 的源头为 SampledCohort
-        
-        # 重建 CTE 以使用采样表
-        sampled_name = psql.Identifier("SampledCohort")
-        sampled_cte = psql.SQL("{name} AS (SELECT * FROM {tgt} ORDER BY RANDOM() LIMIT {lim})").format(
-            name=sampled_name, tgt=target_table_ident, lim=psql.Literal(preview_limit)
+        steps = load_steps + [
+            build_drop_wide_view_step(target_table_ident),
+            (drop_cols_sql, None),
+            _build_rebuild_create_step(target_table_ident, rebuild_name),
+            (create_new_sql, None),
+            _build_rebuild_swap_step(target_table_ident, rebuild_name, index_columns or []),
+        ]
+        steps.append(build_refresh_wide_view_step(target_table_ident, group_by_key))
+        steps.append((drop_sql, None))
+        return steps
+
+    alter_cols = [psql.SQL("ADD COLUMN IF NOT EXISTS {} {}").format(m[1], m[3]) for m in selected_methods]
+    alter_sql = psql.SQL("ALTER TABLE {tgt} ").format(tgt=target_table_ident) + psql.SQL(', ').join(alter_cols) + psql.SQL(";")
+    
+    updates = [psql.SQL("{col} = {src}.{col}").format(col=m[1], src=md_alias) for m in selected_methods]
+    update_sql = psql.SQL("UPDATE {tgt} {alias} SET {sets} FROM {tmp} {src} WHERE {alias}.{key} = {src}.{key}").format(
+        tgt=target_table_ident, alias=target_alias, sets=psql.SQL(', ').join(updates),
+        tmp=tmp_ident, src=md_alias, key=group_by_key
+    )
+    
+    return [(alter_sql, None)] + load_steps + [
+        (update_sql, None),
+        build_refresh_wide_view_step(target_table_ident, group_by_key),
+        (drop_sql, None)
+    ]
+
+
+def _build_partition_condition(
+    cohort_alias: psql.Identifier,
+    group_by_key: psql.Identifier,
+    partition_count: int,
+    partition_index: int
+) -> psql.Composable:
+    """按队列连接键的哈希值划分分区，同一键的所有事件落在同一分区，因此各分区的分组聚合互不重叠。"""
+    return psql.SQL("MOD(HASHTEXT(CAST({coh}.{key} AS TEXT)) & 2147483647, {n}) = {i}").format(
+        coh=cohort_alias, key=group_by_key, n=psql.Literal(int(partition_count)), i=psql.Literal(int(partition_index))
+    )
+
+
+def _build_partitioned_execution_plan(
+    target_table_ident: psql.Identifier,
+    build_query_for_partition,
+    query_params: List[Any],
+    selected_methods: List[Tuple[str, psql.Identifier, Any, psql.SQL, str]],
+    group_by_key: psql.Identifier,
+    tmp_base_name: str,
+    partition_count: int,
+    merge_strategy: str = MERGE_STRATEGY_UPDATE,
+    index_columns: Optional[List[str]] = None
+) -> Dict[str, Any]:
+    """
+    生成分区并行执行计划。build_query_for_partition(index) 返回只处理该分区的聚合查询，index 为 None 时不加分区条件。
+    临时表只对创建它的会话可见，因此各分区连接共同写入与队列表同 schema 的 UNLOGGED 中间表：
+    - prepare_steps:   创建空的中间表 (需单独提交，其他连接才能看到)
+    - partition_steps: 每个分区一条 INSERT，可在不同连接上并发执行
+    - finalize_steps:  与普通执行相同的 UPDATE/重建 步骤 (单事务)，最后删除中间表
+    """
+    schema_name, table_only_name = target_table_ident.strings
+    staging_name = f"{table_only_name}__stage_{tmp_base_name}_{int(time.time())%1000}"[:63]
+    staging_ident = psql.Identifier(schema_name, staging_name)
+
+    prepare_steps = [(
+        psql.SQL("DROP TABLE IF EXISTS {stg}; CREATE UNLOGGED TABLE {stg} AS {query} WITH NO DATA").format(
+            stg=staging_ident, query=build_query_for_partition(None)
+        ),
+        query_params
+    )]
+    partition_steps = [
+        (psql.SQL("INSERT INTO {stg} {query}").format(stg=staging_ident, query=build_query_for_partition(i)), query_params)
+        for i in range(partition_count)
+    ]
+    finalize_steps = _build_execution_steps(
+        target_table_ident, None, [], selected_methods, group_by_key, tmp_base_name,
+        merge_strategy=merge_strategy, index_columns=index_columns, staging_table_ident=staging_ident
+    )
+    return {
+        "staging_table": staging_ident,
+        "prepare_steps": prepare_steps,
+        "partition_steps": partition_steps,
+        "finalize_steps": finalize_steps,
+    }
+
+
+def _build_sampled_cohort_cte(
+    sampled_name: psql.Composable,
+    target_table_ident: psql.Identifier,
+    preview_limit: int,
+    key_column: Optional[str],
+    preview_sampling: Optional[Dict[str, Any]] = None
+) -> psql.Composable:
+    """
+    生成预览用的 SampledCohort CTE。
+    preview_sampling: {"method": 采样方式, "seed": 种子, "estimated_rows": 估计行数, "relkind": 关系类型}，
+    为空时沿用 ORDER BY RANDOM()。
+    """
+    sampling = preview_sampling or {}
+    sample_query = build_sample_query(
+        target_table_ident, preview_limit,
+        method=sampling.get("method", SAMPLING_RANDOM),
+        seed=sampling.get("seed"),
+        estimated_rows=sampling.get("estimated_rows"),
+        key_column=key_column,
+        relkind=sampling.get("relkind", 'r')
+    )
+    return psql.SQL("{name} AS ({query})").format(name=sampled_name, query=sample_query)
+
+
+def _build_preview_query(
+    sampled_cte: psql.Composable,
+    sampled_name: psql.Identifier,
+    filtered_events_cte_sql: psql.Composable,
+    main_query: psql.Composable,
+    selected_methods: List[Tuple[str, psql.Identifier, Any, psql.SQL, str]],
+    group_by_key: psql.Identifier,
+    cohort_alias: psql.Identifier
+) -> psql.Composable:
+    md_alias = psql.Identifier("md")
+    preview_selects = [psql.SQL("{}.*").format(cohort_alias)]
+    for m in selected_methods:
+        preview_selects.append(psql.SQL("{}.{}").format(md_alias, m[1]))
+
+    return psql.SQL(
+        "WITH {sampled}, {filtered}, MergedData AS ({agg_query}) "
+        "SELECT {cols} FROM {sampled_name} {coh} "
+        "LEFT JOIN MergedData {md} ON {coh}.{key} = {md}.{key}"
+    ).format(
+        sampled=sampled_cte,
+        filtered=filtered_events_cte_sql,
+        agg_query=main_query, # main_query 依赖 FilteredEvents
+        cols=psql.SQL(', ').join(preview_selects),
+        sampled_name=sampled_name, coh=cohort_alias, md=md_alias, key=group_by_key
+    )
+
+def _build_feature_cache_steps(
+    target_table_ident: psql.Identifier,
+    panel_specific_config: Dict[str, Any],
+    db_profile: BaseDbProfile,
+    selected_methods: List[Tuple[str, psql.Identifier, Any, psql.SQL, str]],
+    group_by_key: psql.Identifier,
+    build_filtered_events_cte,
+    build_main_query,
+    params_for_cte: List[Any],
+    tmp_base_name: str,
+    merge_strategy: str = MERGE_STRATEGY_UPDATE
+) -> List[Tuple[psql.Composable, Optional[List[Any]]]]:
+    """
+    经由特征缓存的执行步骤：建表 -> 按水位线失效 -> 计算缺失键 -> 登记 -> 淘汰 -> 从缓存写回队列表。
+    缓存表的列使用固定基础名生成，与 selected_methods 一一对应。
+    """
+    source_event_table = panel_specific_config.get("source_event_table")
+    cache_methods, _, _ = _collect_output_columns(FEATURE_CACHE_COLUMN_BASE, panel_specific_config, db_profile.get_event_time_array_type())
+    cache_query, cache_agg_params = build_main_query(cache_methods)
+    cache_params = params_for_cte + cache_agg_params
+
+    feature_hash = compute_feature_hash(panel_specific_config, db_profile.get_display_name(), group_by_key.string)
+    cache_ident = get_cache_table_ident(feature_hash)
+
+    def with_cohort(cohort_source):
+        return psql.SQL("WITH {cte} {main}").format(cte=build_filtered_events_cte(cohort_source), main=cache_query)
+
+    steps = build_cache_setup_steps(cache_ident, with_cohort(target_table_ident), cache_params, group_by_key)
+    steps.append(build_invalidation_step(feature_hash, cache_ident, source_event_table))
+    steps.extend(build_cache_fill_steps(
+        target_table_ident, cache_ident, group_by_key,
+        with_cohort(build_missing_keys_source(target_table_ident, cache_ident, group_by_key)), cache_params,
+        [m[1] for m in cache_methods]
+    ))
+    steps.append(build_registry_upsert_step(
+        feature_hash, cache_ident, source_event_table, group_by_key.string,
+        serialize_config_for_registry(panel_specific_config)
+    ))
+    steps.append(build_eviction_step(feature_hash))
+
+    read_query = build_cache_read_query(
+        target_table_ident, cache_ident, group_by_key,
+        [(cache_m[1], m[1]) for cache_m, m in zip(cache_methods, selected_methods)]
+    )
+    steps.extend(_build_execution_steps(
+        target_table_ident, read_query, [], selected_methods, group_by_key, tmp_base_name,
+        merge_strategy=merge_strategy, index_columns=db_profile.get_cohort_index_columns()
+    ))
+    return steps
+
+def _build_incremental_execution_steps(
+    target_table_ident: psql.Identifier,
+    panel_specific_config: Dict[str, Any],
+    db_profile: BaseDbProfile,
+    selected_methods: List[Tuple[str, psql.Identifier, Any, psql.SQL, str]],
+    group_by_key: psql.Identifier,
+    build_filtered_events_cte,
+    main_query: psql.Composable,
+    query_params: List[Any],
+    tmp_base_name: str
+) -> List[Tuple[psql.Composable, Optional[List[Any]]]]:
+    """
+    增量执行步骤：只计算尚未完成的队列键，UPDATE 只触及这些行。
+    已完成的键记录在与队列表同 schema 的标记表 {队列表}__computed (column_name, config_hash, 连接键) 中。
+    某个键需要计算，当且仅当至少一个目标列仍为 NULL，或它未被当前配置标记过全部目标列；
+    配置变化 (config_hash 不同) 时旧标记不再计数，因此按旧配置写入的非空值同样会重新计算。
+    增量模式始终使用原地更新方式写回。
+    """
+    schema_name, table_only_name = target_table_ident.strings
+    marker_ident = psql.Identifier(schema_name, get_computed_marker_name(table_only_name))
+    delta_ident = psql.Identifier(f"delta_keys_{tmp_base_name}_{int(time.time())%1000}"[:60])
+    config_hash = compute_feature_hash(panel_specific_config, db_profile.get_display_name(), group_by_key.string)
+    column_names = [m[0] for m in selected_methods]
+
+    setup_marker = psql.SQL(
+        "CREATE TABLE IF NOT EXISTS {marker} AS SELECT ''::TEXT AS column_name, ''::TEXT AS config_hash, {key} FROM {tgt} WITH NO DATA; "
+        "CREATE UNIQUE INDEX IF NOT EXISTS {idx} ON {marker} (column_name, {key})"
+    ).format(
+        marker=marker_ident, key=group_by_key, tgt=target_table_ident,
+        idx=psql.Identifier(f"{table_only_name}__computed_idx"[:63])
+    )
+    null_checks = psql.SQL(' OR ').join(psql.SQL("t.{} IS NULL").format(m[1]) for m in selected_methods)
+    create_delta = psql.SQL(
+        "CREATE TEMPORARY TABLE {delta} AS SELECT DISTINCT t.{key} FROM {tgt} t "
+        "WHERE t.{key} IS NOT NULL AND (({nulls}) OR (SELECT COUNT(*) FROM {marker} m "
+        "WHERE m.{key} = t.{key} AND m.config_hash = {hash} AND m.column_name = ANY({cols})) < {n})"
+    ).format(
+        delta=delta_ident, key=group_by_key, tgt=target_table_ident, nulls=null_checks, marker=marker_ident,
+        hash=psql.Literal(config_hash), cols=psql.Literal(column_names), n=psql.Literal(len(column_names))
+    )
+    delta_cohort = psql.SQL("(SELECT * FROM {tgt} t WHERE t.{key} IN (SELECT {key} FROM {delta}))").format(
+        tgt=target_table_ident, key=group_by_key, delta=delta_ident
+    )
+    mark_done = psql.SQL(
+        "INSERT INTO {marker} (column_name, config_hash, {key}) "
+        "SELECT col.name, {hash}, d.{key} FROM {delta} d CROSS JOIN UNNEST({cols}::TEXT[]) AS col(name) "
+        "ON CONFLICT (column_name, {key}) DO UPDATE SET config_hash = EXCLUDED.config_hash"
+    ).format(marker=marker_ident, key=group_by_key, hash=psql.Literal(config_hash), delta=delta_ident, cols=psql.Literal(column_names))
+
+    query_sql = psql.SQL("WITH {cte} {main}").format(cte=build_filtered_events_cte(delta_cohort), main=main_query)
+    merge_steps = _build_execution_steps(
+        target_table_ident, query_sql, query_params, selected_methods, group_by_key, tmp_base_name,
+        merge_strategy=MERGE_STRATEGY_UPDATE
+    )
+    # merge_steps: ALTER, CREATE TEMP, UPDATE, 重新生成宽视图, DROP TEMP；新列需先由 ALTER 添加，才能在增量判断中引用
+    alter_step, merge_body, drop_tmp_step = merge_steps[0], merge_steps[1:-1], merge_steps[-1]
+    return (
+        [alter_step, (setup_marker, None), (create_delta, None)]
+        + merge_body
+        + [(mark_done, None), drop_tmp_step, (psql.SQL("DROP TABLE IF EXISTS {}").format(delta_ident), None)]
+    )
+
+# ==========================================
+# 5. 主构建函数 (Refactored Main Function)
+# ==========================================
+
+def build_special_data_sql(
+    target_cohort_table_name: str,
+    base_new_column_name: str,
+    panel_specific_config: Dict[str, Any],
+    db_profile: BaseDbProfile,
+    active_db_params: Optional[Dict] = None,
+    for_execution: bool = False,
+    preview_limit: int = 100,
+    merge_strategy: str = MERGE_STRATEGY_UPDATE,
+    preview_sampling: Optional[Dict[str, Any]] = None,
+    partition_count: int = 1,
+    use_feature_cache: bool = False,
+    incremental: bool = False,
+    cohort_key_pushdown: Optional[bool] = None
+) -> Tuple[Optional[Any], Optional[str], Optional[List[Any]], List[Tuple[str, str]]]:
+    """
+    构建单项专项数据提取 SQL。
+    for_execution 且 partition_count > 1 时返回分区并行执行计划 (见 _build_partitioned_execution_plan)，
+    信号类型为 PARTITIONED_EXECUTION_SIGNAL。
+    use_feature_cache 为 True 时执行步骤改为经由特征缓存 (见 sql_logic/feature_cache.py)：
+    只计算缓存中缺失的键，再从缓存写回队列表；此时忽略 partition_count。
+    incremental 为 True 时 (且未使用特征缓存) 只计算尚未完成的队列键 (见 _build_incremental_execution_steps)，
+    此时忽略 partition_count，并始终使用原地更新方式写回 (不支持窄表存储)。
+    cohort_key_pushdown 控制是否使用队列键半连接下推 (见 _build_cohort_key_pushdown_condition)，
+    为 None 时取数据库画像的默认值 (BaseDbProfile.use_cohort_key_pushdown)。
+    """
+    
+    # 处理特殊的“预处理表合并”模式 (保持原有逻辑)
+    if panel_specific_config.get("panel_type") == "merge_preprocessed":
+        return build_merge_preprocessed_sql(
+            target_cohort_table_name, panel_specific_config, db_profile, active_db_params, for_execution, preview_limit,
+            preview_sampling=preview_sampling
         )
-        
-        # 替换原始 CTE 中的 JOIN 目标
-        cte_sql_preview = filtered_events_cte_sql # 这里其实复用了对象，但 format 参数不同
-        # 我们需要重新构建 CTE 字符串，将 target_table_ident 替换为 sampled_name
-        # 上面第 5 步使用的是 target_table_ident。为了预览，我们需要修改 join 的右表。
-        
-        # 简便方法：在预览模式下，我们构建一个新的 JOIN 子句
-        if override_join:
-             # 复杂情况暂时不替换，直接用全表 (preview limit 会限制最终结果，但中间计算可能慢)
-             # 或者简单的在此处只做全表 LIMIT
-             pass 
-        else:
-             # 标准替换
-             from_join_clause_preview = psql.SQL("FROM {event_table} {evt_alias} JOIN {cohort_table} {coh_alias} ON {evt_alias}.{evt_key} = {coh_alias}.{coh_key}").format(
-                event_table=psql.SQL(source_event_table), evt_alias=event_alias,
-                cohort_table=sampled_name, coh_alias=cohort_alias, # <--- 关键替换
-                evt_key=psql.Identifier(event_join_key), coh_key=psql.Identifier(cohort_join_key)
+
+    # 带分箱宽度的相对时间窗口：输出为分箱长表
+    time_window_spec = panel_specific_config.get("time_window_spec")
+    if time_window_spec and float(time_window_spec.get("bin_hours") or 0) > 0:
+        return build_binned_feature_sql(
+            target_cohort_table_name, base_new_column_name, panel_specific_config, db_profile,
+            for_execution=for_execution, preview_limit=preview_limit, preview_sampling=preview_sampling,
+            cohort_key_pushdown=cohort_key_pushdown
+        )
+
+    # --- 1. 参数提取 ---
+    source_event_table = panel_specific_config.get("source_event_table")
+    value_column_name = panel_specific_config.get("value_column_to_extract") 
+    time_col_name = panel_specific_config.get("time_column_in_event_table")
+    aggregation_methods = panel_specific_config.get("aggregation_methods", {})
+    time_window_text = panel_specific_config.get("time_window_text")
+
+    # --- 2. 基础校验 ---
+    if not all([source_event_table, time_window_text or time_window_spec]):
+        return None, "配置不完整 (缺少源表或时间窗口)", [], []
+    if time_window_spec:
+        spec_error = validate_time_window_spec(time_window_spec)
+        if spec_error:
+            return None, spec_error, [], []
+    
+    table_parts = _split_table_name(target_cohort_table_name)
+    if not table_parts:
+        return None, "目标表名格式错误 (Schema.Table)", [], []
+    if for_execution and merge_strategy == MERGE_STRATEGY_NARROW and get_feature_table_prefix(table_parts[1]) is None:
+        return None, "队列表名过长，无法使用窄表存储", [], []
+
+    # --- 3. 初始化对象 ---
+    target_table_ident = psql.Identifier(*table_parts)
+    cohort_alias = psql.Identifier("cohort")
+    event_alias = psql.Identifier("evt")
+    
+    # 获取策略对象
+    strategy = get_sql_strategy(db_profile, event_alias, cohort_alias)
+
+    # --- 4. 构建 WHERE 子句 (通用逻辑) ---
+    all_where_conditions, params_for_cte = _collect_where_conditions(panel_specific_config, strategy, event_alias, db_profile)
+
+    # 数值影子表已准备时改读影子表中已解析的数值列
+    shadow_def = _resolve_shared_numeric_shadow([panel_specific_config], db_profile)
+
+    # 构建 SELECT 列表
+    select_defs = [psql.SQL("{}.*").format(cohort_alias)] # 保留所有队列列
+    
+    # 添加值列 (使用 event_value 别名)，类型转换在聚合阶段进行
+    if value_column_name:
+        select_defs.append(psql.SQL("{}.{} AS event_value").format(event_alias, psql.Identifier(_get_event_value_column(panel_specific_config, shadow_def))))
+    
+    # 添加时间列 (使用 event_time 别名)
+    if time_col_name:
+        select_defs.append(psql.SQL("{}.{} AS event_time").format(event_alias, psql.Identifier(time_col_name)))
+
+    # 添加 JSON 所需列 (使用策略)
+    if any(m in MED_SERIES_METHODS for m, s in aggregation_methods.items() if s):
+        select_defs.extend(strategy.get_med_json_columns())
+
+    if cohort_key_pushdown is None:
+        cohort_key_pushdown = db_profile.use_cohort_key_pushdown()
+
+    def build_filtered_events_cte(cohort_source: psql.Composable, partition_index: Optional[int] = None) -> psql.Composable:
+        conditions = list(all_where_conditions)
+        pushdown_condition = _build_cohort_key_pushdown_condition(
+            panel_specific_config, db_profile, event_alias,
+            _partition_pushdown_source(cohort_source, cohort_alias, group_by_key, partition_count, partition_index)
+        ) if cohort_key_pushdown else None
+        if pushdown_condition is not None:
+            conditions.insert(0, pushdown_condition)
+        if partition_index is not None:
+            conditions.append(_build_partition_condition(cohort_alias, group_by_key, partition_count, partition_index))
+        return psql.SQL("FilteredEvents AS (SELECT {selects} {joins} WHERE {conds})").format(
+            selects=psql.SQL(', ').join(select_defs),
+            joins=_build_cohort_join_clause(panel_specific_config, db_profile, event_alias, cohort_source, cohort_alias, shadow_def),
+            conds=psql.SQL(' AND ').join(conditions) if conditions else psql.SQL("TRUE")
+        )
+
+    # --- 5. 确定聚合列 ---
+    selected_methods, generated_column_details_for_preview, col_error = _collect_output_columns(
+        base_new_column_name, panel_specific_config, db_profile.get_event_time_array_type()
+    )
+    if col_error:
+        return None, col_error, [], []
+    if not selected_methods:
+        return None, "未选择任何有效的提取列", [], []
+
+    # --- 6. 构建聚合查询 ---
+    group_by_key = psql.Identifier(db_profile.get_cohort_join_key(source_event_table))
+    raw_val_expr = psql.Identifier('event_value')
+    time_expr = psql.Identifier('event_time')
+    val_expr = _get_aggregate_value_expression(db_profile, panel_specific_config, raw_val_expr, shadow_def)
+
+    def build_main_query(methods):
+        # FIRST/LAST 类方法在有时间列时改由 DISTINCT ON 子查询计算，再与其余聚合结果关联
+        aggregate_methods, ordered_picks = methods, []
+        if time_col_name:
+            aggregate_methods, ordered_picks = _split_ordered_pick_methods(methods, val_expr, time_expr)
+
+        agg_select_list, outer_select_list, agg_params = _build_aggregate_select_list(
+            aggregate_methods,
+            val_expr=val_expr,
+            raw_val_expr=raw_val_expr,
+            time_expr=time_expr
+        )
+        return _build_grouped_aggregate_query(group_by_key, agg_select_list, outer_select_list, ordered_picks), agg_params
+
+    main_query, extra_params = build_main_query(selected_methods)
+
+    # --- 7. 组装最终 SQL (Execution or Preview) ---
+    final_params = params_for_cte + extra_params
+
+    if for_execution and use_feature_cache:
+        steps = _build_feature_cache_steps(
+            target_table_ident, panel_specific_config, db_profile, selected_methods, group_by_key,
+            build_filtered_events_cte, build_main_query, params_for_cte, base_new_column_name,
+            merge_strategy=merge_strategy
+        )
+        return steps, "execution_list", base_new_column_name, generated_column_details_for_preview
+
+    if for_execution and incremental:
+        if merge_strategy == MERGE_STRATEGY_NARROW:
+            return None, "增量模式基于队列表中的目标列判断是否已计算，不支持窄表存储", [], []
+        steps = _build_incremental_execution_steps(
+            target_table_ident, panel_specific_config, db_profile, selected_methods, group_by_key,
+            build_filtered_events_cte, main_query, final_params, base_new_column_name
+        )
+        return steps, "execution_list", base_new_column_name, generated_column_details_for_preview
+
+    if for_execution:
+        if partition_count > 1:
+            plan = _build_partitioned_execution_plan(
+                target_table_ident,
+                lambda i: psql.SQL("WITH {cte} {main}").format(cte=build_filtered_events_cte(target_table_ident, i), main=main_query),
+                final_params, selected_methods, group_by_key, base_new_column_name, partition_count,
+                merge_strategy=merge_strategy, index_columns=db_profile.get_cohort_index_columns()
             )
-             # 重建 CTE
-             filtered_events_cte_sql = psql.SQL("FilteredEvents AS (SELECT {selects} {joins} WHERE {conds})").format(
-                selects=psql.SQL(', ').join(select_defs),
-                joins=from_join_clause_preview,
-                conds=psql.SQL(' AND ').join(all_where_conditions) if all_where_conditions else psql.SQL("TRUE")
+            return plan, PARTITIONED_EXECUTION_SIGNAL, base_new_column_name, generated_column_details_for_preview
+        base_cte_part = psql.SQL("WITH {cte} {main}").format(cte=build_filtered_events_cte(target_table_ident), main=main_query)
+        steps = _build_execution_steps(
+            target_table_ident, base_cte_part, final_params, selected_methods, group_by_key, base_new_column_name,
+            merge_strategy=merge_strategy, index_columns=db_profile.get_cohort_index_columns()
+        )
+        return steps, "execution_list", base_new_column_name, generated_column_details_for_preview
+
+    # 生成预览 SQL (采样)：先对 target table 采样作为 SampledCohort CTE，再与 FilteredEvents 关联
+    sampled_name = psql.Identifier("SampledCohort")
+    sampled_cte = _build_sampled_cohort_cte(sampled_name, target_table_ident, preview_limit, group_by_key.string, preview_sampling)
+    # 面板的覆盖 JOIN 模板同样通过 {cohort_table} 占位符接收 SampledCohort，事件表只与样本关联
+    preview_sql = _build_preview_query(
+        sampled_cte, sampled_name, build_filtered_events_cte(sampled_name), main_query,
+        selected_methods, group_by_key, cohort_alias
+    )
+    return preview_sql, None, final_params, generated_column_details_for_preview
+
+
+_special_data_build_memo = BuildMemo()
+
+
+def build_special_data_sql_memoized(
+    target_cohort_table_name: str,
+    base_new_column_name: str,
+    panel_specific_config: Dict[str, Any],
+    db_profile: BaseDbProfile,
+    active_db_params: Optional[Dict] = None,
+    for_execution: bool = False,
+    preview_limit: int = 100,
+    merge_strategy: str = MERGE_STRATEGY_UPDATE,
+    preview_sampling: Optional[Dict[str, Any]] = None,
+    partition_count: int = 1,
+    use_feature_cache: bool = False,
+    incremental: bool = False,
+    cohort_key_pushdown: Optional[bool] = None
+) -> Tuple[Optional[Any], Optional[str], Optional[List[Any]], List[Tuple[str, str]]]:
+    """
+    build_special_data_sql 的记忆化版本 (见 sql_logic/build_memo.py)，参数与返回值相同。
+    键为画像类、画像名称、配置的规范化形式与其余全部参数；只记忆化预览构建。
+    执行计划内含按时间生成的临时表名 (temp_merge_…、__stage_…、delta_keys_…)，
+    每次都重新构建；预处理表合并需要查询数据库，也不做记忆化。
+    """
+    build = lambda: build_special_data_sql(
+        target_cohort_table_name, base_new_column_name, panel_specific_config, db_profile,
+        active_db_params=active_db_params, for_execution=for_execution, preview_limit=preview_limit,
+        merge_strategy=merge_strategy, preview_sampling=preview_sampling, partition_count=partition_count,
+        use_feature_cache=use_feature_cache, incremental=incremental, cohort_key_pushdown=cohort_key_pushdown
+    )
+    if for_execution or panel_specific_config.get("panel_type") == "merge_preprocessed":
+        return build()
+    key = (
+        type(db_profile).__module__, type(db_profile).__qualname__, db_profile.get_display_name(), target_cohort_table_name, base_new_column_name,
+        freeze_value(panel_specific_config), for_execution, preview_limit, merge_strategy, freeze_value(preview_sampling),
+        partition_count, use_feature_cache, incremental, cohort_key_pushdown
+    )
+    return _special_data_build_memo.get_or_build(key, build)
+
+
+def clear_special_data_build_memo():
+    _special_data_build_memo.clear()
+
+
+def build_batch_pivot_sql(
+    target_cohort_table_name: str,
+    feature_configs: List[Tuple[str, Dict[str, Any]]],
+    db_profile: BaseDbProfile,
+    for_execution: bool = False,
+    preview_limit: int = 100,
+    merge_strategy: str = MERGE_STRATEGY_UPDATE,
+    preview_sampling: Optional[Dict[str, Any]] = None,
+    partition_count: int = 1,
+    cohort_key_pushdown: Optional[bool] = None
+) -> Tuple[Optional[Any], Optional[str], Optional[List[Any]], List[Tuple[str, str]]]:
+    """
+    批量透视模式：将多个针对同一事件表的面板配置合并为一次扫描。
+
+    feature_configs 为 [(新列基础名, panel_specific_config), ...]。
+    FilteredEvents 中为每个配置计算一个匹配标记列 match_N，WHERE 取各配置条件的并集，
+    聚合阶段通过 FILTER (WHERE match_N) 将事件分派到各自的输出列。
+    返回值结构与 build_special_data_sql 相同 (包括 partition_count > 1 时的分区并行执行计划)。
+    cohort_key_pushdown 的含义同 build_special_data_sql。
+    """
+    if not feature_configs:
+        return None, "批量任务列表为空", [], []
+
+    first_config = feature_configs[0][1]
+    source_event_table = first_config.get("source_event_table")
+    override_join = first_config.get("cte_join_on_cohort_override")
+
+    for base_name, config in feature_configs:
+        if config.get("panel_type") == "merge_preprocessed":
+            return None, f"'{base_name}': 预处理表合并不支持批量透视模式", [], []
+        if config.get("source_event_table") != source_event_table:
+            return None, f"'{base_name}': 批量透视要求所有配置使用同一事件表 ({source_event_table})", [], []
+        if str(config.get("cte_join_on_cohort_override") or "") != str(override_join or ""):
+            return None, f"'{base_name}': 批量透视要求所有配置使用相同的队列关联方式", [], []
+        window_spec = config.get("time_window_spec")
+        if not (config.get("time_window_text") or window_spec):
+            return None, f"'{base_name}': 配置不完整 (缺少时间窗口)", [], []
+        if window_spec:
+            spec_error = validate_time_window_spec(window_spec)
+            if spec_error:
+                return None, f"'{base_name}': {spec_error}", [], []
+            if float(window_spec.get("bin_hours") or 0) > 0:
+                return None, f"'{base_name}': 分箱时间序列输出不支持批量透视模式", [], []
+
+    if not source_event_table:
+        return None, "配置不完整 (缺少源表)", [], []
+
+    table_parts = _split_table_name(target_cohort_table_name)
+    if not table_parts:
+        return None, "目标表名格式错误 (Schema.Table)", [], []
+    if for_execution and merge_strategy == MERGE_STRATEGY_NARROW and get_feature_table_prefix(table_parts[1]) is None:
+        return None, "队列表名过长，无法使用窄表存储", [], []
+
+    target_table_ident = psql.Identifier(*table_parts)
+    cohort_alias = psql.Identifier("cohort")
+    event_alias = psql.Identifier("evt")
+    strategy = get_sql_strategy(db_profile, event_alias, cohort_alias)
+
+    select_defs = [psql.SQL("{}.*").format(cohort_alias)]
+    select_params = []
+    match_conditions = []
+    where_params = []
+    all_selected_methods = []
+    all_column_details = []
+    agg_select_list = []
+    outer_select_list = []
+    ordered_picks = []
+    agg_params = []
+    needs_med_json = False
+
+    shadow_def = _resolve_shared_numeric_shadow([config for _, config in feature_configs], db_profile)
+    for idx, (base_name, config) in enumerate(feature_configs):
+        conditions, cond_params = _collect_where_conditions(config, strategy, event_alias, db_profile)
+        condition_sql = psql.SQL("({})").format(psql.SQL(' AND ').join(conditions) if conditions else psql.SQL("TRUE"))
+
+        match_flag = psql.Identifier(f"match_{idx}")
+        value_ident = psql.Identifier(f"event_value_{idx}")
+        time_ident = psql.Identifier(f"event_time_{idx}")
+
+        value_column_name = _get_event_value_column(config, shadow_def)
+        time_col_name = config.get("time_column_in_event_table")
+
+        select_defs.append(psql.SQL("{} AS {}").format(condition_sql, match_flag))
+        select_params.extend(cond_params)
+        select_defs.append(
+            psql.SQL("{}.{} AS {}").format(event_alias, psql.Identifier(value_column_name), value_ident)
+            if value_column_name else psql.SQL("NULL AS {}").format(value_ident)
+        )
+        select_defs.append(
+            psql.SQL("{}.{} AS {}").format(event_alias, psql.Identifier(time_col_name), time_ident)
+            if time_col_name else psql.SQL("NULL AS {}").format(time_ident)
+        )
+        match_conditions.append(condition_sql)
+        where_params.extend(cond_params)
+
+        selected_methods, column_details, col_error = _collect_output_columns(base_name, config, db_profile.get_event_time_array_type())
+        if col_error:
+            return None, col_error, [], []
+        if not selected_methods:
+            return None, f"'{base_name}': 未选择任何有效的提取列", [], []
+        known_names = {m[0] for m in all_selected_methods}
+        duplicated = [m[0] for m in selected_methods if m[0] in known_names]
+        if duplicated:
+            return None, f"批量任务中存在重复的列名: {', '.join(duplicated)}", [], []
+
+        if any(config.get("aggregation_methods", {}).get(m) for m in MED_SERIES_METHODS):
+            needs_med_json = True
+
+        item_val_expr = _get_aggregate_value_expression(db_profile, config, value_ident, shadow_def)
+        item_methods, item_picks = selected_methods, []
+        if time_col_name:
+            item_methods, item_picks = _split_ordered_pick_methods(
+                selected_methods, item_val_expr, time_ident, match_flag=match_flag, alias_prefix=f"pick_{idx}"
             )
+        item_aggs, item_outputs, item_params = _build_aggregate_select_list(
+            item_methods,
+            val_expr=item_val_expr,
+            raw_val_expr=value_ident,
+            time_expr=time_ident,
+            match_flag=match_flag,
+            fused_prefix=f"_fused_{idx}"
+        )
+        agg_select_list.extend(item_aggs)
+        outer_select_list.extend(item_outputs)
+        ordered_picks.extend(item_picks)
+        agg_params.extend(item_params)
+        all_selected_methods.extend(selected_methods)
+        all_column_details.extend(column_details)
 
-        # 最终预览查询
-        preview_selects = [psql.SQL("{}.*").format(cohort_alias)]
-        for _, i, _, _ in selected_methods:
-            preview_selects.append(psql.SQL("{}.{}").format(md_alias, i))
+    if needs_med_json:
+        select_defs.extend(strategy.get_med_json_columns())
 
-        preview_sql = psql.SQL(
-            "WITH {sampled}, {filtered}, MergedData AS ({agg_query}) "
-            "SELECT {cols} FROM {sampled_name} {coh} "
-            "LEFT JOIN MergedData {md} ON {coh}.{key} = {md}.{key}"
-        ).format(
-            sampled=sampled_cte,
-            filtered=filtered_events_cte_sql,
-            agg_query=main_query, # main_query 依赖 FilteredEvents
-            cols=psql.SQL(', ').join(preview_selects),
-            sampled_name=sampled_name, coh=cohort_alias, md=md_alias, key=group_by_key
+    if cohort_key_pushdown is None:
+        cohort_key_pushdown = db_profile.use_cohort_key_pushdown()
+
+    def build_filtered_events_cte(cohort_source: psql.Composable, partition_index: Optional[int] = None) -> psql.Composable:
+        conds = psql.SQL("({})").format(psql.SQL(' OR ').join(match_conditions))
+        pushdown_condition = _build_cohort_key_pushdown_condition(
+            first_config, db_profile, event_alias,
+            _partition_pushdown_source(cohort_source, cohort_alias, group_by_key, partition_count, partition_index)
+        ) if cohort_key_pushdown else None
+        if pushdown_condition is not None:
+            conds = psql.SQL("{} AND {}").format(pushdown_condition, conds)
+        if partition_index is not None:
+            conds = psql.SQL("({}) AND {}").format(conds, _build_partition_condition(cohort_alias, group_by_key, partition_count, partition_index))
+        return psql.SQL("FilteredEvents AS (SELECT {selects} {joins} WHERE {conds})").format(
+            selects=psql.SQL(', ').join(select_defs),
+            joins=_build_cohort_join_clause(first_config, db_profile, event_alias, cohort_source, cohort_alias, shadow_def),
+            conds=conds
         )
-        
-        return preview_sql, None, final_params, generated_column_details_for_preview
+
+    group_by_key = psql.Identifier(db_profile.get_cohort_join_key(source_event_table))
+    main_query = _build_grouped_aggregate_query(group_by_key, agg_select_list, outer_select_list, ordered_picks)
+    # 参数顺序：SELECT 中的匹配标记 -> WHERE 中的条件并集 -> 聚合阶段参数
+    final_params = select_params + where_params + agg_params
+    batch_desc = f"批量透视 ({len(feature_configs)} 项, {source_event_table})"
+
+    if for_execution:
+        # 窄表存储时按批量中的列基础名命名特征表，重复执行同一批量任务会替换同一张特征表
+        tmp_base_name = "batch_" + "_".join(sorted(base_name for base_name, _ in feature_configs))
+        if partition_count > 1:
+            plan = _build_partitioned_execution_plan(
+                target_table_ident,
+                lambda i: psql.SQL("WITH {cte} {main}").format(cte=build_filtered_events_cte(target_table_ident, i), main=main_query),
+                final_params, all_selected_methods, group_by_key, tmp_base_name, partition_count,
+                merge_strategy=merge_strategy, index_columns=db_profile.get_cohort_index_columns()
+            )
+            return plan, PARTITIONED_EXECUTION_SIGNAL, batch_desc, all_column_details
+        base_cte_part = psql.SQL("WITH {cte} {main}").format(cte=build_filtered_events_cte(target_table_ident), main=main_query)
+        steps = _build_execution_steps(
+            target_table_ident, base_cte_part, final_params, all_selected_methods, group_by_key, tmp_base_name,
+            merge_strategy=merge_strategy, index_columns=db_profile.get_cohort_index_columns()
+        )
+        return steps, "execution_list", batch_desc, all_column_details
+
+    sampled_name = psql.Identifier("SampledCohort")
+    sampled_cte = _build_sampled_cohort_cte(sampled_name, target_table_ident, preview_limit, group_by_key.string, preview_sampling)
+    preview_sql = _build_preview_query(
+        sampled_cte, sampled_name, build_filtered_events_cte(sampled_name), main_query,
+        all_selected_methods, group_by_key, cohort_alias
+    )
+    return preview_sql, None, final_params, all_column_details
+
+
+def build_preprocessed_source_cte(
+    source_table_ident: psql.Identifier,
+    join_key_ident: psql.Identifier,
+    selected_columns: List[str],
+    cohort_relation: psql.Composable
+) -> psql.Composable:
+    """
+    预处理表合并的 SourceCTE：每个连接键按时间取首条记录。
+    先以队列键半连接限制源表，只投影连接键与选中的列，DISTINCT ON 只需对队列涉及的行排序；
+    源表存在 (连接键, charttime) 索引时可按索引顺序逐键读取，无需排序。
+    """
+    src = psql.Identifier("src")
+    projected = [psql.SQL("{}.{}").format(src, join_key_ident)] + [
+        psql.SQL("{}.{}").format(src, psql.Identifier(c)) for c in selected_columns if c != join_key_ident.string
+    ]
+    return psql.SQL("""
+    SourceCTE AS (
+        SELECT DISTINCT ON ({src}.{key}) {cols}
+        FROM {source_table} {src}
+        WHERE {src}.{key} IN (SELECT {key} FROM {cohort})
+        ORDER BY {src}.{key}, {src}.{order_col} ASC NULLS LAST, {src}.hadm_id
+    )
+    """).format(
+        src=src, key=join_key_ident, cols=psql.SQL(", ").join(projected), source_table=source_table_ident,
+        cohort=cohort_relation, order_col=psql.Identifier(PREPROCESSED_ORDER_COLUMN)
+    )
+
+
+def describe_preprocessed_merge_plan(source_table_name: str, join_key: str, ordering_index: Optional[str]) -> str:
+    """根据源表是否有 (连接键, charttime) 索引，描述预处理表合并的预期执行计划。"""
+    if ordering_index:
+        return (f"预期计划: 队列键半连接后经索引 {ordering_index} 按 ({join_key}, {PREPROCESSED_ORDER_COLUMN}) "
+                f"顺序读取，DISTINCT ON 无需排序")
+    return (f"预期计划: 队列键半连接后对匹配行排序再 DISTINCT ON；{source_table_name} 缺少 "
+            f"({join_key}, {PREPROCESSED_ORDER_COLUMN}) 索引，建议建立以避免排序")
 
 
 def build_merge_preprocessed_sql(
@@ -506,10 +1598,11 @@ def build_merge_preprocessed_sql(
     db_profile: BaseDbProfile,
     active_db_params: Optional[Dict] = None,
     for_execution: bool = False,
-    preview_limit: int = 100
+    preview_limit: int = 100,
+    preview_sampling: Optional[Dict[str, Any]] = None
 ) -> Tuple[Optional[Any], Optional[str], Optional[List[Any]], List[Tuple[str, str]]]:
     """
-    处理预处理表合并的辅助函数 (保持不变)
+    处理预处理表合并的辅助函数
     """
     source_table_full_name = panel_specific_config.get("source_event_table")
     selected_columns = panel_specific_config.get("selected_columns", [])
@@ -527,14 +1620,6 @@ def build_merge_preprocessed_sql(
     source_table_ident = psql.Identifier(source_schema, source_table_only)
     target_table_ident = psql.Identifier(target_schema, target_table_only)
     join_key_ident = psql.Identifier(join_key)
-    
-    source_cte = psql.SQL("""
-    SourceCTE AS (
-        SELECT DISTINCT ON ({key}) *
-        FROM {source_table}
-        ORDER BY {key}, charttime ASC NULLS LAST, hadm_id
-    )
-    """).format(key=join_key_ident, source_table=source_table_ident)
 
     if for_execution:
         alter_clauses = []
@@ -544,23 +1629,23 @@ def build_merge_preprocessed_sql(
         conn = psycopg2.connect(**active_db_params)
         try:
             with conn.cursor() as cur:
-                for col_name in selected_columns:
-                    cur.execute("""
-                        SELECT data_type FROM information_schema.columns
-                        WHERE table_schema = %s AND table_name = %s AND column_name = %s
-                    """, (source_schema, source_table_only, col_name))
-                    result = cur.fetchone()
-                    if result:
-                        col_type = result[0]
-                        alter_clauses.append(psql.SQL("ADD COLUMN IF NOT EXISTS {} {}").format(psql.Identifier(col_name), psql.SQL(col_type)))
-                        col_details_for_preview.append((col_name, col_type))
+                source_column_types = get_table_column_types(cur, source_schema, source_table_only)
+                ordering_index = find_index_by_leading_columns(
+                    cur, source_schema, source_table_only, [join_key, PREPROCESSED_ORDER_COLUMN]
+                )
         finally:
             conn.close()
+        for col_name in selected_columns:
+            col_type = source_column_types.get(col_name)
+            if col_type:
+                alter_clauses.append(psql.SQL("ADD COLUMN IF NOT EXISTS {} {}").format(psql.Identifier(col_name), psql.SQL(col_type)))
+                col_details_for_preview.append((col_name, col_type))
 
         if not alter_clauses:
             return None, "未能确定要添加的列。", [], []
 
         alter_sql = psql.SQL("ALTER TABLE {target_table} ").format(target_table=target_table_ident) + psql.SQL(', ').join(alter_clauses) + psql.SQL(";")
+        source_cte = build_preprocessed_source_cte(source_table_ident, join_key_ident, selected_columns, target_table_ident)
 
         update_sql = psql.SQL(
             "WITH {cte} UPDATE {target} t SET {sets} FROM SourceCTE s WHERE t.{key} = s.{key};"
@@ -571,12 +1656,16 @@ def build_merge_preprocessed_sql(
             key=join_key_ident
         )
         
-        return [(alter_sql, None), (update_sql, None)], "execution_list", f"来自 {source_table_only} 表的数据", col_details_for_preview
+        steps = [(alter_sql, None), (update_sql, None), build_refresh_wide_view_step(target_table_ident, join_key_ident)]
+        plan_note = describe_preprocessed_merge_plan(source_table_only, join_key, ordering_index)
+        return steps, "execution_list", f"来自 {source_table_only} 表的数据；{plan_note}", col_details_for_preview
 
     else:
-        sampled_cohort_cte = psql.SQL(
-            "SampledCohort AS (SELECT * FROM {target} ORDER BY RANDOM() LIMIT {limit})"
-        ).format(target=target_table_ident, limit=psql.Literal(preview_limit))
+        sampled_cohort_cte = _build_sampled_cohort_cte(
+            psql.SQL("SampledCohort"), target_table_ident, preview_limit, join_key, preview_sampling
+        )
+        # 只为样本中的键取首条记录
+        source_cte = build_preprocessed_source_cte(source_table_ident, join_key_ident, selected_columns, psql.SQL("SampledCohort"))
         
         select_cols = [psql.SQL("c.*")] + [psql.SQL("s.{}").format(psql.Identifier(c)) for c in selected_columns]
 
@@ -590,4 +1679,203 @@ def build_merge_preprocessed_sql(
             cols=psql.SQL(', ').join(select_cols),
             key=join_key_ident
         )
-        return preview_sql, None, None, []
\ No newline at end of file
+        return preview_sql, None, None, []
+
+
+def build_binned_feature_sql(
+    target_cohort_table_name: str,
+    base_new_column_name: str,
+    panel_specific_config: Dict[str, Any],
+    db_profile: BaseDbProfile,
+    for_execution: bool = False,
+    preview_limit: int = 100,
+    preview_sampling: Optional[Dict[str, Any]] = None,
+    cohort_key_pushdown: Optional[bool] = None
+) -> Tuple[Optional[Any], Optional[str], Optional[List[Any]], List[Tuple[str, str]]]:
+    """
+    分箱时间序列提取：按 time_window_spec (见 validate_time_window_spec) 将窗口内事件划分为宽度 bin_hours 的时间箱，
+    一次 GROUP BY (连接键, 时间箱) 计算所有已选聚合，结果以长表格式写入 {队列表}__binned：
+        (连接键, feature_name, bin_index, bin_start_hours, bin_end_hours, stat, value)
+    feature_name 为新列基础名，bin_index 从窗口起点开始计数，起止小时数相对锚点。
+    重复执行同一 feature_name 时先删除旧结果；空值不写入。只输出数值结果，文本/JSON 聚合与正则提取被忽略。
+    """
+    source_event_table = panel_specific_config.get("source_event_table")
+    value_column_name = panel_specific_config.get("value_column_to_extract")
+    time_col_name = panel_specific_config.get("time_column_in_event_table")
+    time_col_is_date = panel_specific_config.get("time_column_is_date_only", False)
+    window_spec = panel_specific_config.get("time_window_spec") or {}
+
+    if not source_event_table:
+        return None, "配置不完整 (缺少源表)", [], []
+    if not time_col_name:
+        return None, "分箱时间序列输出需要事件时间列", [], []
+    if panel_specific_config.get("is_text_extraction"):
+        return None, "分箱时间序列输出只支持数值型提取", [], []
+    spec_error = validate_time_window_spec(window_spec)
+    if spec_error:
+        return None, spec_error, [], []
+
+    table_parts = _split_table_name(target_cohort_table_name)
+    if not table_parts:
+        return None, "目标表名格式错误 (Schema.Table)", [], []
+
+    target_table_ident = psql.Identifier(*table_parts)
+    binned_table_ident = psql.Identifier(table_parts[0], get_binned_table_name(table_parts[1]))
+    cohort_alias = psql.Identifier("cohort")
+    event_alias = psql.Identifier("evt")
+    strategy = get_sql_strategy(db_profile, event_alias, cohort_alias)
+
+    all_where_conditions, params_for_cte = _collect_where_conditions(panel_specific_config, strategy, event_alias, db_profile)
+
+    selected_methods, _, col_error = _collect_output_columns(base_new_column_name, panel_specific_config, db_profile.get_event_time_array_type())
+    if col_error:
+        return None, col_error, [], []
+    numeric_methods = [m for m in selected_methods
+                       if m[3].string not in BINNED_EXCLUDED_RESULT_TYPES and not m[3].string.endswith("[]") and not isinstance(m[2], tuple)]
+    if not numeric_methods:
+        return None, "分箱时间序列输出至少需要一个数值型聚合方法", [], []
+
+    group_by_key = psql.Identifier(db_profile.get_cohort_join_key(source_event_table))
+    raw_val_expr = psql.Identifier('event_value')
+    time_expr = psql.Identifier('event_time')
+    bin_ident = psql.Identifier('event_bin')
+    shadow_def = _resolve_shared_numeric_shadow([panel_specific_config], db_profile)
+    val_expr = _get_aggregate_value_expression(db_profile, panel_specific_config, raw_val_expr, shadow_def)
+    event_value_column = _get_event_value_column(panel_specific_config, shadow_def)
+
+    start_hours = psql.Literal(float(window_spec["start_hours"]))
+    end_hours = psql.Literal(float(window_spec["end_hours"]))
+    bin_hours = psql.Literal(float(window_spec["bin_hours"]))
+    hours_expr = strategy.get_hours_since_anchor_expression(time_col_name, window_spec, time_col_is_date)
+
+    select_defs = [
+        psql.SQL("{}.{}").format(cohort_alias, group_by_key),
+        psql.SQL("{}.{} AS {}").format(event_alias, psql.Identifier(event_value_column), raw_val_expr) if value_column_name else psql.SQL("NULL AS {}").format(raw_val_expr),
+        psql.SQL("{}.{} AS {}").format(event_alias, psql.Identifier(time_col_name), time_expr),
+        psql.SQL("CAST(FLOOR(({hours} - {start}) / {width}) AS INTEGER) AS {bin}").format(
+            hours=hours_expr, start=start_hours, width=bin_hours, bin=bin_ident
+        ),
+    ]
+
+    agg_select_list, outer_select_list, agg_params = _build_aggregate_select_list(
+        numeric_methods, val_expr=val_expr, raw_val_expr=raw_val_expr, time_expr=time_expr
+    )
+    binned_cte = psql.SQL(
+        "Binned AS (SELECT {key}, {bin}, {outer} FROM (SELECT {key}, {bin}, {aggs} FROM FilteredEvents GROUP BY {key}, {bin}) agg)"
+    ).format(key=group_by_key, bin=bin_ident, outer=psql.SQL(', ').join(outer_select_list), aggs=psql.SQL(', ').join(agg_select_list))
+
+    binned_alias = psql.Identifier("b")
+    stat_values = []
+    for _, col_ident, _, col_type, method_key in numeric_methods:
+        col_ref = psql.SQL("{}.{}").format(binned_alias, col_ident)
+        if col_type.string == "BOOLEAN":
+            col_ref = psql.SQL("CAST({} AS INTEGER)").format(col_ref)
+        stat_values.append(psql.SQL("({}, CAST({} AS DOUBLE PRECISION))").format(psql.Literal(method_key.lower()), col_ref))
+    long_select = psql.SQL(
+        "SELECT {b}.{key}, CAST({feature} AS TEXT) AS feature_name, {b}.{bin} AS bin_index, "
+        "CAST({start} + {b}.{bin} * {width} AS DOUBLE PRECISION) AS bin_start_hours, "
+        "CAST(LEAST({start} + ({b}.{bin} + 1) * {width}, {end}) AS DOUBLE PRECISION) AS bin_end_hours, "
+        "s.stat, s.value FROM Binned {b} CROSS JOIN LATERAL (VALUES {values}) AS s(stat, value) WHERE s.value IS NOT NULL"
+    ).format(
+        b=binned_alias, key=group_by_key, feature=psql.Literal(base_new_column_name), bin=bin_ident,
+        start=start_hours, width=bin_hours, end=end_hours, values=psql.SQL(', ').join(stat_values)
+    )
+
+    if cohort_key_pushdown is None:
+        cohort_key_pushdown = db_profile.use_cohort_key_pushdown()
+
+    def build_long_query(cohort_source: psql.Composable, leading_ctes: Optional[psql.Composable] = None) -> psql.Composable:
+        conditions = list(all_where_conditions)
+        pushdown_condition = _build_cohort_key_pushdown_condition(panel_specific_config, db_profile, event_alias, cohort_source) if cohort_key_pushdown else None
+        if pushdown_condition is not None:
+            conditions.insert(0, pushdown_condition)
+        filtered_cte = psql.SQL("FilteredEvents AS (SELECT {selects} {joins} WHERE {conds})").format(
+            selects=psql.SQL(', ').join(select_defs),
+            joins=_build_cohort_join_clause(panel_specific_config, db_profile, event_alias, cohort_source, cohort_alias, shadow_def),
+            conds=psql.SQL(' AND ').join(conditions) if conditions else psql.SQL("TRUE")
+        )
+        ctes = [leading_ctes, filtered_cte, binned_cte] if leading_ctes is not None else [filtered_cte, binned_cte]
+        return psql.SQL("WITH {ctes} {select}").format(ctes=psql.SQL(', ').join(ctes), select=long_select)
+
+    final_params = params_for_cte + agg_params
+    column_details = [(m[0], "Double (分箱长表)") for m in numeric_methods]
+
+    if for_execution:
+        long_columns = psql.SQL(', ').join([group_by_key] + [psql.Identifier(c) for c in (
+            "feature_name", "bin_index", "bin_start_hours", "bin_end_hours", "stat", "value")])
+        tmp_ident = psql.Identifier(f"temp_binned_{base_new_column_name}_{int(time.time())%1000}"[:60])
+        steps = [
+            (psql.SQL("CREATE TEMPORARY TABLE {tmp} AS {query}").format(tmp=tmp_ident, query=build_long_query(target_table_ident)), final_params),
+            (psql.SQL(
+                "CREATE TABLE IF NOT EXISTS {tbl} AS SELECT {cols} FROM {tmp} WITH NO DATA; "
+                "CREATE INDEX IF NOT EXISTS {idx} ON {tbl} (feature_name, {key}, bin_index)"
+            ).format(
+                tbl=binned_table_ident, cols=long_columns, tmp=tmp_ident, key=group_by_key,
+                idx=psql.Identifier(f"{table_parts[1]}{BINNED_TABLE_SUFFIX}_idx"[:63])
+            ), None),
+            (psql.SQL("DELETE FROM {} WHERE feature_name = {}").format(binned_table_ident, psql.Literal(base_new_column_name)), None),
+            (psql.SQL("INSERT INTO {tbl} ({cols}) SELECT {cols} FROM {tmp}").format(tbl=binned_table_ident, cols=long_columns, tmp=tmp_ident), None),
+            (psql.SQL("ANALYZE {}").format(binned_table_ident), None),
+            (psql.SQL("DROP TABLE IF EXISTS {}").format(tmp_ident), None),
+        ]
+        return steps, "execution_list", base_new_column_name, column_details
+
+    sampled_name = psql.Identifier("SampledCohort")
+    sampled_cte = _build_sampled_cohort_cte(sampled_name, target_table_ident, preview_limit, group_by_key.string, preview_sampling)
+    preview_sql = psql.SQL("{query} ORDER BY 1, bin_index, stat LIMIT {limit}").format(
+        query=build_long_query(sampled_name, sampled_cte), limit=psql.Literal(int(preview_limit))
+    )
+    return preview_sql, None, final_params, column_details
+
+
+# ==========================================
+# 6. 执行代价估计 (供界面与批量任务排序使用)
+# ==========================================
+
+def estimate_special_data_cost(
+    cur,
+    target_cohort_table_name: str,
+    base_new_column_name: str,
+    panel_specific_config: Dict[str, Any],
+    db_profile: BaseDbProfile
+) -> Optional[Dict[str, Any]]:
+    """
+    以普通执行方式 (单连接、完整计算) 构建步骤，并对其中的 CREATE TEMP 查询执行 EXPLAIN。
+    返回值见 cost_estimator.explain_query_cost；无法构建时返回 None。
+    预处理表合并没有临时计算步骤，改为对其 SourceCTE (队列键半连接 + DISTINCT ON) 执行 EXPLAIN。
+    """
+    if panel_specific_config.get("panel_type") == "merge_preprocessed":
+        source_table = panel_specific_config.get("source_event_table") or ""
+        join_key = panel_specific_config.get("join_key")
+        if "." not in source_table or not join_key or not panel_specific_config.get("selected_columns"):
+            return None
+        source_cte = build_preprocessed_source_cte(
+            psql.Identifier(*source_table.split(".", 1)), psql.Identifier(join_key),
+            panel_specific_config["selected_columns"], psql.Identifier(*target_cohort_table_name.split(".", 1))
+        )
+        return explain_query_cost(cur, psql.SQL("WITH {} SELECT * FROM SourceCTE").format(source_cte))
+    steps, signal_type, _, _ = build_special_data_sql_memoized(
+        target_cohort_table_name, base_new_column_name, panel_specific_config, db_profile, for_execution=True
+    )
+    if signal_type != "execution_list":
+        return None
+    return estimate_execution_steps_cost(cur, steps)
+
+
+def order_batch_groups_by_cost(
+    cur,
+    target_cohort_table_name: str,
+    feature_config_groups: List[List[Tuple[str, Dict[str, Any]]]],
+    db_profile: BaseDbProfile
+) -> List[Tuple[Optional[Dict[str, Any]], List[Tuple[str, Dict[str, Any]]]]]:
+    """
+    估计每组批量透视任务的代价，并按代价从低到高排序 (无法估计的组排在最后)。
+    返回 [(estimate, feature_configs), ...]。
+    """
+    estimated = []
+    for feature_configs in feature_config_groups:
+        steps, signal_type, _, _ = build_batch_pivot_sql(target_cohort_table_name, feature_configs, db_profile, for_execution=True)
+        estimate = estimate_execution_steps_cost(cur, steps) if signal_type == "execution_list" else None
+        estimated.append((estimate, feature_configs))
+    estimated.sort(key=lambda item: (item[0] is None, item[0]["total_cost"] if item[0] else 0.0))
+    return estimated
@@ -0,0 +1,120 @@
+# --- START OF FILE sql_logic/sql_renderer.py ---
+"""
+离线 SQL 渲染 (不需要数据库连接)。
+
+psycopg2 的 Composable.as_string() 与 cursor.mogrify() 都需要一个连接对象，
+此前为了渲染标识符而建立的临时连接在没有本地数据库时会一直等到 TCP 连接超时。
+这里用纯 Python 实现同样的引号规则，仅用于界面上的 SQL 预览与日志显示；
+真正执行的 SQL 仍然交给 psycopg2 处理参数。
+
+假定服务器开启 standard_conforming_strings (PostgreSQL 9.1 起的默认值)：
+普通字符串中的反斜杠不是转义字符，只需把单引号写成两个。
+"""
+import datetime
+import decimal
+import math
+import re
+import uuid
+from typing import Any, Mapping, Optional, Sequence, Union
+
+import psycopg2.sql as psql
+
+_PLACEHOLDER_RE = re.compile(r"%(?:\((?P<name>[^)]*)\))?(?P<conv>[s%])")
+_SENTINEL = object()
+
+
+def quote_identifier(*strings: str) -> str:
+    """按 PostgreSQL 规则为 (可带 schema 的) 标识符加双引号。"""
+    return ".".join('"' + s.replace('"', '""') + '"' for s in strings)
+
+
+def quote_literal(value: Any) -> str:
+    """把 Python 值转换为 SQL 字面量，规则与 psycopg2 的默认适配保持一致。"""
+    if value is None:
+        return "NULL"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, float):
+        if math.isnan(value):
+            return "'NaN'::float"
+        if math.isinf(value):
+            return "'Infinity'::float" if value > 0 else "'-Infinity'::float"
+        return repr(value)
+    if isinstance(value, decimal.Decimal):
+        return "'NaN'::numeric" if value.is_nan() else str(value)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return "'\\x" + bytes(value).hex() + "'::bytea"
+    if isinstance(value, datetime.datetime):
+        return f"'{value.isoformat()}'::{'timestamptz' if value.tzinfo else 'timestamp'}"
+    if isinstance(value, datetime.date):
+        return f"'{value.isoformat()}'::date"
+    if isinstance(value, datetime.time):
+        return f"'{value.isoformat()}'::time"
+    if isinstance(value, datetime.timedelta):
+        return f"'{value.days} days {value.seconds}.{value.microseconds:06d} seconds'::interval"
+    if isinstance(value, list):
+        if not value:
+            return "'{}'"
+        return "ARRAY[" + ",".join(quote_literal(v) for v in value) + "]"
+    if isinstance(value, tuple):
+        # psycopg2 把元组适配为 IN (...) 使用的括号列表
+        return "(" + ", ".join(quote_literal(v) for v in value) + ")"
+    if isinstance(value, uuid.UUID):
+        return f"'{value}'::uuid"
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def render_composable(sql_obj: Union[psql.Composable, str]) -> str:
+    """离线等价于 sql_obj.as_string(conn)：占位符 (%s 与 %%) 原样保留。"""
+    if isinstance(sql_obj, str):
+        return sql_obj
+    if isinstance(sql_obj, psql.Composed):
+        return "".join(render_composable(part) for part in sql_obj.seq)
+    if isinstance(sql_obj, psql.SQL):
+        return sql_obj.string
+    if isinstance(sql_obj, psql.Identifier):
+        return quote_identifier(*sql_obj.strings)
+    if isinstance(sql_obj, psql.Literal):
+        return quote_literal(sql_obj.wrapped)
+    if isinstance(sql_obj, psql.Placeholder):
+        return f"%({sql_obj.name})s" if sql_obj.name else "%s"
+    raise TypeError(f"无法渲染的 SQL 对象类型: {type(sql_obj).__name__}")
+
+
+def render_sql(
+    sql_obj: Union[psql.Composable, str],
+    params: Optional[Union[Sequence[Any], Mapping[str, Any]]] = None
+) -> str:
+    """
+    离线等价于 cursor.mogrify(sql_obj, params)，返回可读的 SQL 文本。
+    params 为空时与 psycopg2 一样不处理 % 占位符；参数数量不匹配时抛出 ValueError。
+    """
+    template = render_composable(sql_obj)
+    if params is None:
+        return template
+
+    is_mapping = isinstance(params, Mapping)
+    positional = iter(params if not is_mapping else ())
+
+    def _substitute(match: re.Match) -> str:
+        if match.group("conv") == "%":
+            return "%"
+        name = match.group("name")
+        if name is not None:
+            if not is_mapping:
+                raise ValueError("命名占位符需要以字典形式提供参数")
+            return quote_literal(params[name])
+        if is_mapping:
+            raise ValueError("位置占位符需要以序列形式提供参数")
+        try:
+            return quote_literal(next(positional))
+        except StopIteration:
+            raise ValueError("SQL 中的占位符多于提供的参数") from None
+
+    rendered = _PLACEHOLDER_RE.sub(_substitute, template)
+    if not is_mapping and next(positional, _SENTINEL) is not _SENTINEL:
+        raise ValueError("提供的参数多于 SQL 中的占位符")
+    return rendered
+
@@ -0,0 +1,289 @@
+# --- START OF FILE tabs/tab_cohort_compose.py ---
+from PySide6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QPushButton,
+                          QListWidget, QListWidgetItem, QMessageBox, QLabel,
+                          QLineEdit, QTextEdit, QGroupBox, QProgressBar)
+from PySide6.QtCore import Qt, Signal, QThread, QObject, Slot
+import psycopg2
+import psycopg2.sql as psql
+import re
+import time
+from typing import Optional, Dict, List
+
+from db_profiles.base_profile import BaseDbProfile
+from sql_logic.cohort_algebra import build_cohort_composition_steps, get_common_columns, parse_cohort_expression, get_expression_aliases
+from sql_logic.narrow_store import is_narrow_store_relation
+from sql_logic.sql_renderer import render_sql
+
+ALIAS_LETTERS = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+
+class CohortCompositionWorker(QObject):
+    finished = Signal(str, int)
+    error = Signal(str)
+    progress = Signal(int, int)
+    log = Signal(str)
+
+    def __init__(self, db_params, cohort_schema, target_table_name, operand_tables: Dict[str, str],
+                 expression, key_column, index_columns: List[str]):
+        super().__init__()
+        self.db_params = db_params; self.cohort_schema = cohort_schema; self.target_table_name = target_table_name
+        self.operand_tables = operand_tables; self.expression = expression
+        self.key_column = key_column; self.index_columns = index_columns
+        self.is_cancelled = False; self.conn = None
+
+    @Slot()
+    def cancel(self):
+        self.log.emit("队列组合操作被请求取消..."); self.is_cancelled = True
+        if self.conn:
+            try: self.conn.cancel()
+            except Exception as e: self.log.emit(f"发送取消请求时出错: {e}")
+
+    def run(self):
+        target_table_ident = psql.Identifier(self.cohort_schema, self.target_table_name)
+        try:
+            self.conn = psycopg2.connect(**self.db_params); self.conn.autocommit = False
+            cur = self.conn.cursor()
+            used_aliases = get_expression_aliases(parse_cohort_expression(self.expression, list(self.operand_tables.keys())))
+            common_columns = get_common_columns(cur, self.cohort_schema, [self.operand_tables[a] for a in used_aliases])
+            steps, _ = build_cohort_composition_steps(target_table_ident, self.operand_tables, self.expression,
+                                                      self.key_column, common_columns, self.index_columns)
+            self.log.emit(f"结果表列 (各队列表共有): {', '.join(name for name, _ in common_columns)}")
+            self.progress.emit(0, len(steps))
+            for i, (stmt, params) in enumerate(steps):
+                if self.is_cancelled: raise InterruptedError("操作已取消")
+                self.log.emit(f"--- [执行SQL {i + 1}/{len(steps)}] ---\n{render_sql(stmt, params)}")
+                start_time = time.time()
+                cur.execute(stmt, params)
+                self.log.emit(f"语句执行成功 (耗时: {time.time() - start_time:.2f} 秒)")
+                self.progress.emit(i + 1, len(steps))
+            # 建表、写入、索引与统计信息在同一事务中提交，失败时不留下半成品表
+            self.conn.commit()
+            cur.execute(psql.SQL("SELECT COUNT(*) FROM {}").format(target_table_ident))
+            count = cur.fetchone()[0]
+            self.log.emit(f"队列组合完成: {self.cohort_schema}.{self.target_table_name} ({count} 行)。")
+            self.finished.emit(self.target_table_name, count)
+        except Exception as e:
+            if self.conn and not self.conn.closed:
+                try: self.conn.rollback()
+                except Exception as rb_err: self.log.emit(f"尝试回滚失败: {rb_err}")
+            if self.is_cancelled: self.error.emit("操作已取消")
+            else: self.error.emit(f"队列组合失败: {e}")
+        finally:
+            if self.conn: self.conn.close()
+
+
+class CohortCompositionTab(QWidget):
+    """在服务器端对已保存的队列表做并 / 交 / 差运算，结果物化为新的队列表。"""
+
+    def __init__(self, get_db_params_func, get_db_profile_func, parent=None):
+        super().__init__(parent)
+        self.get_db_params = get_db_params_func
+        self.get_db_profile = get_db_profile_func
+        self.db_profile: Optional[BaseDbProfile] = None
+        self.worker = None
+        self.worker_thread = None
+        self.init_ui()
+
+    def init_ui(self):
+        main_layout = QVBoxLayout(self)
+
+        instruction_label = QLabel("勾选参与运算的队列表 (按列表顺序依次记为 A、B、C ...)，输入集合表达式与结果名称后点击“组合队列”。\n"
+                                   "运算符: | 并、& 交、- 差，可使用括号，例如 (A | B) - C。运算按画像的队列键进行，结果保留各队列表共有的列。")
+        instruction_label.setWordWrap(True)
+        main_layout.addWidget(instruction_label)
+
+        tables_group = QGroupBox("参与运算的队列表")
+        tables_layout = QVBoxLayout(tables_group)
+        self.table_list = QListWidget()
+        self.table_list.itemChanged.connect(self.update_aliases)
+        tables_layout.addWidget(self.table_list)
+        refresh_layout = QHBoxLayout()
+        self.key_label = QLabel("队列键: -")
+        refresh_layout.addWidget(self.key_label)
+        refresh_layout.addStretch()
+        self.refresh_btn = QPushButton("刷新表列表")
+        self.refresh_btn.clicked.connect(self.refresh_tables)
+        self.refresh_btn.setEnabled(False)
+        refresh_layout.addWidget(self.refresh_btn)
+        tables_layout.addLayout(refresh_layout)
+        main_layout.addWidget(tables_group)
+
+        expr_layout = QHBoxLayout()
+        expr_layout.addWidget(QLabel("集合表达式:"))
+        self.expression_input = QLineEdit()
+        self.expression_input.setPlaceholderText("例如: A - B")
+        self.expression_input.textChanged.connect(self.update_button_states)
+        expr_layout.addWidget(self.expression_input)
+        expr_layout.addWidget(QLabel("结果名称:"))
+        self.result_name_input = QLineEdit()
+        self.result_name_input.setPlaceholderText("例如: sepsis_without_cancer")
+        self.result_name_input.textChanged.connect(self.update_button_states)
+        expr_layout.addWidget(self.result_name_input)
+        main_layout.addLayout(expr_layout)
+
+        btn_layout = QHBoxLayout()
+        btn_layout.addStretch()
+        self.preview_btn = QPushButton("预览SQL")
+        self.preview_btn.clicked.connect(self.preview_sql_action)
+        btn_layout.addWidget(self.preview_btn)
+        self.compose_btn = QPushButton("组合队列")
+        self.compose_btn.setStyleSheet("font-weight: bold; color: green;")
+        self.compose_btn.clicked.connect(self.compose_action)
+        btn_layout.addWidget(self.compose_btn)
+        self.cancel_btn = QPushButton("取消操作")
+        self.cancel_btn.clicked.connect(self.cancel_action)
+        btn_layout.addWidget(self.cancel_btn)
+        main_layout.addLayout(btn_layout)
+
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setVisible(False)
+        main_layout.addWidget(self.progress_bar)
+        self.log_display = QTextEdit()
+        self.log_display.setReadOnly(True)
+        self.log_display.setPlaceholderText("执行的SQL与日志将显示在这里...")
+        main_layout.addWidget(self.log_display, 1)
+        self.update_button_states()
+
+    @Slot()
+    def on_profile_changed(self):
+        self.db_profile = self.get_db_profile()
+        key_column = self.db_profile.get_cohort_primary_key() if self.db_profile else None
+        self.key_label.setText(f"队列键: {key_column or '-'}")
+        self.refresh_tables()
+
+    @Slot()
+    def on_db_connected(self):
+        self.refresh_btn.setEnabled(True)
+        self.refresh_tables()
+
+    def refresh_tables(self):
+        checked = set(self.get_operand_tables().values())
+        self.table_list.blockSignals(True)
+        self.table_list.clear()
+        db_params = self.get_db_params()
+        if self.db_profile and db_params:
+            conn = None
+            try:
+                conn = psycopg2.connect(**db_params)
+                cur = conn.cursor()
+                cur.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = %s AND table_type = 'BASE TABLE' ORDER BY table_name",
+                            (self.db_profile.get_cohort_table_schema(),))
+                for (table_name,) in cur.fetchall():
+                    if is_narrow_store_relation(table_name): continue
+                    item = QListWidgetItem(table_name)
+                    item.setData(Qt.ItemDataRole.UserRole, table_name)
+                    item.setFlags(item.flags() | Qt.ItemFlag.ItemIsUserCheckable)
+                    item.setCheckState(Qt.CheckState.Checked if table_name in checked else Qt.CheckState.Unchecked)
+                    self.table_list.addItem(item)
+            except Exception as e:
+                self.log_display.append(f"获取队列表列表失败: {e}")
+            finally:
+                if conn: conn.close()
+        self.table_list.blockSignals(False)
+        self.update_aliases()
+
+    def get_operand_tables(self) -> Dict[str, str]:
+        """返回 {别名: 队列表名}，别名按勾选项在列表中的顺序分配。"""
+        tables = [self.table_list.item(i).data(Qt.ItemDataRole.UserRole) for i in range(self.table_list.count())
+                  if self.table_list.item(i).checkState() == Qt.CheckState.Checked]
+        return dict(zip(ALIAS_LETTERS, tables))
+
+    @Slot()
+    def update_aliases(self):
+        alias_by_table = {table: alias for alias, table in self.get_operand_tables().items()}
+        self.table_list.blockSignals(True)
+        for i in range(self.table_list.count()):
+            item = self.table_list.item(i); table_name = item.data(Qt.ItemDataRole.UserRole)
+            item.setText(f"{alias_by_table[table_name]} = {table_name}" if table_name in alias_by_table else table_name)
+        self.table_list.blockSignals(False)
+        self.update_button_states()
+
+    @Slot()
+    def update_button_states(self):
+        is_busy = bool(self.worker_thread and self.worker_thread.isRunning())
+        ready = bool(self.get_db_params() and self.db_profile and self.get_operand_tables()
+                     and self.expression_input.text().strip() and self.result_name_input.text().strip())
+        self.preview_btn.setEnabled(ready and not is_busy)
+        self.compose_btn.setEnabled(ready and not is_busy)
+        self.cancel_btn.setEnabled(is_busy)
+        for w in [self.table_list, self.expression_input, self.result_name_input, self.refresh_btn]: w.setEnabled(not is_busy)
+        self.progress_bar.setVisible(is_busy)
+
+    def get_result_table_name(self) -> Optional[str]:
+        cleaned_name = re.sub(r'[^a-z0-9_]+', '_', self.result_name_input.text().lower()).strip('_')
+        if not cleaned_name: return None
+        return cleaned_name if cleaned_name.endswith("_cohort") else f"{cleaned_name}_cohort"
+
+    def _validate_inputs(self):
+        """检查输入并返回 (结果表名, 队列键)；输入无效时弹出提示并返回 None。"""
+        target_table_name = self.get_result_table_name()
+        if not target_table_name: QMessageBox.warning(self, "名称无效", "请输入有效的结果名称。"); return None
+        if len(target_table_name) > 63: QMessageBox.warning(self, "名称过长", f"生成的表名 '{target_table_name}' 超过63字符。"); return None
+        key_column = self.db_profile.get_cohort_primary_key()
+        if not key_column: QMessageBox.warning(self, "不支持", "当前数据库画像未定义队列键，无法进行集合运算。"); return None
+        try:
+            parse_cohort_expression(self.expression_input.text(), list(self.get_operand_tables().keys()))
+        except ValueError as e:
+            QMessageBox.warning(self, "表达式无效", str(e)); return None
+        return target_table_name, key_column
+
+    def preview_sql_action(self):
+        validated = self._validate_inputs()
+        if not validated: return
+        target_table_name, key_column = validated
+        cohort_schema = self.db_profile.get_cohort_table_schema(); operand_tables = self.get_operand_tables()
+        try:
+            with psycopg2.connect(**self.get_db_params()) as conn, conn.cursor() as cur:
+                used_aliases = get_expression_aliases(parse_cohort_expression(self.expression_input.text(), list(operand_tables.keys())))
+                common_columns = get_common_columns(cur, cohort_schema, [operand_tables[a] for a in used_aliases])
+                steps, _ = build_cohort_composition_steps(psql.Identifier(cohort_schema, target_table_name), operand_tables, self.expression_input.text(),
+                                                          key_column, common_columns, self.db_profile.get_cohort_index_columns())
+            self.log_display.setText("\n\n".join(f"{render_sql(stmt, params)};" for stmt, params in steps))
+        except Exception as e:
+            QMessageBox.critical(self, "预览失败", f"生成SQL时出错: {e}")
+
+    def compose_action(self):
+        if self.worker_thread and self.worker_thread.isRunning(): QMessageBox.warning(self, "任务进行中", "一个队列组合任务正在运行。"); return
+        validated = self._validate_inputs()
+        if not validated: return
+        target_table_name, key_column = validated
+        if QMessageBox.question(self, '确认创建', f"将创建表:\n{target_table_name}\n(同名表将被替换) 确定吗?",
+                                QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No) == QMessageBox.StandardButton.No: return
+
+        self.log_display.clear()
+        self.progress_bar.setRange(0, 0)
+        self.worker = CohortCompositionWorker(self.get_db_params(), self.db_profile.get_cohort_table_schema(), target_table_name,
+                                              self.get_operand_tables(), self.expression_input.text(), key_column,
+                                              self.db_profile.get_cohort_index_columns())
+        self.worker_thread = QThread(); self.worker.moveToThread(self.worker_thread)
+        self.worker_thread.started.connect(self.worker.run)
+        self.worker.finished.connect(self.on_worker_finished)
+        self.worker.error.connect(self.on_worker_error)
+        self.worker.progress.connect(self.update_progress)
+        self.worker.log.connect(self.log_display.append)
+        self.worker.finished.connect(self.reset_worker_state); self.worker.error.connect(self.reset_worker_state)
+        self.worker_thread.finished.connect(self.worker.deleteLater); self.worker_thread.finished.connect(self.worker_thread.deleteLater)
+        self.worker_thread.start()
+        self.update_button_states()
+
+    @Slot(int, int)
+    def update_progress(self, value, max_val):
+        self.progress_bar.setRange(0, max_val); self.progress_bar.setValue(value)
+
+    def cancel_action(self):
+        if self.worker: self.worker.cancel()
+
+    @Slot(str, int)
+    def on_worker_finished(self, table_name, count):
+        QMessageBox.information(self, "组合完成", f"队列表 '{table_name}' 已创建，共 {count} 行。")
+        self.refresh_tables()
+
+    @Slot(str)
+    def on_worker_error(self, error_message):
+        QMessageBox.critical(self, "组合失败", error_message)
+
+    @Slot()
+    def reset_worker_state(self):
+        if self.worker_thread: self.worker_thread.quit(); self.worker_thread.wait()
+        self.worker = None; self.worker_thread = None
+        self.update_button_states()
@@ -10,6 +10,7 @@ import pandas as pd
 from typing import Optional, Dict, Callable
 
 from db_profiles.base_profile import BaseDbProfile
+from sql_logic.narrow_store import is_narrow_store_relation
 
 class SQLWorker(QObject):
     finished = Signal(list, list)
@@ -295,7 +296,7 @@ class BaseInfoDataExtractionTab(QWidget):
                 WHERE table_schema = %s
                 ORDER BY table_name
             """, (cohort_schema,))
-            tables = cur.fetchall()
+            tables = [t for t in cur.fetchall() if not is_narrow_store_relation(t[0])]
             if tables:
                 for table in tables: self.table_combo.addItem(f"{cohort_schema}.{table[0]}")
                 if self.table_combo.count() > 0:
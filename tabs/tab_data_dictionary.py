@@ -11,6 +11,7 @@ from typing import Optional
 
 from ui_components.conditiongroup import ConditionGroupWidget
 from db_profiles.base_profile import BaseDbProfile
+from sql_logic.sql_renderer import render_sql
 
 class DataDictionaryTab(QWidget):
     # ... (init is the same) ...
@@ -182,14 +183,8 @@ class DataDictionaryTab(QWidget):
         full_query_obj += psql.SQL(" ORDER BY {} LIMIT 500").format(order_by_col_ident)
 
         try:
-            db_params = self.get_db_params()
-            if db_params:
-                with psycopg2.connect(**db_params) as conn:
-                    with conn.cursor() as cur:
-                        readable_sql = cur.mogrify(full_query_obj, query_params).decode(conn.encoding or 'utf-8')
-                        self.sql_preview_textedit.setText(readable_sql)
-            else:
-                self.sql_preview_textedit.setText("-- 无法连接数据库生成完整预览 --\n" + str(full_query_obj))
+            # 离线渲染预览，不为预览单独建立数据库连接
+            self.sql_preview_textedit.setText(render_sql(full_query_obj, query_params))
         except Exception as e:
             self.sql_preview_textedit.setText(f"-- 生成SQL预览失败: {e} --")
 
@@ -11,6 +11,10 @@ import pandas as pd
 import traceback
 import numpy as np
 
+from sql_logic.sampling import SAMPLING_METHODS_DISPLAY, build_sample_query, get_relation_estimate
+from sql_logic.narrow_store import is_narrow_store_relation, resolve_read_relation
+from app_config import PREVIEW_SAMPLING_METHOD, PREVIEW_SAMPLING_SEED
+
 class DataExportTab(QWidget):
     def __init__(self, get_db_params_func, parent=None):
         super().__init__(parent)
@@ -104,6 +108,19 @@ class DataExportTab(QWidget):
         self.preview_spinbox.setRange(10, 1000)
         self.preview_spinbox.setValue(100)
         preview_options_layout.addWidget(self.preview_spinbox)
+        preview_options_layout.addWidget(QLabel("采样方式:"))
+        self.sampling_combo = QComboBox()
+        for display_name, method_key in SAMPLING_METHODS_DISPLAY:
+            self.sampling_combo.addItem(display_name, method_key)
+        default_index = self.sampling_combo.findData(PREVIEW_SAMPLING_METHOD)
+        if default_index != -1: self.sampling_combo.setCurrentIndex(default_index)
+        preview_options_layout.addWidget(self.sampling_combo)
+        preview_options_layout.addWidget(QLabel("种子:"))
+        self.sampling_seed_spinbox = QSpinBox()
+        self.sampling_seed_spinbox.setRange(0, 2147483647)
+        self.sampling_seed_spinbox.setValue(PREVIEW_SAMPLING_SEED)
+        self.sampling_seed_spinbox.setToolTip("相同的种子在数据不变时得到相同的预览样本 (完全随机方式除外)")
+        preview_options_layout.addWidget(self.sampling_seed_spinbox)
         preview_options_layout.addStretch()
         result_layout.addLayout(preview_options_layout)
         
@@ -185,7 +202,8 @@ class DataExportTab(QWidget):
         try:
             with conn.cursor() as cur:
                 cur.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = %s ORDER BY table_name", (selected_schema,))
-                table_names = [table[0] for table in cur.fetchall()]
+                # 窄表存储的特征表与宽视图不单独列出：选择队列表时自动读取其宽视图
+                table_names = [table[0] for table in cur.fetchall() if not is_narrow_store_relation(table[0])]
                 
                 current_table_text = self.table_combo.currentText() if not schema_changed and self.table_combo.count() > 0 else None
 
@@ -301,9 +319,19 @@ class DataExportTab(QWidget):
 
         try:
             preview_limit = self.preview_spinbox.value()
-            table_identifier = psql.Identifier(self.selected_table_schema, self.selected_table_name)
-            query = psql.SQL("SELECT * FROM {table} ORDER BY RANDOM() LIMIT {limit}").format(
-                table=table_identifier, limit=psql.Literal(preview_limit))
+            with conn.cursor() as cur:
+                estimated_rows, relkind = get_relation_estimate(cur, self.selected_table_schema, self.selected_table_name)
+                read_name = resolve_read_relation(cur, self.selected_table_schema, self.selected_table_name)
+            if read_name != self.selected_table_name:
+                relkind = 'v' # 宽视图不支持 TABLESAMPLE，行数估计沿用队列表
+            table_identifier = psql.Identifier(self.selected_table_schema, read_name)
+            query = build_sample_query(
+                table_identifier, preview_limit,
+                method=self.sampling_combo.currentData(),
+                seed=self.sampling_seed_spinbox.value(),
+                estimated_rows=estimated_rows,
+                relkind=relkind
+            )
             
             with conn.cursor() as cur:
                 final_sql_string = cur.mogrify(query).decode(conn.encoding or 'utf-8')
@@ -334,10 +362,9 @@ class DataExportTab(QWidget):
 
             self.result_table.resizeColumnsToContents()
 
-            with conn.cursor() as cur:
-                cur.execute(psql.SQL("SELECT COUNT(*) FROM {table}").format(table=table_identifier))
-                total_rows = cur.fetchone()[0]
-            QMessageBox.information(self, "预览成功", f"表 {self.selected_table_schema}.{self.selected_table_name} (共 {total_rows} 行) 加载预览 {df.shape[0]} 行。")
+            # 行数来自 pg_class.reltuples 统计估计，避免对大表执行 COUNT(*)
+            total_rows_text = f"约 {estimated_rows:,} 行 (统计估计)" if estimated_rows is not None else "行数未知 (表尚未 ANALYZE)"
+            QMessageBox.information(self, "预览成功", f"表 {self.selected_table_schema}.{self.selected_table_name} ({total_rows_text}) 加载预览 {df.shape[0]} 行。")
         except Exception as e:
             QMessageBox.critical(self, "预览失败", f"无法预览数据: {str(e)}\n{traceback.format_exc()}")
             self.sql_preview_display.append(f"\n-- ERROR: {str(e)}")
@@ -369,7 +396,9 @@ class DataExportTab(QWidget):
 
         QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
         try:
-            table_identifier = psql.Identifier(self.selected_table_schema, self.selected_table_name)
+            with conn.cursor() as cur:
+                read_name = resolve_read_relation(cur, self.selected_table_schema, self.selected_table_name)
+            table_identifier = psql.Identifier(self.selected_table_schema, read_name)
             query_sql_obj = psql.SQL("SELECT * FROM {table}").format(table=table_identifier)
             limit_value = self.limit_spinbox.value()
             if limit_value > 0:
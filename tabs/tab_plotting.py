@@ -16,6 +16,7 @@ from lifelines import KaplanMeierFitter
 from lifelines.statistics import logrank_test
 
 from ui_components.plotting_panels.km_panel import KM_Panel
+from sql_logic.narrow_store import is_narrow_store_relation, resolve_read_relation
 
 class PlottingTab(QWidget):
     def __init__(self, get_db_params_func, get_db_profile_func, parent=None):
@@ -107,7 +108,7 @@ class PlottingTab(QWidget):
             with psycopg2.connect(**self.get_db_params()) as conn:
                 with conn.cursor() as cur:
                     cur.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = %s AND table_type='BASE TABLE' ORDER BY table_name", (schema,))
-                    tables = [t[0] for t in cur.fetchall()]
+                    tables = [t[0] for t in cur.fetchall() if not is_narrow_store_relation(t[0])]
                     current = self.table_combo.currentText()
                     self.table_combo.clear(); self.table_combo.addItems(tables)
                     if current in tables: self.table_combo.setCurrentText(current)
@@ -121,6 +122,9 @@ class PlottingTab(QWidget):
         QApplication.setOverrideCursor(Qt.WaitCursor)
         try:
             with psycopg2.connect(**self.get_db_params()) as conn:
+                # 使用窄表存储的队列表经由宽视图读取
+                with conn.cursor() as cur:
+                    table = resolve_read_relation(cur, schema, table)
                 self.df = pd.read_sql(f"SELECT * FROM \"{schema}\".\"{table}\"", conn)
             
             self.on_plot_type_changed(self.plot_type_combo.currentIndex())
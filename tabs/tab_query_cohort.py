@@ -4,17 +4,27 @@ from PySide6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QPushButton,
                           QSplitter, QTextEdit, QDialog, QLineEdit, QFormLayout,
                           QApplication, QProgressBar, QGroupBox, QComboBox,
                           QRadioButton, QButtonGroup, QScrollArea)
-from PySide6.QtCore import Qt, Signal, QObject, QThread, Slot
+from PySide6.QtCore import Qt, Signal, QObject, QThread, Slot, QTimer
+import json
 import psycopg2
 from psycopg2 import sql as psql
 from psycopg2.errors import QueryCanceled
 import re
 import time
+import threading
 import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from typing import Optional, Dict, Any, Tuple
 
 from ui_components.conditiongroup import ConditionGroupWidget 
 from db_profiles.base_profile import BaseDbProfile
+from sql_logic.sql_renderer import render_composable, render_sql
+from sql_logic.narrow_store import build_drop_feature_store_step
+from sql_logic.search_acceleration import build_search_acceleration_steps, resolve_search_relation
+from app_config import (COHORT_CREATE_UNLOGGED, COHORT_SET_LOGGED_AFTER_CREATE,
+                        COHORT_PARALLEL_WORKERS, COHORT_INDEX_CONNECTIONS,
+                        COHORT_ESTIMATE_DEBOUNCE_MS, COHORT_ESTIMATE_TIMEOUT_MS)
 
 # --- Constants ---
 COHORT_TYPE_FIRST_EVENT_KEY = "first_event_admission"
@@ -30,79 +40,169 @@ class CohortCreationWorker(QObject):
 
     def __init__(self, db_params, target_table_name_str,
                  condition_sql_template, condition_params,
-                 admission_cohort_type, source_mode_details, cohort_schema):
+                 admission_cohort_type, source_mode_details, cohort_schema,
+                 index_columns=None, primary_key_column=None,
+                 unlogged=COHORT_CREATE_UNLOGGED, set_logged_after=COHORT_SET_LOGGED_AFTER_CREATE,
+                 parallel_workers=COHORT_PARALLEL_WORKERS, index_connections=COHORT_INDEX_CONNECTIONS,
+                 first_icu_stay_relation=None):
         super().__init__()
         self.db_params = db_params; self.target_table_name_str = target_table_name_str
         self.condition_sql_template = condition_sql_template; self.condition_params = condition_params
         self.admission_cohort_type = admission_cohort_type; self.source_mode_details = source_mode_details
         self.cohort_schema = cohort_schema; self.is_cancelled = False; self.conn = None
+        # 物化管线选项: 索引列、主键列 (仅首次事件队列)、是否以 UNLOGGED 创建、并行进程数、建索引的连接数
+        # 需要 LOGGED 表 (set_logged_after) 时直接以普通表创建，而不是建完索引后再 SET LOGGED 重写整表
+        self.index_columns = list(index_columns) if index_columns is not None else (
+            ['patientunitstayid'] if 'eicu' in cohort_schema else ['subject_id', 'hadm_id'])
+        self.primary_key_column = primary_key_column if admission_cohort_type == COHORT_TYPE_FIRST_EVENT_KEY else None
+        self.unlogged = unlogged and not set_logged_after
+        self.parallel_workers = parallel_workers; self.index_connections = max(1, int(index_connections))
+        self._index_conns = set(); self._index_conn_lock = threading.Lock()
+        # 画像维护的首次 ICU 入住辅助视图 (只由"刷新"按钮创建)；为 None 或视图尚不存在时退回对 icustays 逐次排序
+        self.first_icu_stay_relation = first_icu_stay_relation
 
     @Slot()
     def cancel(self):
         self.log.emit("队列创建操作被请求取消..."); self.is_cancelled = True
-        if self.conn:
-            try: self.conn.cancel()
+        with self._index_conn_lock: conns = [self.conn] + list(self._index_conns)
+        for conn in conns:
+            if not conn: continue
+            try: conn.cancel()
             except Exception as e: self.log.emit(f"发送取消请求时出错: {e}")
 
+    @contextmanager
+    def _stage(self, step, total_steps, label):
+        """执行一个物化阶段：开始与结束时都通过 progress 信号报告，结束时附带耗时。"""
+        stage_msg = f"步骤 {step}/{total_steps}: {label}..."; self.log.emit(stage_msg)
+        self.progress.emit(step - 1, total_steps, stage_msg)
+        started = time.perf_counter()
+        yield
+        done_msg = f"步骤 {step}/{total_steps}: {label} 完成 (耗时 {time.perf_counter() - started:.2f} 秒)"; self.log.emit(done_msg)
+        self.progress.emit(step, total_steps, done_msg)
+        if self.is_cancelled: raise InterruptedError("操作已取消")
+
+    def _apply_session_settings(self, cur, maintenance=False):
+        if self.parallel_workers is None: return
+        setting = "max_parallel_maintenance_workers" if maintenance else "max_parallel_workers_per_gather"
+        cur.execute(psql.SQL("SET {} = {}").format(psql.SQL(setting), psql.Literal(int(self.parallel_workers))))
+
+    def _create_index_on_own_connection(self, target_table_ident, column):
+        """在独立连接上建立一个索引 (自动提交)，多个索引可以同时建立。"""
+        conn = psycopg2.connect(**self.db_params); conn.autocommit = True
+        with self._index_conn_lock: self._index_conns.add(conn)
+        try:
+            if self.is_cancelled: raise InterruptedError("操作已取消")
+            with conn.cursor() as cur:
+                self._apply_session_settings(cur, maintenance=True)
+                started = time.perf_counter()
+                cur.execute(psql.SQL("CREATE INDEX ON {} ({})").format(target_table_ident, psql.Identifier(column)))
+                return column, time.perf_counter() - started
+        finally:
+            with self._index_conn_lock: self._index_conns.discard(conn)
+            conn.close()
+
     def run(self):
-        total_steps = 5; current_step = 0
+        total_steps = 6
+        step = 0; table_committed = False
+        target_table_ident = psql.Identifier(self.cohort_schema, self.target_table_name_str)
         try:
             self.log.emit(f"开始创建队列: {self.target_table_name_str} ..."); 
-            self.progress.emit(current_step, total_steps, "准备开始...")
-            
-            self.log.emit("连接数据库..."); self.conn = psycopg2.connect(**self.db_params)
-            cur = self.conn.cursor(); self.conn.autocommit = False; self.log.emit("数据库已连接。")
-            if self.is_cancelled: raise InterruptedError("操作在连接后取消")
+            self.progress.emit(0, total_steps, "准备开始...")
 
-            current_step += 1; stage_msg = f"步骤 {current_step}/{total_steps}: 确保 schema 存在..."; self.log.emit(stage_msg)
-            self.progress.emit(current_step, total_steps, stage_msg)
-            cur.execute(psql.SQL("CREATE SCHEMA IF NOT EXISTS {}").format(psql.Identifier(self.cohort_schema)))
-            if self.is_cancelled: raise InterruptedError("操作已取消")
+            step += 1
+            with self._stage(step, total_steps, "连接数据库并设置会话"):
+                self.conn = psycopg2.connect(**self.db_params)
+                cur = self.conn.cursor(); self.conn.autocommit = False
+                self._apply_session_settings(cur)
+                cur.execute(psql.SQL("CREATE SCHEMA IF NOT EXISTS {}").format(psql.Identifier(self.cohort_schema)))
+                self._resolve_first_icu_stay_relation(cur)
 
-            target_table_ident = psql.Identifier(self.cohort_schema, self.target_table_name_str)
             base_event_select_sql, base_event_params = self._build_base_event_query()
             if base_event_select_sql is None: raise ValueError("无法构建基础事件查询SQL。")
             final_event_select_sql = self._build_final_event_select_sql(base_event_select_sql)
 
-            current_step += 1; stage_msg = f"步骤 {current_step}/{total_steps}: 创建临时表..."; self.log.emit(stage_msg)
-            self.progress.emit(current_step, total_steps, stage_msg)
-            temp_event_ad_table = psql.Identifier(f"temp_event_ad_{int(time.time())}")
-            temp_table_creation_sql = psql.SQL("CREATE TEMPORARY TABLE {temp_table} AS ({query})").format(temp_table=temp_event_ad_table, query=final_event_select_sql)
-            self.log.emit("--- [将执行SQL]: 创建临时事件表 ---\n" + cur.mogrify(temp_table_creation_sql, base_event_params).decode(self.conn.encoding or 'utf-8', 'replace'))
-            cur.execute(temp_table_creation_sql, base_event_params)
-            if self.is_cancelled: raise InterruptedError("操作已取消")
-            
-            current_step += 1; stage_msg = f"步骤 {current_step}/{total_steps}: 创建目标队列数据表..."; self.log.emit(stage_msg)
-            self.progress.emit(current_step, total_steps, stage_msg)
-            final_table_creation_sql = self._build_final_table_creation_sql(target_table_ident, temp_event_ad_table)
-            self.log.emit("--- [将执行SQL]: 创建最终队列数据表 ---\n" + cur.mogrify(final_table_creation_sql).decode(self.conn.encoding or 'utf-8', 'replace'))
-            cur.execute(final_table_creation_sql)
-            if self.is_cancelled: raise InterruptedError("操作已取消")
+            step += 1
+            with self._stage(step, total_steps, "创建临时事件表"):
+                temp_event_ad_table = psql.Identifier(f"temp_event_ad_{int(time.time())}")
+                temp_table_creation_sql = psql.SQL("CREATE TEMPORARY TABLE {temp_table} AS ({query})").format(temp_table=temp_event_ad_table, query=final_event_select_sql)
+                self.log.emit("--- [将执行SQL]: 创建临时事件表 ---\n" + cur.mogrify(temp_table_creation_sql, base_event_params).decode(self.conn.encoding or 'utf-8', 'replace'))
+                cur.execute(temp_table_creation_sql, base_event_params)
 
-            current_step += 1; stage_msg = f"步骤 {current_step}/{total_steps}: 创建索引..."; self.log.emit(stage_msg)
-            self.progress.emit(current_step, total_steps, stage_msg)
-            if 'eicu' in self.cohort_schema: cur.execute(psql.SQL("CREATE INDEX ON {target_table} (patientunitstayid);").format(target_table=target_table_ident))
-            else: cur.execute(psql.SQL("CREATE INDEX ON {target_table} (subject_id);").format(target_table=target_table_ident)); cur.execute(psql.SQL("CREATE INDEX ON {target_table} (hadm_id);").format(target_table=target_table_ident))
-            if self.is_cancelled: raise InterruptedError("操作已取消")
-            
-            current_step += 1; stage_msg = f"步骤 {current_step}/{total_steps}: 提交事务..."; self.log.emit(stage_msg)
-            self.progress.emit(current_step, total_steps, stage_msg)
-            self.conn.commit(); cur.execute(psql.SQL("SELECT COUNT(*) FROM {}").format(target_table_ident))
-            count = cur.fetchone()[0];
+            step += 1
+            with self._stage(step, total_steps, f"创建目标队列数据表{' (UNLOGGED)' if self.unlogged else ''}"):
+                # 同名旧队列的窄表特征 (宽视图依赖旧表)、增量标记表与分箱长表不再适用于新队列，先行删除
+                cur.execute(build_drop_feature_store_step(target_table_ident)[0])
+                final_table_creation_sql = self._build_final_table_creation_sql(target_table_ident, temp_event_ad_table)
+                self.log.emit("--- [将执行SQL]: 创建最终队列数据表 ---\n" + cur.mogrify(final_table_creation_sql).decode(self.conn.encoding or 'utf-8', 'replace'))
+                cur.execute(final_table_creation_sql)
+                self._add_primary_key(cur, target_table_ident)
+                # 提交后其他连接才能看到新表并为其建立索引
+                self.conn.commit(); table_committed = True
+
+            step += 1
+            index_columns = [c for c in self.index_columns if c != self.primary_key_column]
+            with self._stage(step, total_steps, f"在 {min(len(index_columns), self.index_connections)} 个连接上并行创建索引"):
+                if index_columns:
+                    with ThreadPoolExecutor(max_workers=min(len(index_columns), self.index_connections)) as executor:
+                        futures = [executor.submit(self._create_index_on_own_connection, target_table_ident, c) for c in index_columns]
+                        for future in as_completed(futures):
+                            column, elapsed = future.result()
+                            self.log.emit(f"索引 ({column}) 已建立，耗时 {elapsed:.2f} 秒")
+
+            step += 1
+            with self._stage(step, total_steps, "收集统计信息 (ANALYZE)"):
+                cur.execute(psql.SQL("ANALYZE {}").format(target_table_ident))
+
+            step += 1
+            with self._stage(step, total_steps, "提交事务"):
+                self.conn.commit(); cur.execute(psql.SQL("SELECT COUNT(*) FROM {}").format(target_table_ident))
+                count = cur.fetchone()[0]
             self.finished.emit(self.target_table_name_str, count)
         except (InterruptedError, QueryCanceled):
-            if self.conn: self.conn.rollback(); self.error.emit("操作已取消")
+            self._rollback_after_failure(target_table_ident, table_committed); self.error.emit("操作已取消")
         except (Exception, psycopg2.Error) as error:
-            if self.conn: self.conn.rollback(); self.error.emit(f"创建队列时出错: {error}\n{traceback.format_exc()}")
+            self._rollback_after_failure(target_table_ident, table_committed); self.error.emit(f"创建队列时出错: {error}\n{traceback.format_exc()}")
         finally:
             if self.conn: self.conn.close()
 
+    def _resolve_first_icu_stay_relation(self, cur):
+        """辅助视图只在用户刷新时创建；建表前用 to_regclass 确认其存在，不存在则改用内联子查询。"""
+        if not self.first_icu_stay_relation: return
+        cur.execute("SELECT to_regclass(%s) IS NOT NULL", (self.first_icu_stay_relation,))
+        if cur.fetchone()[0]: return
+        self.log.emit(f"辅助视图 {self.first_icu_stay_relation} 尚未创建 (可点击\"刷新首次ICU入住辅助表\")，本次改用 icustays 子查询。")
+        self.first_icu_stay_relation = None
+
+    def _add_primary_key(self, cur, target_table_ident):
+        """为首次事件队列声明主键；键列存在重复或空值时回退为普通索引 (不中断创建)。"""
+        if not self.primary_key_column: return
+        cur.execute("SAVEPOINT cohort_pk")
+        try:
+            cur.execute(psql.SQL("ALTER TABLE {} ADD PRIMARY KEY ({})").format(target_table_ident, psql.Identifier(self.primary_key_column)))
+            cur.execute("RELEASE SAVEPOINT cohort_pk")
+            self.log.emit(f"已声明主键 ({self.primary_key_column})。")
+        except psycopg2.Error as e:
+            cur.execute("ROLLBACK TO SAVEPOINT cohort_pk")
+            self.log.emit(f"无法声明主键 ({self.primary_key_column})，改为普通索引: {e}")
+            self.primary_key_column = None
+
+    def _rollback_after_failure(self, target_table_ident, table_committed):
+        if not self.conn or self.conn.closed: return
+        try:
+            self.conn.rollback()
+            if table_committed:
+                # 队列表已提交但后续阶段失败：删除不完整的表，避免留下缺少索引或统计信息的队列
+                with self.conn.cursor() as cur: cur.execute(psql.SQL("DROP TABLE IF EXISTS {}").format(target_table_ident))
+                self.conn.commit()
+        except psycopg2.Error as e:
+            self.log.emit(f"清理失败的队列表时出错: {e}")
+
     # ... (rest of the worker methods are unchanged) ...
     def _build_final_event_select_sql(self, base_event_select_sql):
         if self.admission_cohort_type == COHORT_TYPE_FIRST_EVENT_KEY:
             order_by_parts = self._get_ranking_order_by()
-            partition_field = "base.patientunitstayid" if 'eicu' in self.cohort_schema else "base.subject_id"
-            return psql.SQL("SELECT * FROM (SELECT base.*, ROW_NUMBER() OVER(PARTITION BY {partition_field} ORDER BY {order}) AS rn FROM ({base}) AS base) ranked WHERE ranked.rn = 1").format(partition_field=psql.SQL(partition_field), order=psql.SQL(', ').join(order_by_parts), base=base_event_select_sql)
+            partition_field = psql.Identifier("base", get_first_event_partition_column(self.cohort_schema))
+            return psql.SQL("SELECT * FROM (SELECT base.*, ROW_NUMBER() OVER(PARTITION BY {partition_field} ORDER BY {order}) AS rn FROM ({base}) AS base) ranked WHERE ranked.rn = 1").format(partition_field=partition_field, order=psql.SQL(', ').join(order_by_parts), base=base_event_select_sql)
         return base_event_select_sql
     def _get_ranking_order_by(self):
         if 'eicu' in self.cohort_schema:
@@ -114,85 +214,163 @@ class CohortCreationWorker(QObject):
             if self.source_mode_details.get("event_seq_num_col"): order_by_parts.append(psql.SQL("base.qualifying_event_seq_num ASC"))
         return order_by_parts
     def _build_final_table_creation_sql(self, target_table_ident, temp_event_ad_table):
-        if 'eicu' in self.cohort_schema: return psql.SQL("DROP TABLE IF EXISTS {target_table}; CREATE TABLE {target_table} AS SELECT evt.patientunitstayid, pat.uniquepid, evt.admittime, pat.unitdischargeoffset AS los_icu_minutes, pat.unitadmittime24 AS icu_intime, evt.qualifying_event_title, evt.qualifying_event_time AS diagnosis_offset_min, pat.age, pat.gender, pat.hospitaldischargestatus FROM {temp_event} evt JOIN public.patient pat ON evt.patientunitstayid = pat.patientunitstayid;").format(target_table=target_table_ident, temp_event=temp_event_ad_table)
-        return psql.SQL("DROP TABLE IF EXISTS {target_table}; CREATE TABLE {target_table} AS SELECT evt.subject_id, evt.hadm_id, evt.admittime, adm.dischtime, icu.stay_id, icu.intime AS icu_intime, icu.outtime AS icu_outtime, EXTRACT(EPOCH FROM (icu.outtime - icu.intime)) / 3600.0 AS los_icu_hours, evt.qualifying_event_code, evt.qualifying_event_icd_version, evt.qualifying_event_title, evt.qualifying_event_seq_num FROM {temp_event} evt JOIN mimiciv_hosp.admissions adm ON evt.hadm_id = adm.hadm_id LEFT JOIN (SELECT i.*, ROW_NUMBER() OVER(PARTITION BY i.hadm_id ORDER BY i.intime) as rn FROM mimiciv_icu.icustays i) icu ON evt.hadm_id = icu.hadm_id AND icu.rn = 1;").format(target_table=target_table_ident, temp_event=temp_event_ad_table)
+        create_kw = psql.SQL("CREATE UNLOGGED TABLE" if self.unlogged else "CREATE TABLE")
+        if 'eicu' in self.cohort_schema: return psql.SQL("DROP TABLE IF EXISTS {target_table}; {create} {target_table} AS SELECT evt.patientunitstayid, pat.uniquepid, evt.admittime, pat.unitdischargeoffset AS los_icu_minutes, pat.unitadmittime24 AS icu_intime, evt.qualifying_event_title, evt.qualifying_event_time AS diagnosis_offset_min, pat.age, pat.gender, pat.hospitaldischargestatus FROM {temp_event} evt JOIN public.patient pat ON evt.patientunitstayid = pat.patientunitstayid;").format(create=create_kw, target_table=target_table_ident, temp_event=temp_event_ad_table)
+        # dischtime 已随基础事件查询带入临时表，这里只需连接首次 ICU 入住
+        if self.first_icu_stay_relation: icu_source = psql.Identifier(*self.first_icu_stay_relation.split('.', 1))
+        else: icu_source = psql.SQL("(SELECT i.hadm_id, i.stay_id, i.intime, i.outtime, EXTRACT(EPOCH FROM (i.outtime - i.intime)) / 3600.0 AS los_icu_hours FROM (SELECT i.*, ROW_NUMBER() OVER(PARTITION BY i.hadm_id ORDER BY i.intime) as rn FROM mimiciv_icu.icustays i) i WHERE i.rn = 1)")
+        return psql.SQL("DROP TABLE IF EXISTS {target_table}; {create} {target_table} AS SELECT evt.subject_id, evt.hadm_id, evt.admittime, evt.dischtime, icu.stay_id, icu.intime AS icu_intime, icu.outtime AS icu_outtime, icu.los_icu_hours, evt.qualifying_event_code, evt.qualifying_event_icd_version, evt.qualifying_event_title, evt.qualifying_event_seq_num FROM {temp_event} evt LEFT JOIN {icu_source} icu ON evt.hadm_id = icu.hadm_id;").format(create=create_kw, target_table=target_table_ident, temp_event=temp_event_ad_table, icu_source=icu_source)
     def _build_base_event_query(self):
-        details = self.source_mode_details
-        event_table = psql.SQL(details['event_table'])
-        select_list = []
-        
-        # --- START OF ROBUST FIX ---
-        # 复制一份原始的 WHERE 子句模板
-        where_clause_str = self.condition_sql_template
+        return build_base_event_query(self.condition_sql_template, self.condition_params, self.source_mode_details, self.cohort_schema, self.log.emit)
+
+def get_first_event_partition_column(cohort_schema):
+    """首次事件队列中每个分组只保留一行的分组列: eICU 为 patientunitstayid，MIMIC-IV 为 subject_id (每位患者的首次入院)。"""
+    return "patientunitstayid" if 'eicu' in cohort_schema else "subject_id"
+
+def build_base_event_query(condition_sql_template, condition_params, source_mode_details, cohort_schema, log=lambda message: None):
+    """构建队列的基础事件查询 (每个满足条件的事件一行)，返回 (SQL, 参数)。队列创建与规模估计共用。"""
+    details = source_mode_details
+    event_table = psql.SQL(details['event_table'])
+    select_list = []
+    
+    # --- START OF ROBUST FIX ---
+    # 复制一份原始的 WHERE 子句模板
+    where_clause_str = condition_sql_template
+    
+    # 仅当需要连接字典表时，才对 WHERE 子句中的字段进行限定，以避免歧义
+    if details.get('dictionary_table'):
+        log("检测到字典表连接，正在限定WHERE子句中的字段...")
+        # 获取所有可能在字典表中进行搜索的字段
+        searchable_dict_fields = [field[0] for field in details.get('search_fields', [])]
         
-        # 仅当需要连接字典表时，才对 WHERE 子句中的字段进行限定，以避免歧义
-        if details.get('dictionary_table'):
-            self.log.emit("检测到字典表连接，正在限定WHERE子句中的字段...")
-            # 获取所有可能在字典表中进行搜索的字段
-            searchable_dict_fields = [field[0] for field in details.get('search_fields', [])]
-            
-            dummy_conn = None
-            try:
-                # 尝试使用默认参数连接，这在很多本地配置中会成功
-                dummy_conn = psycopg2.connect("")
-                
-                for field_name in searchable_dict_fields:
-                    # 将 'icd_code' 转换为 '"icd_code"'
-                    unqualified_str = psql.Identifier(field_name).as_string(dummy_conn)
-                    # 将 ('dd', 'icd_code') 转换为 '"dd"."icd_code"'
-                    qualified_str = psql.Identifier('dd', field_name).as_string(dummy_conn)
-                    
-                    if unqualified_str in where_clause_str:
-                        self.log.emit(f"限定字段 (方法: psycopg2): {unqualified_str} -> {qualified_str}")
-                        where_clause_str = where_clause_str.replace(unqualified_str, qualified_str)
-
-            except psycopg2.Error:
-                # 如果上面的连接失败，回退到手动格式化。这对于简单标识符是安全的。
-                self.log.emit("临时数据库连接失败，回退到手动字段限定。")
-                for field_name in searchable_dict_fields:
-                    # 手动构建带引号的标识符
-                    unqualified_str = f'"{field_name}"'
-                    qualified_str = f'"dd"."{field_name}"'
-                    
-                    if unqualified_str in where_clause_str:
-                        self.log.emit(f"限定字段 (方法: 手动): {unqualified_str} -> {qualified_str}")
-                        where_clause_str = where_clause_str.replace(unqualified_str, qualified_str)
-            finally:
-                if dummy_conn:
-                    dummy_conn.close()
-        # --- END OF ROBUST FIX ---
-
-        # eICU 的逻辑构建部分
-        if 'eicu' in self.cohort_schema:
-            select_list.extend([psql.SQL("e.patientunitstayid AS patientunitstayid"), psql.SQL("pat.unitadmittime24 AS admittime"), psql.SQL("e.{} AS qualifying_event_title").format(psql.Identifier(details['event_icd_col'])), psql.SQL("e.{} AS qualifying_event_seq_num").format(psql.Identifier(details.get('event_seq_num_col', 'diagnosispriority'))), psql.SQL("e.{} AS qualifying_event_time").format(psql.Identifier(details.get('event_time_col', 'diagnosisoffset'))), psql.SQL("NULL AS qualifying_event_icd_version")])
-            from_clause = psql.SQL("FROM {event_table} e JOIN public.patient pat ON e.patientunitstayid = pat.patientunitstayid").format(event_table=event_table)
+        for field_name in searchable_dict_fields:
+            # 将 'icd_code' 转换为 '"icd_code"'，将 ('dd', 'icd_code') 转换为 '"dd"."icd_code"' (离线渲染，无需数据库连接)
+            unqualified_str = render_composable(psql.Identifier(field_name))
+            qualified_str = render_composable(psql.Identifier('dd', field_name))
+
+            if unqualified_str in where_clause_str:
+                log(f"限定字段: {unqualified_str} -> {qualified_str}")
+                where_clause_str = where_clause_str.replace(unqualified_str, qualified_str)
+    # --- END OF ROBUST FIX ---
+
+    # eICU 的逻辑构建部分
+    if 'eicu' in cohort_schema:
+        select_list.extend([psql.SQL("e.patientunitstayid AS patientunitstayid"), psql.SQL("pat.unitadmittime24 AS admittime"), psql.SQL("e.{} AS qualifying_event_title").format(psql.Identifier(details['event_icd_col'])), psql.SQL("e.{} AS qualifying_event_seq_num").format(psql.Identifier(details.get('event_seq_num_col', 'diagnosispriority'))), psql.SQL("e.{} AS qualifying_event_time").format(psql.Identifier(details.get('event_time_col', 'diagnosisoffset'))), psql.SQL("NULL AS qualifying_event_icd_version")])
+        from_clause = psql.SQL("FROM {event_table} e JOIN public.patient pat ON e.patientunitstayid = pat.patientunitstayid").format(event_table=event_table)
+    
+    # MIMIC-IV 的逻辑构建部分
+    else:
+        select_list.extend([psql.SQL("e.subject_id"), psql.SQL("e.hadm_id"), psql.SQL("adm.admittime"), psql.SQL("adm.dischtime"), psql.SQL("e.{} AS qualifying_event_code").format(psql.Identifier(details['event_icd_col']))])
+        from_clause = psql.SQL("FROM {event_table} e JOIN mimiciv_hosp.admissions adm ON e.hadm_id = adm.hadm_id").format(event_table=event_table)
         
-        # MIMIC-IV 的逻辑构建部分
-        else:
-            select_list.extend([psql.SQL("e.subject_id"), psql.SQL("e.hadm_id"), psql.SQL("adm.admittime"), psql.SQL("e.{} AS qualifying_event_code").format(psql.Identifier(details['event_icd_col']))])
-            from_clause = psql.SQL("FROM {event_table} e JOIN mimiciv_hosp.admissions adm ON e.hadm_id = adm.hadm_id").format(event_table=event_table)
-            
-            if dict_table := psql.SQL(details['dictionary_table']) if details.get('dictionary_table') else None:
-                join_on_parts = [psql.SQL("e.{event_icd_col} = dd.{dict_icd_col}").format(event_icd_col=psql.Identifier(details['event_icd_col']), dict_icd_col=psql.Identifier(details['dict_icd_col']))]
-                if "diagnoses_icd" in details['event_table'] or "procedures_icd" in details['event_table']: 
-                    join_on_parts.append(psql.SQL("e.icd_version = dd.icd_version"))
-                
-                from_clause += psql.SQL(" JOIN {dict_table} dd ON {join_on}").format(dict_table=dict_table, join_on=psql.SQL(" AND ").join(join_on_parts))
-                select_list.append(psql.SQL("dd.{} AS qualifying_event_title").format(psql.Identifier(details['dict_title_col'])))
-            else: 
-                select_list.append(psql.SQL("e.{} AS qualifying_event_title").format(psql.Identifier(details['event_icd_col'])))
+        if dict_table := psql.SQL(details['dictionary_table']) if details.get('dictionary_table') else None:
+            join_on_parts = [psql.SQL("e.{event_icd_col} = dd.{dict_icd_col}").format(event_icd_col=psql.Identifier(details['event_icd_col']), dict_icd_col=psql.Identifier(details['dict_icd_col']))]
+            if "diagnoses_icd" in details['event_table'] or "procedures_icd" in details['event_table']: 
+                join_on_parts.append(psql.SQL("e.icd_version = dd.icd_version"))
             
-            select_list.append(psql.SQL("e.{} AS qualifying_event_seq_num").format(psql.Identifier(details['event_seq_num_col'])) if details.get("event_seq_num_col") else psql.SQL("NULL AS qualifying_event_seq_num"))
-            if details.get("event_time_col"): 
-                select_list.append(psql.SQL("e.{} AS qualifying_event_time").format(psql.Identifier(details['event_time_col'])))
-            select_list.append(psql.SQL("e.icd_version AS qualifying_event_icd_version") if "diagnoses_icd" in details['event_table'] or "procedures_icd" in details['event_table'] else psql.SQL("NULL AS qualifying_event_icd_version"))
+            from_clause += psql.SQL(" JOIN {dict_table} dd ON {join_on}").format(dict_table=dict_table, join_on=psql.SQL(" AND ").join(join_on_parts))
+            select_list.append(psql.SQL("dd.{} AS qualifying_event_title").format(psql.Identifier(details['dict_title_col'])))
+        else: 
+            select_list.append(psql.SQL("e.{} AS qualifying_event_title").format(psql.Identifier(details['event_icd_col'])))
         
-        # 使用我们最终处理过的 where_clause_str
-        return psql.SQL("SELECT {selects} {froms} WHERE {where}").format(
-            selects=psql.SQL(', ').join(select_list), 
-            froms=from_clause, 
-            where=psql.SQL(where_clause_str)
-        ), self.condition_params
+        select_list.append(psql.SQL("e.{} AS qualifying_event_seq_num").format(psql.Identifier(details['event_seq_num_col'])) if details.get("event_seq_num_col") else psql.SQL("NULL AS qualifying_event_seq_num"))
+        if details.get("event_time_col"): 
+            select_list.append(psql.SQL("e.{} AS qualifying_event_time").format(psql.Identifier(details['event_time_col'])))
+        select_list.append(psql.SQL("e.icd_version AS qualifying_event_icd_version") if "diagnoses_icd" in details['event_table'] or "procedures_icd" in details['event_table'] else psql.SQL("NULL AS qualifying_event_icd_version"))
+    
+    # 使用我们最终处理过的 where_clause_str
+    return psql.SQL("SELECT {selects} {froms} WHERE {where}").format(
+        selects=psql.SQL(', ').join(select_list), 
+        froms=from_clause, 
+        where=psql.SQL(where_clause_str)
+    ), condition_params
+
+class CohortSizeEstimateWorker(QObject):
+    """
+    在后台估计队列规模: 先在语句超时内精确计数 COUNT(DISTINCT 队列键)，超时后改用 EXPLAIN 的行数估计。
+    generation 用于丢弃被新条件取代的旧结果。
+    """
+    estimated = Signal(int, int, bool) # generation, 规模, 是否为精确计数
+    failed = Signal(int, str)
+    done = Signal()
+
+    def __init__(self, generation, db_params, base_event_sql, base_event_params, key_column, timeout_ms=COHORT_ESTIMATE_TIMEOUT_MS):
+        super().__init__()
+        self.generation = generation; self.db_params = db_params
+        self.base_event_sql = base_event_sql; self.base_event_params = base_event_params
+        self.key_column = key_column; self.timeout_ms = timeout_ms
+        self.is_cancelled = False; self.conn = None; self._conn_lock = threading.Lock()
+
+    def cancel(self):
+        self.is_cancelled = True
+        with self._conn_lock:
+            if self.conn and not self.conn.closed:
+                try: self.conn.cancel()
+                except Exception: pass
+
+    @Slot()
+    def run(self):
+        key = psql.Identifier(self.key_column)
+        try:
+            if self.is_cancelled: return
+            conn = psycopg2.connect(**self.db_params)
+            with self._conn_lock: self.conn = conn
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute("SELECT set_config('statement_timeout', %s, false)", (str(int(self.timeout_ms)),))
+                try:
+                    cur.execute(psql.SQL("SELECT COUNT(DISTINCT b.{key}) FROM ({base}) b").format(key=key, base=self.base_event_sql), self.base_event_params)
+                    if not self.is_cancelled: self.estimated.emit(self.generation, int(cur.fetchone()[0]), True)
+                    return
+                except QueryCanceled:
+                    # 被新条件取消时直接放弃；语句超时则退回规划器估计 (EXPLAIN 不执行查询)
+                    if self.is_cancelled: return
+                cur.execute(psql.SQL("EXPLAIN (FORMAT JSON) SELECT DISTINCT b.{key} FROM ({base}) b").format(key=key, base=self.base_event_sql), self.base_event_params)
+                raw = cur.fetchone()[0]
+                plan_doc = json.loads(raw) if isinstance(raw, str) else raw
+                if not self.is_cancelled: self.estimated.emit(self.generation, int(plan_doc[0]["Plan"].get("Plan Rows", 0)), False)
+        except Exception as e:
+            if not self.is_cancelled: self.failed.emit(self.generation, str(e))
+        finally:
+            with self._conn_lock:
+                if self.conn: self.conn.close()
+                self.conn = None
+            self.done.emit()
+
+class SearchAccelerationWorker(QObject):
+    """逐步建立项目检索加速 (pg_trgm 索引与去重小表)，每一步独立提交，失败的步骤记录后跳过。"""
+    finished = Signal(int, int) # 成功步数, 失败步数
+    error = Signal(str)
+    progress = Signal(int, int, str)
+    log = Signal(str)
+
+    def __init__(self, db_params, db_profile):
+        super().__init__()
+        self.db_params = db_params; self.db_profile = db_profile; self.conn = None
+
+    @Slot()
+    def run(self):
+        succeeded = failed = 0
+        try:
+            self.conn = psycopg2.connect(**self.db_params); self.conn.autocommit = True
+            with self.conn.cursor() as cur:
+                steps = build_search_acceleration_steps(cur, self.db_profile)
+                for i, (description, stmt) in enumerate(steps, start=1):
+                    self.progress.emit(i - 1, len(steps), f"步骤 {i}/{len(steps)}: {description}...")
+                    self.log.emit(f"--- [{description}] ---\n{render_sql(stmt)}")
+                    start_time = time.time()
+                    try:
+                        cur.execute(stmt); succeeded += 1
+                        self.log.emit(f"完成 (耗时 {time.time() - start_time:.2f} 秒)")
+                    except psycopg2.Error as e:
+                        failed += 1; self.log.emit(f"已跳过: {e}")
+                self.progress.emit(len(steps), len(steps), "检索加速建立完成")
+            self.finished.emit(succeeded, failed)
+        except Exception as e:
+            self.error.emit(f"建立检索加速失败: {e}")
+        finally:
+            if self.conn: self.conn.close()
+
 class QueryCohortTab(QWidget):
     # ... (__init__ and most of init_ui are the same) ...
     def __init__(self, get_db_params_func, get_db_profile_func, parent=None):
@@ -200,6 +378,11 @@ class QueryCohortTab(QWidget):
         self.db_profile: Optional[BaseDbProfile] = None; self.cohort_configs: Dict[str, Dict[str, Any]] = {}
         self.last_filter_conditions: Optional[Tuple[str, list]] = None
         self.cohort_worker_thread: Optional[QThread] = None; self.cohort_worker: Optional[CohortCreationWorker] = None
+        # 规模估计: 每次条件变化递增 generation，旧结果被丢弃；线程在结束前保留引用
+        self._estimate_generation = 0; self._estimate_worker: Optional[CohortSizeEstimateWorker] = None; self._estimate_threads = []; self._estimate_key_column = ""
+        self._estimate_timer = QTimer(self); self._estimate_timer.setSingleShot(True); self._estimate_timer.setInterval(COHORT_ESTIMATE_DEBOUNCE_MS)
+        self._estimate_timer.timeout.connect(self._start_size_estimate)
+        self.search_accel_thread: Optional[QThread] = None; self.search_accel_worker: Optional[SearchAccelerationWorker] = None
         self.init_ui()
     def init_ui(self):
         main_layout=QVBoxLayout(self); splitter=QSplitter(Qt.Orientation.Vertical); main_layout.addWidget(splitter)
@@ -209,16 +392,24 @@ class QueryCohortTab(QWidget):
         self.mode_radio_button_layout.setContentsMargins(0,0,0,0); mode_layout.addWidget(self.mode_radio_button_container)
         self.mode_selection_group.buttonToggled.connect(self.on_mode_changed); top_layout.addWidget(mode_group)
         condition_group=QGroupBox("2. 构建筛选条件并预览项目"); condition_layout=QVBoxLayout(condition_group)
-        self.condition_group=ConditionGroupWidget(is_root=True); self.condition_group.condition_changed.connect(self.update_button_states)
+        self.condition_group=ConditionGroupWidget(is_root=True); self.condition_group.condition_changed.connect(self.update_button_states); self.condition_group.condition_changed.connect(self.schedule_size_estimate)
         cg_scroll=QScrollArea(); cg_scroll.setWidgetResizable(True); cg_scroll.setWidget(self.condition_group); cg_scroll.setMinimumHeight(150); condition_layout.addWidget(cg_scroll)
         condition_layout.addWidget(QLabel("SQL预览/执行日志:")); self.sql_preview_display=QTextEdit(); self.sql_preview_display.setReadOnly(True); self.sql_preview_display.setMinimumHeight(100); condition_layout.addWidget(self.sql_preview_display)
         filter_btn_layout=QHBoxLayout(); filter_btn_layout.addStretch()
         self.filter_btn=QPushButton("筛选并预览项目"); self.filter_btn.clicked.connect(self.filter_items_action)
         filter_btn_layout.addWidget(self.filter_btn); condition_layout.addLayout(filter_btn_layout); top_layout.addWidget(condition_group)
         create_group=QGroupBox("3. 设置队列选项并创建"); create_layout=QVBoxLayout(create_group)
-        cohort_type_layout=QHBoxLayout(); cohort_type_layout.addWidget(QLabel("入院类型:")); self.admission_type_combo=QComboBox(); cohort_type_layout.addWidget(self.admission_type_combo); cohort_type_layout.addStretch(); create_layout.addLayout(cohort_type_layout)
-        create_btn_layout=QHBoxLayout(); create_btn_layout.addStretch()
+        cohort_type_layout=QHBoxLayout(); cohort_type_layout.addWidget(QLabel("入院类型:")); self.admission_type_combo=QComboBox(); self.admission_type_combo.currentIndexChanged.connect(self.schedule_size_estimate); cohort_type_layout.addWidget(self.admission_type_combo); cohort_type_layout.addStretch(); create_layout.addLayout(cohort_type_layout)
+        create_btn_layout=QHBoxLayout()
+        self.refresh_helper_btn=QPushButton("刷新首次ICU入住辅助表"); self.refresh_helper_btn.setToolTip("创建或按源表 (icustays) 的当前内容重新计算辅助表；辅助表不存在时队列创建改用子查询"); self.refresh_helper_btn.clicked.connect(self.refresh_helper_tables_action); create_btn_layout.addWidget(self.refresh_helper_btn)
+        self.search_accel_btn=QPushButton("建立检索加速索引"); self.search_accel_btn.setToolTip("为项目检索列建立 pg_trgm 索引与去重小表，加快筛选项目 (可重复执行以刷新)"); self.search_accel_btn.clicked.connect(self.build_search_acceleration_action); create_btn_layout.addWidget(self.search_accel_btn)
+        create_btn_layout.addStretch()
+        self.estimate_label=QLabel(""); self.estimate_label.setStyleSheet("color: gray;"); create_btn_layout.addWidget(self.estimate_label)
         self.create_cohort_btn=QPushButton("创建队列"); self.create_cohort_btn.setStyleSheet("font-weight: bold; color: green;"); self.create_cohort_btn.clicked.connect(self.create_cohort_action); create_btn_layout.addWidget(self.create_cohort_btn)
+        if COHORT_CREATE_UNLOGGED and not COHORT_SET_LOGGED_AFTER_CREATE:
+            self.create_cohort_btn.setToolTip("队列表以 UNLOGGED 表创建 (不写 WAL，创建更快)。\n"
+                                              "注意：数据库崩溃或异常重启后 UNLOGGED 表会被清空，且不会复制到备库；需要时可按相同条件重新创建。\n"
+                                              "如需崩溃安全的普通表，请在 app_config 中设置 COHORT_SET_LOGGED_AFTER_CREATE = True。")
         self.cancel_btn=QPushButton("取消操作"); self.cancel_btn.clicked.connect(self.cancel_action); create_btn_layout.addWidget(self.cancel_btn); create_layout.addLayout(create_btn_layout); top_layout.addWidget(create_group)
         self.status_group=QGroupBox("执行状态"); status_layout=QVBoxLayout(self.status_group)
         self.progress_bar=QProgressBar(); status_layout.addWidget(self.progress_bar); self.status_label_short = QLabel("准备就绪"); status_layout.addWidget(self.status_label_short); top_layout.addWidget(self.status_group)
@@ -241,13 +432,15 @@ class QueryCohortTab(QWidget):
         if QMessageBox.question(self, '确认创建', f"将创建表:\n{target_table_name}\n确定吗?", QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No) == QMessageBox.StandardButton.No: return
         
         condition_sql, params = self.last_filter_conditions
-        self.progress_bar.setRange(0, 5); self.progress_bar.setValue(0)
+        self.progress_bar.setRange(0, 0); self.progress_bar.setValue(0) # 阶段数由工作线程的进度信号给出
         
         # FIX: Clear the main display and connect log signal to it
         self.sql_preview_display.clear()
         self.sql_preview_display.setPlaceholderText("正在准备创建队列，请稍候...")
         
-        self.cohort_worker = CohortCreationWorker(db_params, target_table_name, condition_sql, params, admission_type, config, self.db_profile.get_cohort_table_schema())
+        self.cohort_worker = CohortCreationWorker(db_params, target_table_name, condition_sql, params, admission_type, config, self.db_profile.get_cohort_table_schema(),
+                                                  index_columns=self.db_profile.get_cohort_index_columns(), primary_key_column=self.db_profile.get_cohort_primary_key(),
+                                                  first_icu_stay_relation=self.db_profile.get_first_icu_stay_relation(), helper_ensure_sql=self.db_profile.get_helper_table_ensure_sql())
         self.cohort_worker_thread = QThread(); self.cohort_worker.moveToThread(self.cohort_worker_thread)
         self.cohort_worker_thread.started.connect(self.cohort_worker.run)
         
@@ -262,7 +455,7 @@ class QueryCohortTab(QWidget):
 
     @Slot(int, int, str)
     def update_progress(self, value, max_val, message):
-        self.progress_bar.setValue(value)
+        self.progress_bar.setRange(0, max_val); self.progress_bar.setValue(value)
         self.status_label_short.setText(message)
 
     # ... (rest of the class is unchanged) ...
@@ -278,7 +471,7 @@ class QueryCohortTab(QWidget):
                 rb = QRadioButton(config['display_name']); self.mode_selection_group.addButton(rb, i); rb.setProperty("mode_key", key); self.mode_radio_button_layout.addWidget(rb)
             if self.mode_selection_group.buttons(): self.mode_selection_group.buttons()[0].setChecked(True); self.on_mode_changed()
         else: self.clear_all_states()
-    def on_db_connected(self): self.update_button_states()
+    def on_db_connected(self): self.update_button_states(); self.schedule_size_estimate()
     @Slot()
     def on_mode_changed(self): self.clear_all_states()
     def clear_all_states(self):
@@ -288,29 +481,36 @@ class QueryCohortTab(QWidget):
             self.condition_group.set_available_search_fields(active_config.get("search_fields", []))
             self.admission_type_combo.clear(); self.admission_type_combo.addItem(COHORT_TYPE_FIRST_EVENT_STR, COHORT_TYPE_FIRST_EVENT_KEY); self.admission_type_combo.addItem(COHORT_TYPE_ALL_EVENTS_STR, COHORT_TYPE_ALL_EVENTS_KEY)
         else: self.condition_group.set_available_search_fields([]); self.admission_type_combo.clear()
-        self.update_button_states()
+        self.update_button_states(); self.schedule_size_estimate()
     def get_active_mode_config(self):
         if btn := self.mode_selection_group.checkedButton(): return self.cohort_configs.get(btn.property("mode_key"))
     @Slot()
     def update_button_states(self):
         is_busy = bool(self.cohort_worker_thread and self.cohort_worker_thread.isRunning()); db_connected = bool(self.get_db_params()); has_valid_conditions = self.condition_group.has_valid_input()
         self.filter_btn.setEnabled(db_connected and has_valid_conditions and not is_busy); self.create_cohort_btn.setEnabled(self.last_filter_conditions is not None and not is_busy)
-        self.cancel_btn.setEnabled(is_busy); self.status_group.setVisible(is_busy)
+        accel_busy = bool(self.search_accel_thread and self.search_accel_thread.isRunning())
+        self.cancel_btn.setEnabled(is_busy); self.status_group.setVisible(is_busy or accel_busy)
+        has_helper_tables = bool(self.db_profile and self.db_profile.get_helper_table_refresh_sql())
+        self.refresh_helper_btn.setVisible(has_helper_tables); self.refresh_helper_btn.setEnabled(db_connected and not is_busy)
+        self.search_accel_btn.setVisible(bool(self.db_profile and self.db_profile.get_search_acceleration_schema())); self.search_accel_btn.setEnabled(db_connected and not is_busy and not accel_busy)
         for w in [self.mode_radio_button_container, self.condition_group, self.admission_type_combo]: w.setEnabled(not is_busy)
     def filter_items_action(self):
         config = self.get_active_mode_config(); db_params = self.get_db_params()
         if not config or not db_params: QMessageBox.warning(self, "错误", "请确保已连接数据库并选择筛选模式。"); return
         condition_sql, params = self.condition_group.get_condition()
-        select_cols = []
-        if dict_table_name := config.get("dictionary_table"):
-            select_cols.append(psql.Identifier(config["dict_icd_col"])); select_cols.append(psql.Identifier(config["dict_title_col"]))
-            if any('icd_version' in field[0] for field in config.get('search_fields', [])): select_cols.append(psql.Identifier('icd_version'))
-            query = psql.SQL("SELECT {cols} FROM {dict_table} WHERE {cond} LIMIT 500").format(cols=psql.SQL(', ').join(select_cols), dict_table=psql.SQL(dict_table_name), cond=psql.SQL(condition_sql))
-        else: query = psql.SQL("SELECT DISTINCT {code_col} FROM {event_table} WHERE {cond} LIMIT 500").format(code_col=psql.Identifier(config["event_icd_col"]), event_table=psql.SQL(config["event_table"]), cond=psql.SQL(condition_sql))
-        self.sql_preview_display.setText("正在生成SQL并查询..."); QApplication.processEvents()
         try:
             with psycopg2.connect(**db_params) as conn, conn.cursor() as cur:
-                mogrified_sql = cur.mogrify(query, params).decode(conn.encoding or 'utf-8', 'replace'); self.sql_preview_display.setText(mogrified_sql); cur.execute(query, params)
+                select_cols = []
+                if dict_table_name := config.get("dictionary_table"):
+                    select_cols.append(psql.Identifier(config["dict_icd_col"])); select_cols.append(psql.Identifier(config["dict_title_col"]))
+                    if any('icd_version' in field[0] for field in config.get('search_fields', [])): select_cols.append(psql.Identifier('icd_version'))
+                    query = psql.SQL("SELECT {cols} FROM {dict_table} WHERE {cond} LIMIT 500").format(cols=psql.SQL(', ').join(select_cols), dict_table=psql.SQL(dict_table_name), cond=psql.SQL(condition_sql))
+                else:
+                    # 无字典表时在事件表上列出不重复的项目；已建立检索加速时改读去重小表
+                    event_source = resolve_search_relation(cur, self.db_profile, config["event_table"], {config["event_icd_col"]} | self.condition_group.get_used_fields())
+                    query = psql.SQL("SELECT DISTINCT {code_col} FROM {event_table} WHERE {cond} LIMIT 500").format(code_col=psql.Identifier(config["event_icd_col"]), event_table=event_source, cond=psql.SQL(condition_sql))
+                self.sql_preview_display.setText(render_sql(query, params)); QApplication.processEvents()
+                cur.execute(query, params)
                 cols = [desc[0] for desc in cur.description]; rows = cur.fetchall(); self.result_label.setText(f"筛选项目预览 ({len(rows)} 条):"); self.result_table.setRowCount(len(rows))
                 self.result_table.setColumnCount(len(cols)); self.result_table.setHorizontalHeaderLabels(cols)
                 for i, row in enumerate(rows):
@@ -319,6 +519,71 @@ class QueryCohortTab(QWidget):
             self.last_filter_conditions = (condition_sql, params); QMessageBox.information(self, "筛选成功", f"找到 {len(rows)} 个匹配项（最多显示500条）。\n您现在可以创建队列了。")
         except Exception as e: QMessageBox.critical(self, "筛选失败", f"执行筛选查询时出错: {e}"); self.sql_preview_display.setText(f"-- 查询失败 --\n{e}"); self.last_filter_conditions = None
         finally: self.update_button_states()
+    @Slot()
+    def schedule_size_estimate(self):
+        """条件变化时立即取消进行中的估计，防抖后重新估计。"""
+        self._estimate_generation += 1; self._estimate_timer.stop()
+        if self._estimate_worker: self._estimate_worker.cancel(); self._estimate_worker = None
+        if not (self.get_db_params() and self.db_profile and self.get_active_mode_config() and self.condition_group.has_valid_input()):
+            self.estimate_label.setText(""); return
+        self.estimate_label.setText("规模估计中..."); self._estimate_timer.start()
+    def _start_size_estimate(self):
+        config = self.get_active_mode_config(); db_params = self.get_db_params()
+        # 与创建按钮生成的队列一致: 首次事件队列按其分组列计数 (MIMIC-IV 为 subject_id)，否则按队列主键计数
+        if self.admission_type_combo.currentData() == COHORT_TYPE_FIRST_EVENT_KEY and self.db_profile:
+            key_column = get_first_event_partition_column(self.db_profile.get_cohort_table_schema())
+        else: key_column = self.db_profile.get_cohort_primary_key() if self.db_profile else None
+        if not config or not db_params or not key_column or not self.condition_group.has_valid_input(): self.estimate_label.setText(""); return
+        self._estimate_key_column = key_column
+        condition_sql, params = self.condition_group.get_condition()
+        try: base_event_sql, base_event_params = build_base_event_query(condition_sql, params, config, self.db_profile.get_cohort_table_schema())
+        except Exception as e: self.estimate_label.setText(""); self.sql_preview_display.append(f"-- 无法构建规模估计查询: {e}"); return
+        worker = CohortSizeEstimateWorker(self._estimate_generation, db_params, base_event_sql, base_event_params, key_column)
+        thread = QThread(); worker.moveToThread(thread); thread.started.connect(worker.run)
+        worker.estimated.connect(self.on_size_estimated); worker.failed.connect(self.on_size_estimate_failed)
+        worker.done.connect(thread.quit); thread.finished.connect(worker.deleteLater); thread.finished.connect(thread.deleteLater)
+        thread.finished.connect(lambda t=thread: self._estimate_threads.remove(t) if t in self._estimate_threads else None)
+        self._estimate_worker = worker; self._estimate_threads.append(thread); thread.start()
+    @Slot(int, int, bool)
+    def on_size_estimated(self, generation, count, is_exact):
+        if generation != self._estimate_generation: return
+        self._estimate_worker = None; self.estimate_label.setToolTip(""); key_column = self._estimate_key_column
+        self.estimate_label.setText(f"预计规模: {count:,} 个 {key_column}" if is_exact else f"预计规模: 约 {count:,} 个 {key_column} (计数超时，规划器估计)")
+    @Slot(int, str)
+    def on_size_estimate_failed(self, generation, error_message):
+        if generation != self._estimate_generation: return
+        self._estimate_worker = None; self.estimate_label.setText("规模估计失败"); self.estimate_label.setToolTip(error_message)
+    def refresh_helper_tables_action(self):
+        db_params = self.get_db_params()
+        if not db_params or not self.db_profile: return
+        refresh_sql = self.db_profile.get_helper_table_refresh_sql()
+        if not refresh_sql: return
+        try:
+            self.sql_preview_display.setText("\n\n".join(refresh_sql)); QApplication.setOverrideCursor(Qt.WaitCursor); QApplication.processEvents()
+            with psycopg2.connect(**db_params) as conn, conn.cursor() as cur:
+                for stmt in refresh_sql: cur.execute(stmt)
+            QMessageBox.information(self, "刷新完成", f"辅助表 {self.db_profile.get_first_icu_stay_relation()} 已刷新。")
+        except Exception as e: QMessageBox.critical(self, "刷新失败", f"刷新辅助表时出错: {e}")
+        finally: QApplication.restoreOverrideCursor()
+    def build_search_acceleration_action(self):
+        db_params = self.get_db_params()
+        if not db_params or not self.db_profile or (self.search_accel_thread and self.search_accel_thread.isRunning()): return
+        if QMessageBox.question(self, '确认建立', f"将在 {self.db_profile.get_search_acceleration_schema()} 中建立去重小表，并为检索列建立 pg_trgm 索引。\n"
+                                "对大型事件表首次执行可能需要数分钟，确定吗?", QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No) == QMessageBox.StandardButton.No: return
+        self.sql_preview_display.clear(); self.status_group.setVisible(True); self.progress_bar.setRange(0, 0)
+        self.search_accel_worker = SearchAccelerationWorker(db_params, self.db_profile)
+        self.search_accel_thread = QThread(); self.search_accel_worker.moveToThread(self.search_accel_thread)
+        self.search_accel_thread.started.connect(self.search_accel_worker.run)
+        self.search_accel_worker.progress.connect(self.update_progress); self.search_accel_worker.log.connect(self.sql_preview_display.append)
+        self.search_accel_worker.finished.connect(lambda ok, failed: QMessageBox.information(self, "检索加速", f"完成 {ok} 步，跳过 {failed} 步 (详见日志)。"))
+        self.search_accel_worker.error.connect(lambda message: QMessageBox.critical(self, "检索加速", message))
+        self.search_accel_worker.finished.connect(self.reset_search_accel_state); self.search_accel_worker.error.connect(self.reset_search_accel_state)
+        self.search_accel_thread.finished.connect(self.search_accel_worker.deleteLater); self.search_accel_thread.finished.connect(self.search_accel_thread.deleteLater)
+        self.search_accel_thread.start(); self.update_button_states()
+    @Slot()
+    def reset_search_accel_state(self):
+        if self.search_accel_thread: self.search_accel_thread.quit(); self.search_accel_thread.wait()
+        self.search_accel_thread = None; self.search_accel_worker = None; self.update_button_states()
     def cancel_action(self):
         if self.cohort_worker: self.cohort_worker.cancel()
     @Slot(str, int)
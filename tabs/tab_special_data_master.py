@@ -4,7 +4,7 @@ from PySide6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QPushButton,
                           QTextEdit, QComboBox, QGroupBox,
                           QRadioButton, QButtonGroup, QStackedWidget,
                           QLineEdit, QProgressBar, QAbstractItemView, QApplication,
-                          QScrollArea,QSizePolicy,QFileDialog)
+                          QScrollArea,QSizePolicy,QFileDialog,QSpinBox,QCheckBox,QDoubleSpinBox)
 from PySide6.QtCore import Qt, Signal, Slot, QObject, QThread, QTimer
 from typing import Optional, Dict, Any
 
@@ -15,11 +15,24 @@ import time
 import traceback
 import numpy as np
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from ui_components.base_panel import BaseSourceConfigPanel
-from sql_logic.sql_builder_special import build_special_data_sql
+from sql_logic.sql_builder_special import (build_special_data_sql_memoized, build_batch_pivot_sql,
+                                          MERGE_STRATEGY_UPDATE, MERGE_STRATEGY_REBUILD, MERGE_STRATEGY_NARROW,
+                                          PARTITIONED_EXECUTION_SIGNAL, estimate_special_data_cost,
+                                          order_batch_groups_by_cost)
+from sql_logic.cost_estimator import format_cost_summary, classify_cost, COST_LEVEL_OK, COST_LEVEL_WARN, COST_LEVEL_BLOCK
 from utils import sanitize_name_part, validate_column_name
-from app_config import SQL_BUILDER_DUMMY_DB_FOR_AS_STRING
+from sql_logic.sampling import get_relation_estimate
+from sql_logic.sql_renderer import render_sql
+from sql_logic.numeric_shadow import find_prepared_numeric_shadows
+from sql_logic.narrow_store import is_narrow_store_relation, get_wide_view_name
+from sql_logic.series_arrays import register_numpy_array_casters
+from app_config import (PREVIEW_SAMPLING_METHOD, PREVIEW_SAMPLING_SEED,
+                        MAX_MERGE_PARTITIONS, MERGE_COST_WARN_THRESHOLD, MERGE_COST_BLOCK_THRESHOLD,
+                        PANEL_CONFIG_DEBOUNCE_MS)
 from db_profiles.base_profile import BaseDbProfile
 
 class MergeSQLWorker(QObject):
@@ -41,6 +54,46 @@ class MergeSQLWorker(QObject):
         self.log.emit("合并操作被请求取消...")
         self.is_cancelled = True
 
+    @staticmethod
+    def _describe_step(sql_text):
+        step_description_peek = sql_text[:200].upper()
+        if "RENAME TO" in step_description_peek: return " (SWAP TABLE)"
+        if "CREATE UNLOGGED TABLE" in step_description_peek: return " (CREATE STAGING)"
+        if step_description_peek.startswith("INSERT INTO"): return " (PARTITION INSERT)"
+        if "ALTER TABLE" in step_description_peek: return " (ALTER)"
+        if "CREATE TEMPORARY TABLE" in step_description_peek: return " (CREATE TEMP)"
+        if "MATERIALIZED VIEW" in step_description_peek: return " (MATERIALIZED VIEW)"
+        if "CREATE TABLE" in step_description_peek and "__F__" in step_description_peek: return " (FEATURE TABLE)"
+        if "CREATE TABLE" in step_description_peek: return " (REBUILD TABLE)"
+        if "CREATE INDEX" in step_description_peek: return " (CREATE INDEX)"
+        if step_description_peek.startswith("ANALYZE"): return " (ANALYZE)"
+        if step_description_peek.startswith("DO "): return " (REFRESH WIDE VIEW)"
+        if "UPDATE" in step_description_peek: return " (UPDATE)"
+        if "DROP TABLE" in step_description_peek: return " (DROP TEMP)"
+        return ""
+
+    def _mogrify_for_log(self, conn, cur, sql_obj_or_str, params_for_step):
+        try:
+            return cur.mogrify(sql_obj_or_str, params_for_step if params_for_step else None).decode(conn.encoding or 'utf-8', 'replace')
+        except Exception as e_mogrify:
+            self.log.emit(f"DEBUG: Error mogrifying SQL: {e_mogrify}")
+            return f"-- Mogrify failed --\nTemplate: {sql_obj_or_str}\nParams: {params_for_step}"
+
+    def _execute_step(self, conn, cur, sql_obj_or_str, params_for_step, current_step_num, total_actual_steps):
+        self.current_sql_for_debug = self._mogrify_for_log(conn, cur, sql_obj_or_str, params_for_step)
+        step_title = f"--- [执行SQL {current_step_num}/{total_actual_steps}]{self._describe_step(self.current_sql_for_debug)} ---"
+        self.log.emit(step_title)
+        self.log.emit(self.current_sql_for_debug)
+
+        if self.is_cancelled: raise InterruptedError("操作在执行步骤前被取消。")
+
+        start_time = time.time()
+        cur.execute(sql_obj_or_str, params_for_step if params_for_step else None)
+        end_time = time.time()
+
+        self.log.emit(f"步骤 {current_step_num} 执行成功 (耗时: {end_time - start_time:.2f} 秒)。")
+        self.progress.emit(current_step_num, total_actual_steps)
+
     def run(self):
         conn_merge = None
         total_actual_steps = len(self.execution_steps)
@@ -53,34 +106,9 @@ class MergeSQLWorker(QObject):
             conn_merge.autocommit = False
             cur = conn_merge.cursor()
             self.log.emit("数据库已连接。")
-            for i, (sql_obj_or_str, params_for_step) in enumerate(self.execution_steps):
+            for sql_obj_or_str, params_for_step in self.execution_steps:
                 current_step_num += 1
-                step_description_short = ""
-                
-                try: 
-                    self.current_sql_for_debug = cur.mogrify(sql_obj_or_str, params_for_step if params_for_step else None).decode(conn_merge.encoding or 'utf-8', 'replace')
-                except Exception as e_mogrify:
-                    self.log.emit(f"DEBUG: Error mogrifying SQL: {e_mogrify}")
-                    self.current_sql_for_debug = f"-- Mogrify failed --\nTemplate: {sql_obj_or_str}\nParams: {params_for_step}"
-
-                step_description_peek = self.current_sql_for_debug[:200].upper()
-                if "ALTER TABLE" in step_description_peek: step_description_short = " (ALTER)"
-                elif "CREATE TEMPORARY TABLE" in step_description_peek: step_description_short = " (CREATE TEMP)"
-                elif "UPDATE" in step_description_peek: step_description_short = " (UPDATE)"
-                elif "DROP TABLE" in step_description_peek: step_description_short = " (DROP TEMP)"
-                
-                step_title = f"--- [执行SQL {current_step_num}/{total_actual_steps}]{step_description_short} ---"
-                self.log.emit(step_title)
-                self.log.emit(self.current_sql_for_debug)
-
-                if self.is_cancelled: raise InterruptedError("操作在执行步骤前被取消。")
-                
-                start_time = time.time()
-                cur.execute(sql_obj_or_str, params_for_step if params_for_step else None)
-                end_time = time.time()
-                
-                self.log.emit(f"步骤 {current_step_num} 执行成功 (耗时: {end_time - start_time:.2f} 秒)。")
-                self.progress.emit(current_step_num, total_actual_steps)
+                self._execute_step(conn_merge, cur, sql_obj_or_str, params_for_step, current_step_num, total_actual_steps)
 
             if self.is_cancelled: raise InterruptedError("操作在提交前被取消，正在回滚...")
             self.log.emit("所有数据库步骤完成，正在提交事务...")
@@ -110,6 +138,144 @@ class MergeSQLWorker(QObject):
                 self.log.emit("关闭数据库连接。")
                 conn_merge.close()
 
+
+class PartitionedMergeSQLWorker(MergeSQLWorker):
+    """
+    分区并行合并。每个执行计划 (见 sql_builder_special._build_partitioned_execution_plan) 分三个阶段：
+    1. prepare_steps 在主连接上执行并立即提交 (创建 UNLOGGED 中间表，其他连接才能看到)；
+    2. partition_steps 由线程池在各自独立的连接上并发执行，每完成一个分区报告一次进度；
+    3. finalize_steps 在主连接的单个事务中执行 UPDATE/重建，并删除中间表。
+    取消时对所有活动连接发送 pg_cancel。失败或取消时删除残留的中间表。
+    """
+
+    def __init__(self, db_params, execution_plans, target_table_name, new_cols_description_str, max_workers):
+        super().__init__(db_params, [], target_table_name, new_cols_description_str)
+        self.execution_plans = execution_plans
+        self.max_workers = max(1, int(max_workers))
+        self._active_conns = set()
+        self._conn_lock = threading.Lock()
+
+    def cancel(self):
+        super().cancel()
+        with self._conn_lock:
+            active_conns = list(self._active_conns)
+        for conn in active_conns:
+            try:
+                conn.cancel()
+            except psycopg2.Error:
+                pass
+
+    def _register_conn(self, conn, active=True):
+        with self._conn_lock:
+            if active: self._active_conns.add(conn)
+            else: self._active_conns.discard(conn)
+
+    def _run_partition(self, sql_obj, params):
+        if self.is_cancelled: raise InterruptedError("操作在分区执行前被取消。")
+        conn = psycopg2.connect(**self.db_params)
+        self._register_conn(conn)
+        try:
+            start_time = time.time()
+            with conn.cursor() as cur:
+                cur.execute(sql_obj, params if params else None)
+            conn.commit()
+            return time.time() - start_time
+        finally:
+            self._register_conn(conn, active=False)
+            conn.close()
+
+    def _drop_staging_tables(self):
+        conn = None
+        try:
+            conn = psycopg2.connect(**self.db_params)
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                for plan in self.execution_plans:
+                    cur.execute(pgsql.SQL("DROP TABLE IF EXISTS {}").format(plan["staging_table"]))
+            self.log.emit("已清理分区中间表。")
+        except psycopg2.Error as e:
+            self.log.emit(f"清理分区中间表失败: {e}")
+        finally:
+            if conn: conn.close()
+
+    def run(self):
+        conn_merge = None
+        total_actual_steps = sum(len(p["prepare_steps"]) + len(p["partition_steps"]) + len(p["finalize_steps"]) for p in self.execution_plans)
+        current_step_num = 0
+        succeeded = False
+        self.log.emit(f"开始为表 '{self.target_table_name}' 分区并行添加/更新列 (基于: {self.new_cols_description_str})，"
+                      f"并发连接数 {self.max_workers}，共 {total_actual_steps} 个数据库步骤...")
+        self.progress.emit(current_step_num, total_actual_steps)
+        try:
+            self.log.emit("连接数据库...")
+            conn_merge = psycopg2.connect(**self.db_params)
+            conn_merge.autocommit = False
+            self._register_conn(conn_merge)
+            cur = conn_merge.cursor()
+            self.log.emit("数据库已连接。")
+
+            for plan in self.execution_plans:
+                for sql_obj, params in plan["prepare_steps"]:
+                    current_step_num += 1
+                    self._execute_step(conn_merge, cur, sql_obj, params, current_step_num, total_actual_steps)
+                conn_merge.commit()
+
+                partition_steps = plan["partition_steps"]
+                if partition_steps:
+                    self.current_sql_for_debug = self._mogrify_for_log(conn_merge, cur, *partition_steps[0])
+                    self.log.emit(f"--- [并行执行 {len(partition_steps)} 个分区] (PARTITION INSERT) ---")
+                    self.log.emit(self.current_sql_for_debug)
+                with ThreadPoolExecutor(max_workers=min(self.max_workers, len(partition_steps) or 1)) as executor:
+                    futures = {executor.submit(self._run_partition, sql_obj, params): idx for idx, (sql_obj, params) in enumerate(partition_steps)}
+                    try:
+                        for future in as_completed(futures):
+                            elapsed = future.result()
+                            current_step_num += 1
+                            self.log.emit(f"分区 {futures[future] + 1}/{len(partition_steps)} 完成 (耗时: {elapsed:.2f} 秒)。")
+                            self.progress.emit(current_step_num, total_actual_steps)
+                    except BaseException:
+                        # 任一分区失败时取消其余分区，避免继续占用连接
+                        for f in futures: f.cancel()
+                        self.cancel()
+                        raise
+
+                for sql_obj, params in plan["finalize_steps"]:
+                    current_step_num += 1
+                    self._execute_step(conn_merge, cur, sql_obj, params, current_step_num, total_actual_steps)
+
+            if self.is_cancelled: raise InterruptedError("操作在提交前被取消，正在回滚...")
+            self.log.emit("所有数据库步骤完成，正在提交事务...")
+            start_commit_time = time.time()
+            conn_merge.commit()
+            self.log.emit(f"事务提交成功 (耗时: {time.time() - start_commit_time:.2f} 秒)。")
+            succeeded = True
+            self.finished.emit()
+        except (InterruptedError, psycopg2.extensions.QueryCanceledError) as ie:
+            if conn_merge and not conn_merge.closed: conn_merge.rollback()
+            self.log.emit(f"操作已取消: {str(ie)}")
+            self.error.emit("操作已取消")
+        except psycopg2.Error as db_err:
+            if conn_merge and not conn_merge.closed: conn_merge.rollback()
+            err_msg = f"数据库错误: {db_err}\n相关SQL (完整): {self.current_sql_for_debug}"
+            self.log.emit(err_msg)
+            self.log.emit(f"Traceback: {traceback.format_exc()}")
+            self.error.emit(err_msg)
+        except Exception as e:
+            if conn_merge and not conn_merge.closed: conn_merge.rollback()
+            err_msg = f"发生意外错误: {e}\n相关SQL (完整): {self.current_sql_for_debug}"
+            self.log.emit(err_msg)
+            self.log.emit(f"Traceback: {traceback.format_exc()}")
+            self.error.emit(err_msg)
+        finally:
+            if conn_merge:
+                self._register_conn(conn_merge, active=False)
+                if not conn_merge.closed:
+                    self.log.emit("关闭数据库连接。")
+                    conn_merge.close()
+            if not succeeded:
+                self._drop_staging_tables()
+
+
 class SpecialDataMasterTab(QWidget):
     request_preview_signal = Signal(str, str)
 
@@ -124,6 +290,15 @@ class SpecialDataMasterTab(QWidget):
         self.merge_worker = None
         self.config_panels: Dict[int, BaseSourceConfigPanel] = {}
         self.user_manually_edited_col_name = False
+        self.batch_queue = [] # [(新列基础名, panel_config), ...]，同一事件表的项将合并为一次扫描
+        self.is_batch_running = False
+        self.is_shadow_preparation_running = False
+        self.prepared_numeric_shadows = set() # 数值影子表已准备好的源事件表
+        # 面板配置变更防抖：间隔内的连续修改只触发一次列名与按钮状态刷新
+        self._config_change_timer = QTimer(self)
+        self._config_change_timer.setSingleShot(True)
+        self._config_change_timer.setInterval(PANEL_CONFIG_DEBOUNCE_MS)
+        self._config_change_timer.timeout.connect(self._apply_panel_config_change)
         self.init_ui()
 
     def init_ui(self):
@@ -137,6 +312,11 @@ class SpecialDataMasterTab(QWidget):
         
         toolbar_layout.addWidget(self.save_config_btn)
         toolbar_layout.addWidget(self.load_config_btn)
+        self.prepare_shadow_btn = QPushButton("准备数值影子表")
+        self.prepare_shadow_btn.setToolTip("为数值存放在文本列中的事件表建立带索引的物化视图 (一次性操作)，之后的提取直接读取已解析的数值。")
+        self.prepare_shadow_btn.clicked.connect(self.prepare_numeric_shadows)
+        self.prepare_shadow_btn.setVisible(False)
+        toolbar_layout.addWidget(self.prepare_shadow_btn)
         toolbar_layout.addStretch()
         main_layout.addLayout(toolbar_layout)
 
@@ -187,7 +367,54 @@ class SpecialDataMasterTab(QWidget):
         self.new_column_name_input.textEdited.connect(self._on_new_column_name_manually_edited)
         self.new_column_name_input.editingFinished.connect(self.update_master_action_buttons_state)
         column_name_layout.addWidget(self.new_column_name_input, 1)
+        column_name_layout.addWidget(QLabel("写入方式:"))
+        self.merge_strategy_combo = QComboBox()
+        self.merge_strategy_combo.addItem("原地更新 (ALTER + UPDATE)", MERGE_STRATEGY_UPDATE)
+        self.merge_strategy_combo.addItem("重建表 (新表写入 + 替换)", MERGE_STRATEGY_REBUILD)
+        self.merge_strategy_combo.addItem("窄表存储 (特征表 + 宽视图)", MERGE_STRATEGY_NARROW)
+        self.merge_strategy_combo.setToolTip("重建表：一次性生成包含新列的新表并原子替换原表，避免 UPDATE 产生大量死元组。\n"
+                                             "原表的约束 (含主键)、索引与 UNLOGGED 属性按原定义重建；视图依赖与权限不会保留。\n"
+                                             "窄表存储：结果写入独立的 <队列表>__f__<列名> 特征表，不修改队列表，也不受 1600 列上限约束；\n"
+                                             "通过 <队列表>__wide 视图呈现宽表，数据导出与绘图页面会自动读取该视图。")
+        column_name_layout.addWidget(self.merge_strategy_combo)
+        column_name_layout.addWidget(QLabel("并行分区:"))
+        self.partition_count_spin = QSpinBox()
+        self.partition_count_spin.setRange(1, MAX_MERGE_PARTITIONS)
+        self.partition_count_spin.setValue(1)
+        self.partition_count_spin.setToolTip("大于 1 时按连接键哈希将队列拆分为 N 个分区，使用 N 个数据库连接并发计算后统一写回。\n"
+                                             "1 表示在单个连接上执行 (默认)。")
+        column_name_layout.addWidget(self.partition_count_spin)
+        self.feature_cache_checkbox = QCheckBox("使用特征缓存")
+        self.feature_cache_checkbox.setToolTip("将提取结果按配置哈希保存到特征缓存 schema 中，再次提取相同特征时只计算缓存中缺失的键。\n"
+                                               "源表数据变化时缓存自动失效。启用后忽略并行分区设置，批量模式不使用缓存。")
+        column_name_layout.addWidget(self.feature_cache_checkbox)
+        self.incremental_checkbox = QCheckBox("增量模式")
+        self.incremental_checkbox.setToolTip("只计算目标列仍为 NULL、或尚未按当前配置记录为已计算的队列行，适用于队列表追加新行后的补算；修改配置后会重新计算全部行。\n"
+                                             "已计算的键记录在 <队列表>__computed 标记表中；增量模式始终使用原地更新写回，不能与窄表存储同时使用。")
+        column_name_layout.addWidget(self.incremental_checkbox)
         content_layout.addWidget(column_name_group)
+
+        self.time_window_spec_group = QGroupBox("自定义相对时间窗口 / 分箱时间序列 (可选)")
+        self.time_window_spec_group.setCheckable(True)
+        self.time_window_spec_group.setChecked(False)
+        self.time_window_spec_group.setToolTip("启用后以 [锚点 + 起始偏移, 锚点 + 结束偏移) 代替面板中的时间窗口选项。\n"
+                                               "分箱宽度大于 0 时按时间箱逐箱聚合，结果以长表格式写入 <队列表>__binned，不修改队列表；\n"
+                                               "分箱输出不使用并行分区、特征缓存与增量模式，也不能加入批量队列。")
+        time_window_spec_layout = QHBoxLayout(self.time_window_spec_group)
+        time_window_spec_layout.addWidget(QLabel("锚点:"))
+        self.time_anchor_combo = QComboBox()
+        time_window_spec_layout.addWidget(self.time_anchor_combo)
+        time_window_spec_layout.addWidget(QLabel("起始 (小时):"))
+        self.window_start_spin = QDoubleSpinBox(); self.window_start_spin.setRange(-8760, 8760); self.window_start_spin.setValue(0)
+        time_window_spec_layout.addWidget(self.window_start_spin)
+        time_window_spec_layout.addWidget(QLabel("结束 (小时):"))
+        self.window_end_spin = QDoubleSpinBox(); self.window_end_spin.setRange(-8760, 8760); self.window_end_spin.setValue(72)
+        time_window_spec_layout.addWidget(self.window_end_spin)
+        time_window_spec_layout.addWidget(QLabel("分箱宽度 (小时, 0 为不分箱):"))
+        self.bin_width_spin = QDoubleSpinBox(); self.bin_width_spin.setRange(0, 8760); self.bin_width_spin.setValue(1)
+        time_window_spec_layout.addWidget(self.bin_width_spin)
+        time_window_spec_layout.addStretch()
+        content_layout.addWidget(self.time_window_spec_group)
         
         self.execution_status_group = QGroupBox("合并执行状态")
         execution_status_layout = QVBoxLayout(self.execution_status_group)
@@ -206,6 +433,19 @@ class SpecialDataMasterTab(QWidget):
         self.cancel_merge_btn = QPushButton("取消合并"); self.cancel_merge_btn.clicked.connect(self.cancel_merge); self.cancel_merge_btn.setEnabled(False)
         action_layout.addWidget(self.cancel_merge_btn)
         content_layout.addLayout(action_layout)
+
+        batch_layout = QHBoxLayout()
+        self.add_to_batch_btn = QPushButton("加入批量队列"); self.add_to_batch_btn.clicked.connect(self.add_current_to_batch); self.add_to_batch_btn.setEnabled(False)
+        self.add_to_batch_btn.setToolTip("将当前配置加入队列。执行时，针对同一事件表的多个提取项只扫描一次事件表。")
+        batch_layout.addWidget(self.add_to_batch_btn)
+        self.execute_batch_btn = QPushButton("执行批量合并"); self.execute_batch_btn.clicked.connect(self.execute_batch_merge); self.execute_batch_btn.setEnabled(False)
+        batch_layout.addWidget(self.execute_batch_btn)
+        self.clear_batch_btn = QPushButton("清空队列"); self.clear_batch_btn.clicked.connect(self.clear_batch_queue); self.clear_batch_btn.setEnabled(False)
+        batch_layout.addWidget(self.clear_batch_btn)
+        self.batch_status_label = QLabel("批量队列: 0 项")
+        batch_layout.addWidget(self.batch_status_label)
+        batch_layout.addStretch()
+        content_layout.addLayout(batch_layout)
         
         content_layout.addWidget(QLabel("SQL预览 (仅供参考):"))
         self.sql_preview = QTextEdit(); self.sql_preview.setReadOnly(True)
@@ -222,8 +462,13 @@ class SpecialDataMasterTab(QWidget):
 
     def on_profile_changed(self):
         self.db_profile = self.get_db_profile()
+        self.prepare_shadow_btn.setVisible(bool(self.db_profile and self.db_profile.get_numeric_shadow_tables()))
         self.refresh_cohort_tables()
 
+        self.time_anchor_combo.clear()
+        for anchor_text, anchor_col in (self.db_profile.get_time_window_anchors() if self.db_profile else []):
+            self.time_anchor_combo.addItem(anchor_text, anchor_col)
+
         for i in reversed(range(self.source_radio_buttons_layout.count())): 
             widget = self.source_radio_buttons_layout.itemAt(i).widget()
             if widget:
@@ -278,8 +523,18 @@ class SpecialDataMasterTab(QWidget):
     @Slot()
     def _on_panel_config_changed(self):
         self.user_manually_edited_col_name = False
-        QTimer.singleShot(0, lambda: self._generate_and_set_default_col_name(force_update=False))
-        QTimer.singleShot(0, self.update_master_action_buttons_state)
+        self._config_change_timer.start()
+
+    @Slot()
+    def _apply_panel_config_change(self):
+        self._generate_and_set_default_col_name(force_update=False)
+        self.update_master_action_buttons_state()
+
+    def _flush_pending_config_change(self):
+        """预览、执行等操作前立即应用尚在防抖等待中的配置变更，避免使用过期的列名。"""
+        if self._config_change_timer.isActive():
+            self._config_change_timer.stop()
+            self._apply_panel_config_change()
 
     @Slot()
     def _on_new_column_name_manually_edited(self):
@@ -340,7 +595,34 @@ class SpecialDataMasterTab(QWidget):
         panel_config = active_panel.get_panel_config()
         return bool(panel_config)
 
-    def _build_merge_query(self, preview_limit=100, for_execution=False, active_db_params=None):
+    def _get_time_window_spec(self) -> Optional[Dict[str, Any]]:
+        """返回界面上的参数化相对时间窗口；未启用时返回 None。"""
+        if not self.time_window_spec_group.isChecked():
+            return None
+        return {
+            "anchor": self.time_anchor_combo.currentData(),
+            "start_hours": self.window_start_spin.value(),
+            "end_hours": self.window_end_spin.value(),
+            "bin_hours": self.bin_width_spin.value(),
+        }
+
+    def _is_binned_output(self) -> bool:
+        spec = self._get_time_window_spec()
+        return bool(spec and spec["bin_hours"] > 0)
+
+    def _get_effective_panel_config(self, panel) -> Optional[Dict[str, Any]]:
+        """返回面板配置；启用自定义相对时间窗口时附加 time_window_spec，事件表的数值影子表已准备时附加 use_numeric_shadow。"""
+        panel_config = panel.get_panel_config() if panel else None
+        if not panel_config:
+            return panel_config
+        spec = self._get_time_window_spec()
+        if spec and panel_config.get("panel_type") != "merge_preprocessed":
+            panel_config = {**panel_config, "time_window_spec": spec}
+        if panel_config.get("source_event_table") in self.prepared_numeric_shadows:
+            panel_config = {**panel_config, "use_numeric_shadow": True}
+        return panel_config
+
+    def _build_merge_query(self, preview_limit=100, for_execution=False, active_db_params=None, preview_sampling=None):
         if not self.selected_cohort_table:
             return None, "未选择目标队列数据表.", [], []
         base_new_col_name = self.new_column_name_input.text().strip()
@@ -352,19 +634,24 @@ class SpecialDataMasterTab(QWidget):
         if not active_panel:
             return None, "未选择有效的数据来源面板。", [], []
             
-        panel_config_dict = active_panel.get_panel_config()
+        panel_config_dict = self._get_effective_panel_config(active_panel)
         if not panel_config_dict:
             return None, f"来自 {active_panel.get_friendly_source_name()} 的配置不完整或无效。", [], []
         
         try:
-            return build_special_data_sql(
+            return build_special_data_sql_memoized(
                 target_cohort_table_name=f"{self.db_profile.get_cohort_table_schema()}.{self.selected_cohort_table}",
                 base_new_column_name=base_new_col_name,
                 panel_specific_config=panel_config_dict,
                 db_profile=self.db_profile,
                 active_db_params=active_db_params,
                 for_execution=for_execution,
-                preview_limit=preview_limit
+                preview_limit=preview_limit,
+                merge_strategy=self.merge_strategy_combo.currentData(),
+                preview_sampling=preview_sampling,
+                partition_count=self.partition_count_spin.value() if for_execution else 1,
+                use_feature_cache=for_execution and self.feature_cache_checkbox.isChecked(),
+                incremental=for_execution and self.incremental_checkbox.isChecked()
             )
         except Exception as e:
             return None, f"构建SQL时发生内部错误: {e}\n{traceback.format_exc()}", [], []
@@ -385,6 +672,12 @@ class SpecialDataMasterTab(QWidget):
         if active_panel: active_panel.setEnabled(is_enabled)
         
         self.new_column_name_input.setEnabled(is_enabled)
+        self.merge_strategy_combo.setEnabled(is_enabled)
+        self.partition_count_spin.setEnabled(is_enabled)
+        self.feature_cache_checkbox.setEnabled(is_enabled)
+        self.incremental_checkbox.setEnabled(is_enabled)
+        self.prepare_shadow_btn.setEnabled(is_enabled)
+        self.time_window_spec_group.setEnabled(is_enabled)
         self.cancel_merge_btn.setEnabled(starting)
         
         if not starting:
@@ -392,6 +685,9 @@ class SpecialDataMasterTab(QWidget):
         else:
             self.preview_merge_btn.setEnabled(False)
             self.execute_merge_btn.setEnabled(False)
+            self.add_to_batch_btn.setEnabled(False)
+            self.execute_batch_btn.setEnabled(False)
+            self.clear_batch_btn.setEnabled(False)
 
     def update_execution_progress(self, value, max_value=None):
         if max_value is not None and self.execution_progress.maximum() != max_value:
@@ -424,7 +720,8 @@ class SpecialDataMasterTab(QWidget):
                 conn = psycopg2.connect(**db_params)
                 cur = conn.cursor()
                 cur.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = %s ORDER BY table_name", (cohort_schema,))
-                tables = [r[0] for r in cur.fetchall()]
+                tables = [r[0] for r in cur.fetchall() if not is_narrow_store_relation(r[0])]
+                self.prepared_numeric_shadows = find_prepared_numeric_shadows(cur, self.db_profile.get_numeric_shadow_tables())
                 if tables:
                     self.table_combo.addItems(tables)
                     idx = self.table_combo.findText(current_sel_text)
@@ -453,6 +750,9 @@ class SpecialDataMasterTab(QWidget):
         is_valid_for_action = self._are_configs_valid_for_action()
         self.preview_merge_btn.setEnabled(is_valid_for_action)
         self.execute_merge_btn.setEnabled(is_valid_for_action)
+        self.add_to_batch_btn.setEnabled(is_valid_for_action)
+        self.execute_batch_btn.setEnabled(bool(self.batch_queue) and bool(self.selected_cohort_table))
+        self.clear_batch_btn.setEnabled(bool(self.batch_queue))
         
         active_panel = self.config_panels.get(self.source_selection_group.checkedId())
         if active_panel:
@@ -461,6 +761,7 @@ class SpecialDataMasterTab(QWidget):
             active_panel.update_panel_action_buttons_state(db_connected and cohort_table_selected)
 
     def execute_merge(self):
+        self._flush_pending_config_change()
         if not self._are_configs_valid_for_action():
             QMessageBox.warning(self, "配置不完整", "请确保所有必要的选项已选择或填写，并且基础列名有效。")
             return
@@ -471,13 +772,28 @@ class SpecialDataMasterTab(QWidget):
             return
             
         execution_steps, signal_type, new_cols_desc, col_details = build_result
-        if signal_type != "execution_list":
+        if signal_type not in ("execution_list", PARTITIONED_EXECUTION_SIGNAL):
             QMessageBox.critical(self, "合并准备失败", f"无法构建SQL: {signal_type if isinstance(signal_type, str) else '未知构建错误'}")
             return
             
-        col_preview_msg = f"确定要向表 '{self.selected_cohort_table}' 中添加/更新以下列吗？\n" + \
-                           "\n".join([f" - {name} (类型: {type_str})" for name, type_str in col_details]) + \
-                           "\n\n此操作将直接修改数据库表。"
+        active_panel = self.config_panels.get(self.source_selection_group.checkedId())
+        event_table = (active_panel.get_panel_config() or {}).get("source_event_table") if active_panel else None
+        if event_table in self.prepared_numeric_shadows:
+            event_table = self.db_profile.get_numeric_shadow_tables()[event_table]["relation"]
+        allowed, cost_summary = self._check_cost_guardrail(self._estimate_current_merge_cost(db_params), event_table)
+        if not allowed:
+            return
+
+        if self._is_binned_output():
+            col_preview_msg = f"确定要将以下分箱统计量写入长表 '{self.selected_cohort_table}__binned' 吗？\n" + \
+                               "\n".join([f" - {name}" for name, _ in col_details]) + \
+                               f"\n\n执行代价估计:\n{cost_summary}" + \
+                               f"\n\n长表中已有的 '{new_cols_desc}' 分箱结果将被替换，队列表本身不会被修改。"
+        else:
+            col_preview_msg = f"确定要向表 '{self.selected_cohort_table}' 中添加/更新以下列吗？\n" + \
+                               "\n".join([f" - {name} (类型: {type_str})" for name, type_str in col_details]) + \
+                               f"\n\n执行代价估计 (按完整计算):\n{cost_summary}" + \
+                               "\n\n此操作将直接修改数据库表。"
         if QMessageBox.question(self, '确认操作', col_preview_msg, QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No) == QMessageBox.StandardButton.No:
             return
             
@@ -495,8 +811,18 @@ class SpecialDataMasterTab(QWidget):
             QMessageBox.critical(self, "合并失败", "无法获取数据库连接参数。")
             return
             
+        if signal_type == PARTITIONED_EXECUTION_SIGNAL:
+            execution_steps = [execution_steps]
+        self._start_merge_worker(db_params, execution_steps, new_cols_desc, signal_type)
+
+    def _start_merge_worker(self, db_params, execution_steps, new_cols_desc, signal_type="execution_list"):
         self.prepare_for_long_operation(True)
-        self.merge_worker = MergeSQLWorker(db_params, execution_steps, self.selected_cohort_table, new_cols_desc)
+        if signal_type == PARTITIONED_EXECUTION_SIGNAL:
+            # execution_steps 为分区执行计划列表
+            self.merge_worker = PartitionedMergeSQLWorker(db_params, execution_steps, self.selected_cohort_table, new_cols_desc,
+                                                          max_workers=self.partition_count_spin.value())
+        else:
+            self.merge_worker = MergeSQLWorker(db_params, execution_steps, self.selected_cohort_table, new_cols_desc)
         self.worker_thread = QThread()
         self.merge_worker.moveToThread(self.worker_thread)
         self.worker_thread.started.connect(self.merge_worker.run)
@@ -510,7 +836,168 @@ class SpecialDataMasterTab(QWidget):
         self.worker_thread.finished.connect(lambda: setattr(self, 'merge_worker', None))
         self.worker_thread.start()
 
+    def add_current_to_batch(self):
+        self._flush_pending_config_change()
+        if not self._are_configs_valid_for_action():
+            QMessageBox.warning(self, "配置不完整", "请确保所有必要的选项已选择或填写，并且基础列名有效。")
+            return
+        active_panel = self.config_panels.get(self.source_selection_group.checkedId())
+        panel_config = self._get_effective_panel_config(active_panel)
+        if panel_config.get("panel_type") == "merge_preprocessed":
+            QMessageBox.warning(self, "不支持", "预处理表合并不支持批量模式，请直接执行合并。")
+            return
+        if self._is_binned_output():
+            QMessageBox.warning(self, "不支持", "分箱时间序列输出不支持批量模式，请直接执行合并。")
+            return
+        base_name = self.new_column_name_input.text().strip()
+        if any(name == base_name for name, _ in self.batch_queue):
+            QMessageBox.warning(self, "名称重复", f"批量队列中已存在基础列名 '{base_name}'。")
+            return
+        self.batch_queue.append((base_name, panel_config))
+        self._update_batch_status()
+
+    def clear_batch_queue(self):
+        self.batch_queue.clear()
+        self._update_batch_status()
+
+    def _update_batch_status(self):
+        tables = {cfg.get("source_event_table") for _, cfg in self.batch_queue}
+        self.batch_status_label.setText(f"批量队列: {len(self.batch_queue)} 项 ({len(tables)} 个事件表)" if self.batch_queue else "批量队列: 0 项")
+        self.update_master_action_buttons_state()
+
+    def _group_batch_queue(self):
+        """将队列按事件表 (及队列关联方式) 分组，每组对应一次扫描的批量透视任务。"""
+        groups: Dict[Any, list] = {}
+        for base_name, cfg in self.batch_queue:
+            group_key = (cfg.get("source_event_table"), str(cfg.get("cte_join_on_cohort_override") or ""))
+            groups.setdefault(group_key, []).append((base_name, cfg))
+        return list(groups.values())
+
+    def _build_batch_execution_steps(self, feature_config_groups):
+        """
+        为每组生成批量透视 SQL，并按给定的分组顺序拼接执行步骤。
+        分区并行模式下返回每组一个执行计划的列表。
+        """
+        target_table = f"{self.db_profile.get_cohort_table_schema()}.{self.selected_cohort_table}"
+        partition_count = self.partition_count_spin.value()
+        expected_signal = PARTITIONED_EXECUTION_SIGNAL if partition_count > 1 else "execution_list"
+        all_steps, all_col_details, descs = [], [], []
+        for feature_configs in feature_config_groups:
+            steps, signal_type, desc, col_details = build_batch_pivot_sql(
+                target_table, feature_configs, self.db_profile, for_execution=True,
+                merge_strategy=self.merge_strategy_combo.currentData(),
+                partition_count=partition_count
+            )
+            if signal_type != expected_signal:
+                return None, signal_type, None, []
+            if signal_type == PARTITIONED_EXECUTION_SIGNAL:
+                all_steps.append(steps)
+            else:
+                all_steps.extend(steps)
+            all_col_details.extend(col_details)
+            descs.append(desc)
+        return all_steps, expected_signal, "; ".join(descs), all_col_details
+
+    def _order_batch_groups_by_cost(self, db_params, feature_config_groups):
+        """
+        估计每组任务的代价并按从低到高排序，返回 (排序后的分组, 合计估计)。
+        无法连接或估计失败时保持原顺序，合计估计为 None。
+        """
+        target_table = f"{self.db_profile.get_cohort_table_schema()}.{self.selected_cohort_table}"
+        conn = None
+        try:
+            conn = psycopg2.connect(**db_params)
+            with conn.cursor() as cur:
+                ordered = order_batch_groups_by_cost(cur, target_table, feature_config_groups, self.db_profile)
+        except Exception:
+            return feature_config_groups, None
+        finally:
+            if conn: conn.close()
+
+        estimates = [est for est, _ in ordered if est]
+        total_estimate = None
+        if estimates and len(estimates) == len(ordered):
+            total_cost = sum(est["total_cost"] for est in estimates)
+            total_estimate = {
+                "total_cost": total_cost,
+                "plan_rows": sum(est["plan_rows"] for est in estimates),
+                "rows_scanned": sum(est["rows_scanned"] for est in estimates),
+                "scans": [scan for est in estimates for scan in est["scans"]],
+                "uses_index": all(est["uses_index"] for est in estimates),
+                "level": classify_cost(total_cost),
+            }
+        return [configs for _, configs in ordered], total_estimate
+
+    def _estimate_current_merge_cost(self, db_params):
+        """对当前配置的完整计算查询执行 EXPLAIN；估计失败时返回 None (不阻止执行)。"""
+        active_panel = self.config_panels.get(self.source_selection_group.checkedId())
+        panel_config = self._get_effective_panel_config(active_panel)
+        if not panel_config:
+            return None
+        conn = None
+        try:
+            conn = psycopg2.connect(**db_params)
+            with conn.cursor() as cur:
+                return estimate_special_data_cost(
+                    cur, f"{self.db_profile.get_cohort_table_schema()}.{self.selected_cohort_table}",
+                    self.new_column_name_input.text().strip(), panel_config, self.db_profile
+                )
+        except Exception:
+            return None
+        finally:
+            if conn: conn.close()
+
+    def _check_cost_guardrail(self, cost_estimate, event_table=None):
+        """
+        根据代价估计决定是否允许执行，返回 (是否允许, 供确认对话框使用的摘要文本)。
+        超过阻止阈值时直接拒绝；超过警告阈值时在摘要前加入警告。
+        """
+        summary = format_cost_summary(cost_estimate, event_table)
+        level = cost_estimate["level"] if cost_estimate else COST_LEVEL_OK
+        if level == COST_LEVEL_BLOCK:
+            QMessageBox.critical(self, "执行代价过高",
+                                 f"估计执行代价超过阻止阈值 ({MERGE_COST_BLOCK_THRESHOLD:,.0f})，已拒绝执行。\n"
+                                 f"请缩小时间窗口或项目范围，或为事件表建立合适的索引。\n\n{summary}")
+            return False, summary
+        if level == COST_LEVEL_WARN:
+            summary = f"[警告] 估计执行代价超过警告阈值 ({MERGE_COST_WARN_THRESHOLD:,.0f})，执行可能耗时很长。\n{summary}"
+        return True, summary
+
+    def execute_batch_merge(self):
+        if not self.batch_queue or not self.selected_cohort_table or not self.db_profile:
+            return
+        db_params = self.get_db_params()
+        if not db_params:
+            QMessageBox.critical(self, "合并失败", "无法获取数据库连接参数。")
+            return
+        try:
+            # 代价低的分组先执行，尽早完成较多的列
+            feature_config_groups, cost_estimate = self._order_batch_groups_by_cost(db_params, self._group_batch_queue())
+            execution_steps, signal_type, new_cols_desc, col_details = self._build_batch_execution_steps(feature_config_groups)
+        except Exception as e:
+            QMessageBox.critical(self, "合并准备失败", f"构建SQL时发生内部错误: {e}\n{traceback.format_exc()}")
+            return
+        if signal_type not in ("execution_list", PARTITIONED_EXECUTION_SIGNAL):
+            QMessageBox.critical(self, "合并准备失败", f"无法构建SQL: {signal_type}")
+            return
+        allowed, cost_summary = self._check_cost_guardrail(cost_estimate)
+        if not allowed:
+            return
+
+        msg = (f"确定要向表 '{self.selected_cohort_table}' 批量添加/更新 {len(col_details)} 列吗？\n"
+               f"{new_cols_desc}\n\n执行代价估计:\n{cost_summary}\n\n此操作将直接修改数据库表。")
+        if QMessageBox.question(self, '确认操作', msg, QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No) == QMessageBox.StandardButton.No:
+            return
+        self.sql_preview.setText(
+            f"-- PREPARED FOR BATCH EXECUTION --\n"
+            f"Target Table: {self.selected_cohort_table}\n"
+            f"Columns: {', '.join(name for name, _ in col_details)}"
+        )
+        self.is_batch_running = True
+        self._start_merge_worker(db_params, execution_steps, new_cols_desc, signal_type)
+
     def preview_merge_data(self):
+        self._flush_pending_config_change()
         if not self._are_configs_valid_for_action():
             QMessageBox.warning(self, "配置不完整", "请确保所有必要的选项已选择或填写以进行预览。")
             return
@@ -523,7 +1010,11 @@ class SpecialDataMasterTab(QWidget):
         conn = None
         try:
             conn = psycopg2.connect(**db_params)
-            preview_sql_obj, error_msg, params_for_cte, _ = self._build_merge_query(preview_limit=100, for_execution=False, active_db_params=db_params)
+            # 列式数组输出直接解析为 NumPy 数组
+            register_numpy_array_casters(conn)
+            preview_sampling = self._get_preview_sampling(conn)
+            preview_sql_obj, error_msg, params_for_cte, _ = self._build_merge_query(
+                preview_limit=100, for_execution=False, active_db_params=db_params, preview_sampling=preview_sampling)
 
             if error_msg:
                 QMessageBox.warning(self, "无法预览", error_msg)
@@ -566,21 +1057,23 @@ class SpecialDataMasterTab(QWidget):
         finally:
             if conn: conn.close()
             
-    def _get_readable_sql_with_conn(self, sql_obj, params, conn):
-        if conn and not conn.closed:
-            try:
-                return conn.cursor().mogrify(sql_obj, params).decode(conn.encoding or 'utf-8')
-            except Exception:
-                pass
-        
-        dummy_conn = None
+    def _get_preview_sampling(self, conn) -> Dict[str, Any]:
+        """基于 pg_class 统计信息为队列表选择采样参数 (不执行 COUNT(*))。"""
+        estimated_rows, relkind = None, None
         try:
-            dummy_conn = psycopg2.connect(SQL_BUILDER_DUMMY_DB_FOR_AS_STRING)
-            return dummy_conn.cursor().mogrify(sql_obj.as_string(dummy_conn), params).decode()
+            with conn.cursor() as cur:
+                estimated_rows, relkind = get_relation_estimate(cur, self.db_profile.get_cohort_table_schema(), self.selected_cohort_table)
+        except psycopg2.Error:
+            conn.rollback()
+        return {"method": PREVIEW_SAMPLING_METHOD, "seed": PREVIEW_SAMPLING_SEED,
+                "estimated_rows": estimated_rows, "relkind": relkind}
+
+    def _get_readable_sql(self, sql_obj, params):
+        """离线渲染可读的 SQL (不需要数据库连接)，仅用于显示。"""
+        try:
+            return render_sql(sql_obj, params if params else None)
         except Exception:
             return f"{str(sql_obj)}\n-- Params: {params}"
-        finally:
-            if dummy_conn: dummy_conn.close()
 
     def cancel_merge(self):
         if self.merge_worker:
@@ -588,13 +1081,55 @@ class SpecialDataMasterTab(QWidget):
             self.merge_worker.cancel()
             self.cancel_merge_btn.setEnabled(False)
 
+    def prepare_numeric_shadows(self):
+        """一次性建立当前数据库画像定义的所有数值影子表 (带索引的物化视图)。"""
+        db_params = self.get_db_params()
+        if not db_params or not self.db_profile:
+            QMessageBox.warning(self, "未连接", "请先连接数据库。")
+            return
+        shadow_tables = self.db_profile.get_numeric_shadow_tables()
+        if not shadow_tables:
+            return
+        table_lines = "\n".join(f" - {src} -> {d['relation']}" for src, d in shadow_tables.items())
+        reply = QMessageBox.question(self, "准备数值影子表",
+                                     f"将为以下事件表建立 (或重建) 数值影子表，需要完整扫描事件表，可能耗时较长：\n{table_lines}\n\n确定继续吗？",
+                                     QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No, QMessageBox.StandardButton.No)
+        if reply != QMessageBox.StandardButton.Yes:
+            return
+        self.is_shadow_preparation_running = True
+        self._start_merge_worker(db_params, self.db_profile.get_numeric_shadow_preparation_steps(), "数值影子表")
+
     @Slot()
     def on_merge_worker_finished_actions(self):
         desc = self.merge_worker.new_cols_description_str if self.merge_worker else ""
-        self.update_execution_log(f"成功向表 {self.selected_cohort_table} 添加/更新与 '{desc}' 相关的列。")
-        QMessageBox.information(self, "合并成功", 
-                                f"已成功向表 {self.selected_cohort_table} 添加/更新列。\n"
-                                "您可以前往“5. 数据预览与导出”页面刷新并查看更新后的数据表。")
+        if self.is_shadow_preparation_running:
+            self.is_shadow_preparation_running = False
+            self.update_execution_log("数值影子表准备完成，之后的提取将直接读取已解析的数值列。")
+            QMessageBox.information(self, "准备完成", "数值影子表已建立，之后的提取将直接读取已解析的数值列。")
+            self.prepare_for_long_operation(False)
+            self.refresh_cohort_tables()
+            return
+        if self._is_binned_output() and not self.is_batch_running:
+            self.update_execution_log(f"成功将 '{desc}' 的分箱结果写入长表 {self.selected_cohort_table}__binned。")
+            QMessageBox.information(self, "合并成功", f"已将 '{desc}' 的分箱结果写入长表 {self.selected_cohort_table}__binned。")
+            self.prepare_for_long_operation(False)
+            return
+        active_panel = self.config_panels.get(self.source_selection_group.checkedId())
+        is_preprocessed = bool(active_panel and (active_panel.get_panel_config() or {}).get("panel_type") == "merge_preprocessed")
+        if self.merge_strategy_combo.currentData() == MERGE_STRATEGY_NARROW and (self.is_batch_running or not is_preprocessed):
+            wide_view = get_wide_view_name(self.selected_cohort_table)
+            self.update_execution_log(f"成功将 '{desc}' 写入特征表，并重新生成宽视图 {wide_view}。")
+            QMessageBox.information(self, "合并成功",
+                                    f"已将 '{desc}' 写入独立特征表，队列表 {self.selected_cohort_table} 未被修改。\n"
+                                    f"“5. 数据预览与导出”页面选择该队列表时会自动读取宽视图 {wide_view}。")
+        else:
+            self.update_execution_log(f"成功向表 {self.selected_cohort_table} 添加/更新与 '{desc}' 相关的列。")
+            QMessageBox.information(self, "合并成功", 
+                                    f"已成功向表 {self.selected_cohort_table} 添加/更新列。\n"
+                                    "您可以前往“5. 数据预览与导出”页面刷新并查看更新后的数据表。")
+        if self.is_batch_running:
+            self.is_batch_running = False
+            self.clear_batch_queue()
         self.prepare_for_long_operation(False)
 
     @Slot()
@@ -609,6 +1144,8 @@ class SpecialDataMasterTab(QWidget):
             QMessageBox.critical(self, "合并失败", f"执行合并SQL失败: {error_message}")
         else:
             QMessageBox.information(self, "操作取消", "数据合并操作已取消。")
+        self.is_batch_running = False
+        self.is_shadow_preparation_running = False
         self.prepare_for_long_operation(False)
 
 # --- [新增] 配置保存与加载逻辑 ---
@@ -642,7 +1179,8 @@ class SpecialDataMasterTab(QWidget):
             "panel_name": active_panel.get_friendly_source_name(),
             "base_new_column_name": self.new_column_name_input.text(),
             "cohort_table": self.selected_cohort_table, # 记录下来，但加载时不强制要求完全一致
-            "panel_config": panel_config
+            "panel_config": panel_config,
+            "time_window_spec": self._get_time_window_spec()
         }
 
         # 弹出文件保存对话框
@@ -680,6 +1218,16 @@ class SpecialDataMasterTab(QWidget):
                 self.new_column_name_input.setText(data["base_new_column_name"])
                 self.user_manually_edited_col_name = True # 防止自动覆盖
 
+            # 恢复自定义相对时间窗口 (旧版本配置中没有此项)
+            saved_spec = data.get("time_window_spec")
+            self.time_window_spec_group.setChecked(bool(saved_spec))
+            if saved_spec:
+                anchor_idx = self.time_anchor_combo.findData(saved_spec.get("anchor"))
+                if anchor_idx != -1: self.time_anchor_combo.setCurrentIndex(anchor_idx)
+                self.window_start_spin.setValue(float(saved_spec.get("start_hours", 0)))
+                self.window_end_spin.setValue(float(saved_spec.get("end_hours", 72)))
+                self.bin_width_spin.setValue(float(saved_spec.get("bin_hours", 0)))
+
             # 3. 切换到正确的面板
             panel_id = data.get("panel_id")
             if panel_id is not None:
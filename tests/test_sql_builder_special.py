@@ -0,0 +1,158 @@
+# --- START OF FILE tests/test_sql_builder_special.py ---
+"""
+专项数据 SQL 构建器测试 (离线，不需要数据库连接)。
+
+对两个数据库画像的每个数据源面板：在面板上选中项目与全部输出后取得 get_panel_config()，
+再用 build_special_data_sql(for_execution=False) 生成预览 SQL，检查项目过滤的形式：
+整数与 bpchar 项目列使用可走索引的 `列 = ANY(%s::类型[])`；text/varchar 名称列 (值可能带首尾空白)
+保留 TRIM(CAST(列 AS TEXT)) 比较；通配符模式退回 TRIM(CAST(列 AS TEXT)) ILIKE。
+另检查记忆化版本只缓存预览构建，执行计划每次重新构建。
+"""
+import os
+
+import pytest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+QtWidgets = pytest.importorskip("PySide6.QtWidgets")
+QtCore = pytest.importorskip("PySide6.QtCore")
+
+from db_profiles.eicu.profile import EICUProfile
+from db_profiles.mimic_iv.profile import MIMICIVProfile
+import sql_logic.sql_builder_special as sql_builder_special
+from sql_logic.build_memo import BuildMemo
+from sql_logic.sql_builder_special import (INTEGER_ITEM_ID_TYPES, PADDING_INSENSITIVE_ITEM_ID_TYPES,
+                                           build_special_data_sql, build_special_data_sql_memoized)
+from sql_logic.sql_renderer import render_sql
+
+# 各原生类型下用于测试的项目 ID
+SAMPLE_ITEM_IDS = {
+    "integer": ["220045", "220050"],
+    "bpchar": ["4019", "I10"],
+    "text": ["aspirin", "heparin"],
+}
+PROFILES = [MIMICIVProfile(), EICUProfile()]
+_created_panels = []
+
+
+@pytest.fixture(scope="module")
+def qt_app():
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    yield app
+    # 在解释器退出前销毁面板，避免 Qt 对象在垃圾回收阶段析构
+    while _created_panels:
+        _created_panels.pop().deleteLater()
+    app.processEvents()
+
+
+def _item_panel_cases():
+    cases = []
+    for profile in PROFILES:
+        for display_name, panel_class in profile.get_source_panels():
+            cases.append(pytest.param(profile, panel_class, id=f"{profile.get_display_name()}-{panel_class.__name__}"))
+    return cases
+
+
+def _build_panel_config(profile, panel_class, item_ids_by_type):
+    """实例化面板并选中全部输出；面板没有项目列表 (如预处理表合并) 时返回 None。"""
+    panel = panel_class(lambda: None, lambda: profile)
+    _created_panels.append(panel)
+    if not hasattr(panel, "item_list"):
+        return None
+    panel.populate_panel_if_needed()
+    if hasattr(panel, "value_agg_widget"):
+        panel.value_agg_widget.set_selected_methods({key: True for key in panel.value_agg_widget.get_selected_methods()})
+    if hasattr(panel, "event_output_widget"):
+        panel.event_output_widget.set_selected_outputs({key: True for key in panel.event_output_widget.get_selected_outputs()})
+
+    # 部分面板在没有选中项目时返回空配置，先用占位 ID 取得项目列
+    panel.get_selected_item_ids = lambda: ["1"]
+    probe_config = panel.get_panel_config() or {}
+    id_column = probe_config.get("item_id_column_in_event_table")
+    native_type = profile.get_item_id_column_type(probe_config.get("source_event_table"), id_column) if id_column else None
+    panel.get_selected_item_ids = lambda: list(item_ids_by_type(native_type))
+    return panel.get_panel_config(), native_type
+
+
+def _build_preview(profile, config):
+    sql_obj, _, params, _ = build_special_data_sql(
+        f"{profile.get_cohort_table_schema()}.test_cohort", "test_feature", config, profile, for_execution=False
+    )
+    assert sql_obj is not None, "预览 SQL 构建失败"
+    return render_sql(sql_obj), params
+
+
+@pytest.mark.parametrize("profile, panel_class", _item_panel_cases())
+def test_item_filter_uses_index_compatible_predicate(qt_app, profile, panel_class):
+    built = _build_panel_config(profile, panel_class, lambda native_type: SAMPLE_ITEM_IDS.get(native_type, ["1"]))
+    if built is None:
+        pytest.skip("面板没有项目列表")
+    config, native_type = built
+    if not config.get("item_id_column_in_event_table"):
+        pytest.skip("面板不按项目列过滤")
+    assert native_type, f"画像未声明 {config['source_event_table']}.{config['item_id_column_in_event_table']} 的原生类型"
+
+    sql_text, params = _build_preview(profile, config)
+    if native_type in INTEGER_ITEM_ID_TYPES | PADDING_INSENSITIVE_ITEM_ID_TYPES:
+        assert f"= ANY(%s::{native_type}[])" in sql_text
+        assert "TRIM(CAST(" not in sql_text
+        assert any(isinstance(p, list) and len(p) == 2 for p in params)
+    else:
+        assert "= ANY(%s::" not in sql_text
+        assert "TRIM(CAST(" in sql_text and " IN %s" in sql_text
+        assert tuple(SAMPLE_ITEM_IDS[native_type]) in params
+
+
+@pytest.mark.parametrize("profile, panel_class", _item_panel_cases())
+def test_padded_text_item_id_keeps_trim_comparison(qt_app, profile, panel_class):
+    """名称列中存有首尾带空白的值时，面板选中的 ID 已去除空白，比较时必须对列做 TRIM 才能匹配。"""
+    built = _build_panel_config(profile, panel_class, lambda native_type: ["1"])
+    if built is None or not built[0].get("item_id_column_in_event_table"):
+        pytest.skip("面板不按项目列过滤")
+    _, native_type = built
+    if native_type in INTEGER_ITEM_ID_TYPES | PADDING_INSENSITIVE_ITEM_ID_TYPES:
+        pytest.skip("项目列的比较不受首尾空白影响")
+
+    panel = _created_panels[-1]
+    del panel.get_selected_item_ids  # 恢复 BaseSourceConfigPanel 的实现 (对选中值 strip)
+    padded_item = QtWidgets.QListWidgetItem("aspirin")
+    padded_item.setData(QtCore.Qt.ItemDataRole.UserRole, ("  aspirin ", "aspirin"))
+    panel.item_list.addItem(padded_item)
+    padded_item.setSelected(True)
+    config = panel.get_panel_config()
+    assert config.get("selected_item_ids") == ["aspirin"]
+
+    sql_text, params = _build_preview(profile, config)
+    assert "= ANY(%s::" not in sql_text
+    assert f'TRIM(CAST("evt"."{config["item_id_column_in_event_table"]}" AS TEXT)) = %s' in sql_text
+    assert "aspirin" in params
+
+
+@pytest.mark.parametrize("profile, panel_class", _item_panel_cases())
+def test_wildcard_item_filter_falls_back_to_text_match(qt_app, profile, panel_class):
+    built = _build_panel_config(profile, panel_class, lambda native_type: ["22%"])
+    if built is None or not built[0].get("item_id_column_in_event_table"):
+        pytest.skip("面板不按项目列过滤")
+    config, _ = built
+
+    sql_text, params = _build_preview(profile, config)
+    assert "TRIM(CAST(" in sql_text and "ILIKE %s" in sql_text
+    assert "= ANY(%s::" not in sql_text
+    assert "22%" in params
+
+
+def test_memoized_build_caches_previews_only(qt_app, monkeypatch):
+    profile = MIMICIVProfile()
+    panel_class = next(cls for _, cls in profile.get_source_panels() if cls.__name__ == "LabeventsConfigPanel")
+    config, _ = _build_panel_config(profile, panel_class, lambda native_type: SAMPLE_ITEM_IDS["integer"])
+    memo = BuildMemo(max_entries=8)
+    monkeypatch.setattr(sql_builder_special, "_special_data_build_memo", memo)
+    build_args = (f"{profile.get_cohort_table_schema()}.test_cohort", "test_feature", config)
+
+    build_special_data_sql_memoized(*build_args, profile, for_execution=False)
+    # 同类同名的另一个画像实例命中同一条目 (键不依赖 id())
+    build_special_data_sql_memoized(*build_args, MIMICIVProfile(), for_execution=False)
+    assert memo.stats() == (1, 1, 1)
+
+    steps, signal_type, _, _ = build_special_data_sql_memoized(*build_args, profile, for_execution=True)
+    assert signal_type == "execution_list" and steps
+    assert memo.stats() == (1, 1, 1), "执行计划不应进入记忆化缓存"
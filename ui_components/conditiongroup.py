@@ -1,8 +1,8 @@
 # --- START OF PROPOSED MODIFICATION FOR conditiongroup.py ---
 from PySide6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLineEdit, QPushButton, QComboBox, QLabel, QFrame, QGroupBox)
 from PySide6.QtCore import Qt, Signal
-import psycopg2 # 需要导入
 from psycopg2 import sql as pgsql # 确保 pgsql 被正确导入和使用
+from sql_logic.sql_renderer import render_composable
 import re # re is not used in this file from the provided snippet, but good to keep if other parts use it.
 
 class ConditionGroupWidget(QWidget):
@@ -221,38 +221,6 @@ class ConditionGroupWidget(QWidget):
         if not self._block_signals:
              self.condition_changed.emit()
 
-    def _build_sql_string_fallback(self, sql_object) -> str:
-        """
-        Internal helper to convert psycopg2.sql objects to string without a db context.
-        This is a simplified version and might not handle all edge cases (e.g., complex Literals).
-        """
-        parts = []
-        def to_list_recursive(obj_to_convert, out_list):
-            if isinstance(obj_to_convert, pgsql.Composed):
-                for sub_item_in_composed in obj_to_convert:
-                    to_list_recursive(sub_item_in_composed, out_list)
-            elif isinstance(obj_to_convert, pgsql.SQL):
-                out_list.append(obj_to_convert.string)
-            elif isinstance(obj_to_convert, pgsql.Identifier):
-                temp_quoted_list_for_identifier = []
-                for s_part_from_identifier in obj_to_convert.strings:
-                    escaped_s_part = s_part_from_identifier.replace('"', '""')
-                    temp_quoted_list_for_identifier.append(f'"{escaped_s_part}"')
-                out_list.append(".".join(temp_quoted_list_for_identifier))
-            elif isinstance(obj_to_convert, pgsql.Literal):
-                try:
-                    out_list.append(str(obj_to_convert))
-                except Exception:
-                    out_list.append(f"'LITERAL_CONVERSION_ERROR:{obj_to_convert!r}'")
-            elif isinstance(obj_to_convert, str):
-                 out_list.append(obj_to_convert)
-            else: # Unknown type, use its string representation
-                out_list.append(str(obj_to_convert))
-        
-        to_list_recursive(sql_object, parts)
-        return "".join(parts)
-
-
     def get_condition(self):
         cond_parts = []
         params = []
@@ -275,6 +243,8 @@ class ConditionGroupWidget(QWidget):
                 param_val = None
 
                 try:
+                    # 文本匹配统一写成 CAST(列 AS TEXT) ILIKE/=，与检索加速的三元组表达式索引
+                    # (见 sql_logic/search_acceleration.py) 完全一致，规划器才能使用该索引
                     if kw_operator_text == "包含":
                         sql_part = pgsql.SQL("CAST({fld} AS TEXT) ILIKE %s").format(fld=field_ident)
                         param_val = f"%{kw_text}%"
@@ -335,30 +305,8 @@ class ConditionGroupWidget(QWidget):
                     composed_parts_with_ops.append(logic_operator_sql)
             full_sql_composed = pgsql.Composed(composed_parts_with_ops)
         
-        dummy_conn = None
-        try:
-            dsn_ = ""
-            try:
-                dsn_ = psycopg2.connect("").dsn
-                parsed_dsn = psycopg2.extensions.parse_dsn(dsn_)
-                user = parsed_dsn.get('user')
-                dbname = parsed_dsn.get('dbname','postgres') 
-                dummy_conn_string = f"dbname='{dbname}' user='{user if user else ''}'" 
-            except Exception: 
-                dummy_conn_string = "dbname='postgres'" 
-
-            dummy_conn = psycopg2.connect(dummy_conn_string)
-            return full_sql_composed.as_string(dummy_conn), params
-        except psycopg2.Error:
-            try:
-                sql_string = self._build_sql_string_fallback(full_sql_composed)
-                return sql_string, params
-            except Exception as e_fallback:
-                print(f"Error in fallback SQL generation: {e_fallback}")
-                return f"-- Fallback SQL Generation Error: {e_fallback} --", params
-        finally:
-            if dummy_conn:
-                dummy_conn.close()
+        # 离线渲染为模板字符串 (保留 %s 占位符)，不再为渲染标识符临时连接数据库
+        return render_composable(full_sql_composed), params
                 
     def has_valid_input(self): 
         for kw_data in self.keywords:
@@ -369,6 +317,14 @@ class ConditionGroupWidget(QWidget):
                 return True
         return False
 
+    def get_used_fields(self) -> set:
+        """返回条件中实际使用 (关键词非空) 的字段名集合，含子组。"""
+        fields = {kw_data["field_combo"].currentData() for kw_data in self.keywords
+                  if kw_data["field_combo"].currentData() and kw_data["input"].text().strip()}
+        for group in self.child_groups:
+            fields |= group.get_used_fields()
+        return fields
+
     def get_state(self) -> dict:
         state = {
             "logic": self.logic_combo.currentText(),